@@ -32,9 +32,8 @@ class AppointmentService(Component):
         """
         Buscar Agendamiento: máximo 80 registros
         """
-        appointment_ids = self.env["calendar.appointment"].sudo().search([
-            ('appointment_code','like',name)
-        ], limit=80)
+        Appointment = self.env["calendar.appointment"].sudo()
+        appointment_ids = Appointment.search(Appointment._search_text_domain(name), limit=80)
 
         if appointment_ids:
             rows = []
@@ -47,6 +46,30 @@ class AppointmentService(Component):
             return res
 
 
+    def create_many(self, appointments):
+        """
+        Crear varios Agendamientos en una sola solicitud: máximo 1000 registros
+        """
+        vals_list = [self._prepare_create_many_vals(values) for values in appointments]
+        # with the rights of the caller
+        appointment_ids = self.env["calendar.appointment"].create(vals_list)
+        rows = []
+        for appointment in appointment_ids:
+            rows.append({
+                "id": appointment.id,
+                "name": appointment.appointment_code,
+                "tag_number": appointment.tag_number or "",
+                "provisioning_state": appointment.provisioning_state or "",
+            })
+        return {"count": len(appointment_ids), "rows": rows}
+
+    def _prepare_create_many_vals(self, values):
+        vals = dict(values)
+        for key in ("partners_ids", "destination_ids"):
+            if key in vals:
+                vals[key] = [(6, 0, vals[key] or [])]
+        return vals
+
     def _get(self, _id):
         return self.env["calendar.appointment"].browse(_id)
 
@@ -184,6 +207,63 @@ class AppointmentService(Component):
     def _validator_return_create(self):
         return self._validator_return_get()
 
+    def _validator_create_many(self):
+        return {
+            "appointments": {
+                "type": "list",
+                "required": True,
+                "empty": False,
+                "maxlength": 1000,
+                "schema": {"type": "dict", "schema": self._validator_create_many_item()},
+            },
+        }
+
+    def _validator_create_many_item(self):
+        integer = {"type": "integer", "coerce": to_int, "required": False, "nullable": True}
+        string = {"type": "string", "required": False, "nullable": True}
+        return {
+            "appointment_type_id": {"type": "integer", "coerce": to_int, "required": True},
+            "calendar_datetime": {"type": "string", "required": True, "empty": False},
+            "process_number": {"type": "string", "required": True, "empty": False},
+            "calendar_duration": {"type": "float", "required": False, "nullable": True},
+            "room_id": integer,
+            "applicant_id": integer,
+            "class_id": integer,
+            "help_id": integer,
+            "partaker_type": integer,
+            "connection_type": integer,
+            "reception_id": integer,
+            "type": {"type": "string", "allowed": ["audience", "conference", "streaming"], "required": False},
+            "request_type": {"type": "string", "allowed": ["l", "r"], "required": False},
+            "platform": {"type": "string", "allowed": ["Teams", "Lifesize"], "required": False},
+            "state": {"type": "string", "allowed": ["draft", "open"], "required": False},
+            "request_date": string,
+            "reception_detail": string,
+            "observations": string,
+            "applicant_raw_name": string,
+            "coorganizer": string,
+            "partners_ids": {"type": "list", "schema": {"type": "integer", "coerce": to_int}, "required": False},
+            "destination_ids": {"type": "list", "schema": {"type": "integer", "coerce": to_int}, "required": False},
+        }
+
+    def _validator_return_create_many(self):
+        return {
+            "count": {"type": "integer", "required": True},
+            "rows": {
+                "type": "list",
+                "required": True,
+                "schema": {
+                    "type": "dict",
+                    "schema": {
+                        "id": {"type": "integer", "required": True},
+                        "name": {"type": "string", "required": True},
+                        "tag_number": {"type": "string", "required": True},
+                        "provisioning_state": {"type": "string", "required": True},
+                    },
+                },
+            },
+        }
+
     def _validator_update(self):
         res = self._validator_create()
         for key in res:
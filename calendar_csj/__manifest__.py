@@ -14,7 +14,7 @@
     # Check https://github.com/odoo/odoo/blob/13.0/odoo/addons/base/data/ir_module_category_data.xml
     # for the full list
     'category': 'Marketing/Online Appointment',
-    'version': '13.1',
+    'version': '13.1.2',
 
     # any module necessary for this one to work correctly
     'depends': ['website_calendar','contacts','base_address_city','event', 'calendar', 'portal'],
@@ -22,10 +22,13 @@
     # always loaded
     'data': [
         'security/ir.model.access.csv',
+        'security/calendar_security.xml',
         'data/res_country.xml',
         'data/res_partner.xml',
         'data/mail_template.xml',
         'data/calendar_appointment.xml',
+        'data/calendar_appointment_export.xml',
+        'data/calendar_appointment_outbox.xml',
         'views/res_judged_view.xml',
         'views/res_entity_view.xml',
         'views/res_specialty_view.xml',
@@ -44,6 +47,8 @@
         'views/calendar_event_view.xml',
         'views/process_process_view.xml',
         'views/calendar_recording_notification_view.xml',
+        'views/calendar_appointment_export_view.xml',
+        'views/calendar_appointment_outbox_view.xml',
         'views/template.xml',
         'report/calendar_appointment.xml',
     ],
@@ -12,11 +12,16 @@ from odoo.tools import html2plaintext, DEFAULT_SERVER_DATETIME_FORMAT as dtf
 from odoo.tools.misc import get_lang
 from odoo.addons.website_calendar.controllers.main import WebsiteCalendar
 from odoo.exceptions import ValidationError
+from werkzeug.http import http_date
+from werkzeug.wrappers import Response
+from ..tools import normalize_text
 import json
 from odoo import SUPERUSER_ID
 import logging
 _logger = logging.getLogger(__name__)
 
+CITY_SUGGESTION_MAX_AGE = 3600
+
 
 class WebsiteCalendarInherit(WebsiteCalendar):
     @http.route([
@@ -239,33 +244,7 @@ class WebsiteCalendarInherit(WebsiteCalendar):
 
         if types:
             if types[0] == 'A':
-                if len(process_number) != 23:
-                    return request.render("website_calendar.appointment_form", {
-                        'appointment_type': appointment_type,
-                        'message': 'process_longer_failed',
-                        'date_start': date_start,
-                        'duration': duration,
-                        'types': types,
-                    })
-
-                city = request.env['res.entity'].sudo().search_city(process_number[0:5])
-                entity = request.env['res.entity'].sudo().search_entity(process_number[5:7])
-                speciality = request.env['res.entity'].sudo().search_speciality(process_number[7:9])
-                # judged = request.env['res.entity'].sudo().search_judged(process_number[9:12])
-                rad_year = process_number[12:16]
-                year = datetime.now()
-                year_limit = int(year.strftime("%Y")) + 1
-                # if city and entity and speciality and judged:
-                if city and entity and speciality:
-                    if not int(rad_year) in range(1900,year_limit):
-                        return request.render("website_calendar.appointment_form", {
-                            'appointment_type': appointment_type,
-                            'message': 'process_longer_failed',
-                            'date_start': date_start,
-                            'duration': duration,
-                            'types': types,
-                        })
-                else:
+                if request.env['res.entity'].sudo().decode_process_number(process_number)['error']:
                     return request.render("website_calendar.appointment_form", {
                         'appointment_type': appointment_type,
                         'message': 'process_longer_failed',
@@ -419,33 +398,26 @@ class WebsiteCalendarInherit(WebsiteCalendar):
 
 class OdooWebsiteSearchAppointment(http.Controller):
 
+    def _appointment_suggestions(self, post, city_id=None, recording_only=False):
+        partner = request.env.user.partner_id
+        judged_id = None
+        if partner.appointment_type != 'scheduler':
+            # only the agendas of their own judged
+            judged_id = partner.parent_id.id
+            city_id = None
+        limit = int(post.get('limit') or 30)
+        suggestions = request.env['calendar.appointment.type'].sudo().search_suggestion(
+            post.get('query') or '', city_id=city_id, judged_id=judged_id,
+            recording_only=recording_only, limit=limit)
+        return [{'cita': name, 'id': appointment_type_id} for appointment_type_id, name in suggestions]
+
     @http.route([
         '/search/suggestion',
         '/search/suggestion/<int:city_id>'], type='http', auth="user", website=True)
-    def search_suggestion(self, city_id, **post):
+    def search_suggestion(self, city_id=None, **post):
         cita = []
         if post:
-            partner = request.env.user.partner_id
-            query = post.get('query').lower()
-            for suggestion in query.split(" "):
-                judged_id = partner.parent_id
-                if partner.appointment_type != 'scheduler':
-                    suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search_calendar(judged_id.id)
-                else:
-                    if city_id: #city selected
-                        suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search([('city_id','=',city_id),('name','!=',False)])
-                    else:
-                        suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search([])
-                for appointment_type in suggested_appointment_types:
-                    if len(cita) > 0 and appointment_type.id in [line.get('id') for line in cita]:
-                        continue
-                    city = appointment_type.judged_id.city_id.name if \
-                        appointment_type.judged_id and appointment_type.judged_id.city_id else '404'
-                    name = city + '-' + appointment_type.name
-                    cita.append({
-                        'cita': name,
-                        'id': appointment_type.id,
-                        })
+            cita = self._appointment_suggestions(post, city_id)
         data = {}
         data['status'] = True,
         data['error'] = None,
@@ -456,32 +428,10 @@ class OdooWebsiteSearchAppointment(http.Controller):
     @http.route([
         '/search/suggestion/recording/add_content',
         '/search/suggestion/recording/add_content/<int:city_id>'], type='http', auth="user", website=True)
-    def search_suggestion_recording_add(self, city_id, **post):
+    def search_suggestion_recording_add(self, city_id=None, **post):
         cita = []
         if post:
-            partner = request.env.user.partner_id
-            query = post.get('query').lower()
-            for suggestion in query.split(" "):
-                judged_id = partner.parent_id
-                if partner.appointment_type != 'scheduler':
-                    suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search_calendar(judged_id.id)
-                else:
-                    if city_id: #city selected
-                        suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search([('city_id','=',city_id),('name','!=',False)])
-                    else:
-                        suggested_appointment_types = request.env['calendar.appointment.type'].sudo().search([])
-                for appointment_type in suggested_appointment_types:
-                    if len(cita) > 0 and appointment_type.id in [line.get('id') for line in cita]:
-                        continue
-                    if not appointment_type.judged_id.recording_add_ok:
-                        continue
-                    city = appointment_type.judged_id.city_id.name if \
-                        appointment_type.judged_id and appointment_type.judged_id.city_id else '404'
-                    name = city + '-' + appointment_type.name
-                    cita.append({
-                        'cita': name,
-                        'id': appointment_type.id,
-                        })
+            cita = self._appointment_suggestions(post, city_id, recording_only=True)
         data = {}
         data['status'] = True,
         data['error'] = None,
@@ -493,41 +443,52 @@ class OdooWebsiteSearchAppointment(http.Controller):
 class OdooWebsiteSearchCity(http.Controller):
 
     @http.route(['/search/suggestion_city'], type='http', auth="user", website=True)
-    def search_suggestion(self, city_id=None, **post):
+    def search_suggestion(self, city_id=None, query='', limit=50, offset=0, **post):
+        City = request.env['res.city'].sudo()
+        etag, last_modified = City._get_suggestion_index()[1:]
+        # the city table only changes with the data, let the browser keep the answers
+        etag = '"%s-%s-%s-%s"' % (etag, normalize_text(query), limit, offset)
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('Cache-Control', 'private, max-age=%s' % CITY_SUGGESTION_MAX_AGE),
+            ('ETag', etag),
+        ]
+        if last_modified:
+            headers.append(('Last-Modified', http_date(last_modified)))
+        httprequest = request.httprequest
+        if httprequest.if_none_match:
+            not_modified = etag.strip('"') in httprequest.if_none_match
+        else:
+            since = httprequest.if_modified_since
+            not_modified = bool(since and last_modified and last_modified.replace(microsecond=0) <= since.replace(tzinfo=None))
+        if not_modified:
+            return Response(status=304, headers=headers)
+
         cities = []
-        if post:
-            query = post.get('query').lower()
-            for suggestion in query.split(" "):
-                suggested_cities = request.env['res.city'].sudo().search([])
-                for city in suggested_cities:
-                    #if len(cities) > 0 and city.id in [line.get('id') for line in cities]:
-                    #    continue
-                    cities.append({
-                        'city': '%s - %s' % (city.name, city.state_id.name),
-                        'id': city.id,
-                        })
+        for suggested_id, name in City.search_suggestion(query, limit=int(limit), offset=int(offset)):
+            cities.append({
+                'city': name,
+                'id': suggested_id,
+                })
         data = {}
         data['status'] = True,
         data['error'] = None,
         data['data'] = {'cities': cities}
-        return json.dumps(data)
+        return request.make_response(json.dumps(data), headers=headers)
 
 
 class OdooWebsiteSearchSolicitante(http.Controller):
 
     @http.route(['/search/suggestion2'], type='http', auth="user", website=True)
-    def search_suggestion(self, **post):
+    def search_suggestion(self, query='', limit=30, offset=0, **post):
         cita = []
-        if post:
-            for suggestion in post.get('query').split(" "):
-                suggested_companies = request.env['res.partner'].sudo().search_company_type()
-                for companie in suggested_companies:
-                    city = companie.city_id.name if companie.city_id else '404'
-                    name = city + '-' + companie.name
-                    cita.append({
-                        'cita': name,
-                        'id': companie.id,
-                        })
+        if query:
+            partners = request.env['res.partner'].search_suggestion(query, 'judged', limit=min(int(limit), 100), offset=int(offset))
+            for companie in partners:
+                cita.append({
+                    'cita': '%s-%s' % (companie['city'] or '404', companie['name']),
+                    'id': companie['id'],
+                    })
         data = {}
         data['status'] = True,
         data['error'] = None,
@@ -537,21 +498,31 @@ class OdooWebsiteSearchSolicitante(http.Controller):
 class OdooWebsiteSearchDestino(http.Controller):
 
     @http.route(['/search/destino'], type='http', auth="user", website=True)
-    def search_suggestion(self, **post):
-        suggestion_list = []
+    def search_suggestion(self, query='', limit=30, offset=0, **post):
         destino = []
-        if post:
-            for suggestion in post.get('query').split(" "):
-                suggested_partners = request.env['res.partner'].sudo().search([('company_type','=','company')])
-                #suggested_partners = request.env['res.partner'].sudo().search([('company_type','in',['company','judged'])])
-                read_partners = suggested_partners.read(['name', 'id', 'code'])
-                suggestion_list += read_partners
-
-        for line in suggestion_list:
-            destino.append({'destino': line['name'], 'id': line['id']})
-        #logger.info(destino)
+        if query:
+            partners = request.env['res.partner'].search_suggestion(query, 'company', limit=min(int(limit), 100), offset=int(offset))
+            for line in partners:
+                destino.append({'destino': line['name'], 'id': line['id']})
         data = {}
         data['status'] = True,
         data['error'] = None,
         data['data'] = {'destino': destino}
         return json.dumps(data)
+
+
+class OdooWebsiteSearchPartner(http.Controller):
+
+    @http.route(['/search/partner'], type='json', auth="user", website=True)
+    def search_partner(self, query='', company_type='company', limit=30, offset=0, **kwargs):
+        """ Paginated partner suggestions: ``has_more`` tells whether a next page exists """
+        if company_type not in ('company', 'judged'):
+            raise ValidationError('Tipo de contacto %s no permitido.' % company_type)
+        limit = min(int(limit), 100)
+        rows = request.env['res.partner'].search_suggestion(query, company_type, limit=limit + 1, offset=int(offset))
+        return {
+            'rows': rows[:limit],
+            'offset': int(offset),
+            'limit': limit,
+            'has_more': len(rows) > limit,
+        }
@@ -7,12 +7,15 @@ from odoo.exceptions import AccessError, MissingError
 from odoo.http import content_disposition, request
 from odoo.addons.portal.controllers.portal import CustomerPortal, pager as portal_pager
 from odoo.tools import groupby as groupbyelem
+from ..models.calendar_appointment_portal import PORTAL_KEYSET_COLUMNS
 from odoo import models, fields, api
 from datetime import datetime,timedelta
 from dateutil.relativedelta import relativedelta
 from odoo.tools import html2plaintext, DEFAULT_SERVER_DATETIME_FORMAT as dtf
+import base64
 import pytz
 import io
+import tempfile
 from odoo.tools.misc import get_lang
 from babel.dates import format_datetime, format_date
 
@@ -27,7 +30,6 @@ from werkzeug import urls
 from werkzeug.wsgi import wrap_file
 from werkzeug.urls import url_encode
 from datetime import datetime, timedelta
-import xlsxwriter
 
 from odoo.osv.expression import OR
 
@@ -37,6 +39,29 @@ _logger = logging.getLogger(__name__)
 
 class CustomerPortal(CustomerPortal):
 
+    def _appointments_xlsx_response(self, domain, order, layout):
+        """ Report of the appointments as xlsx, built in a temporary file
+            and sent by blocks so the worker memory does not grow with it. """
+        output = tempfile.TemporaryFile()
+        request.env['calendar.appointment'].sudo()._export_xlsx(output, domain, order=order, layout=layout)
+        size = output.tell()
+        output.seek(0)
+        return werkzeug.wrappers.Response(
+            wrap_file(request.httprequest.environ, output),
+            headers=[
+                ('Content-Type', 'application/vnd.ms-excel'),
+                ('Content-Disposition', content_disposition('Reporte_Agendamientos.xlsx')),
+                ('Content-Length', size),
+            ],
+            direct_passthrough=True)
+
+    def _appointments_xlsx_sync_limit(self):
+        """ Bigger reports are built by the export cron instead of the request,
+            the public user always gets the report directly. """
+        if request.env.user._is_public():
+            return float('inf')
+        return int(request.env['ir.config_parameter'].sudo().get_param('calendar_csj.export_sync_limit', 5000))
+
     def _prepare_portal_layout_values(self):
         values = super(CustomerPortal, self)._prepare_portal_layout_values()
         # when partner is not scheduler they can only view their own
@@ -46,7 +71,7 @@ class CustomerPortal(CustomerPortal):
         if partner.appointment_type != 'scheduler':
             domain += [('partner_id', '=', judged_id.id)]
 
-        values['appointment_count'] = request.env['calendar.appointment'].sudo().search_count(domain)
+        values['appointment_count'] = request.env['calendar.appointment'].sudo()._portal_count(domain)[0]
 
         return values
 
@@ -72,7 +97,7 @@ class CustomerPortal(CustomerPortal):
 
 
     @http.route(['/my/appointments', '/my/appointments/page/<int:page>'], type='http', auth="public", website=True)
-    def portal_my_appointments(self, page=1, date_begin=None, time_begin=None, date_end=None, time_end=None, sortby=None, filterby=None, search=None, search_in='appointment_code', groupby='none', export='none', **kw):
+    def portal_my_appointments(self, page=1, date_begin=None, time_begin=None, date_end=None, time_end=None, sortby=None, filterby=None, search=None, search_in='appointment_code', groupby='none', export='none', after=None, **kw):
         values = self._prepare_portal_layout_values()
         #return request.render("calendar_csj.portal_my_appointments", values)
         if request.env.user.id == 4:
@@ -160,7 +185,9 @@ class CustomerPortal(CustomerPortal):
             ]
 
         # search
-        if search and search_in:
+        if search and search_in == 'all':
+            domain += request.env['calendar.appointment']._search_text_domain(search)
+        elif search and search_in:
             search_domain = []
             if search_in in ('appointment_code', 'all'):
                 search_domain = OR([search_domain, [('appointment_code', 'ilike', search)]])
@@ -182,13 +209,10 @@ class CustomerPortal(CustomerPortal):
                 search_domain = OR([search_domain, [('indicted_text', 'ilike', search)]])
             if search_in in ('applicant_email', 'all'):
                 search_domain = OR([search_domain, [('applicant_email', 'ilike', search)]])
-            domain += search_domain
             if search_in in ('lifesize_meeting_ext', 'all'):
                 search_domain = OR([search_domain, [('lifesize_meeting_ext', 'ilike', search)]])
-            domain += search_domain
             if search_in in ('name', 'all'):
                 search_domain = OR([search_domain, [('name', 'ilike', search)]])
-            domain += search_domain
             if search_in in ('state', 'all'):
                 search_domain = OR([search_domain, [('state', 'ilike', search)]])
             domain += search_domain
@@ -199,215 +223,41 @@ class CustomerPortal(CustomerPortal):
         if partner.appointment_type != 'scheduler':
             domain += [('partner_id', '=', judged_id.id)]
 
-        appointment_count = request.env['calendar.appointment'].search_count(domain)
-        #appointment_count = 20
-
-        # pager
-        """
-        pager = portal_pager(
-            url="/my/appointments",
-            url_args={'date_begin': date_begin, 'time_begin': time_begin, 'date_end': date_end, 'time_end': time_end, 'search': search, 'sortby': sortby, 'filterby': filterby, 'search_in': search_in},
-            total=appointment_count,
-            page=page,
-            step=self._items_per_page
-        )
-        """
-        if groupby == 'state':
-            order = "state, %s" % order
-        appointments = request.env['calendar.appointment'].sudo().search(domain, order=order, limit=20)
-        if groupby == 'state':
-            grouped_appointments = [request.env['calendar.appointment'].sudo().concat(*g) for k, g in groupbyelem(appointments, itemgetter('state'))]
-        else:
-            grouped_appointments = [appointments]
-
-        # content according to pager and archive selected
-        appointments = request.env['calendar.appointment'].search(domain, order=order, limit=20)
-        #request.session['my_appointments_history'] = appointments.ids[:100]
+        Appointment = request.env['calendar.appointment']
+        appointment_count, count_approximate = Appointment._portal_count(domain)
 
         # excel generation
         # Create a workbook and add a worksheet.
         #if export == 'on' and date_begin and date_end:
         if export == 'true' and request.env.user.has_permission_download_report:
-            appointments_total = request.env['calendar.appointment'].sudo().search(domain, order=order, limit=20)
-            response = request.make_response(
-                None,
-                headers=[('Content-Type', 'application/vnd.ms-excel'), ('Content-Disposition', content_disposition('Reporte_Agendamientos.xlsx'))
-                ]
+            if count_approximate:
+                appointment_count = Appointment.search_count(domain)
+            if appointment_count > self._appointments_xlsx_sync_limit():
+                request.env['calendar.appointment.export']._create_from_domain(domain, order=order, layout='private')
+                return request.redirect('/my/appointments/exports')
+            return self._appointments_xlsx_response(domain, order, 'private')
+
+        # pager: the sortings on a key are paginated by seeking after the
+        # last row of the previous page, the others by offset
+        pager = next_cursor = None
+        if groupby == 'none' and sortby in PORTAL_KEYSET_COLUMNS:
+            appointments, next_cursor = Appointment.sudo()._portal_search_page(domain, sortby, after=after, limit=self._items_per_page)
+        else:
+            pager = portal_pager(
+                url="/my/appointments",
+                url_args={'date_begin': date_begin, 'time_begin': time_begin, 'date_end': date_end, 'time_end': time_end, 'search': search, 'sortby': sortby, 'filterby': filterby, 'search_in': search_in, 'groupby': groupby},
+                total=appointment_count,
+                page=page,
+                step=self._items_per_page
             )
-            output = io.BytesIO()
-            workbook = xlsxwriter.Workbook(output, {'in_memory': True, 'default_date_format': 'yyyy/mm/dd'})
-            sheet = workbook.add_worksheet('Agendamientos')
-            cell_format = workbook.add_format()
-            head = workbook.add_format()
-            txt = workbook.add_format()
-            dateformat = workbook.add_format()
-            timeformat = workbook.add_format()
-            datetimeformat = workbook.add_format()
-
-            workbook.formats[0].set_font_size(8)
-
-            sheet.set_column('A:A', 20)
-            sheet.set_column('B:B', 40)
-            sheet.set_column('C:C', 20)
-            sheet.set_column('C:C', 20)
-            sheet.set_column('D:D', 20, dateformat)
-            sheet.set_column('E:E', 20)
-            sheet.set_column('F:F', 20)
-            sheet.set_column('G:G', 60)
-            sheet.set_column('H:H', 20)
-            sheet.set_column('I:I', 20)
-            sheet.set_column('J:J', 20)
-            sheet.set_column('K:K', 20)
-            sheet.set_column('L:L', 50)
-            sheet.set_column('M:M', 50)
-            sheet.set_column('N:N', 20, dateformat)
-            sheet.set_column('O:O', 40)
-            sheet.set_column('P:P', 20)
-            sheet.set_column('Q:Q', 50)
-            sheet.set_column('R:R', 30)
-            sheet.set_column('S:S', 20)
-            sheet.set_column('T:T', 40)
-            sheet.set_column('U:U', 20)
-            sheet.set_column('V:V', 20)
-            sheet.set_column('W:W', 20)
-            sheet.set_column('X:X', 20)
-            sheet.set_column('Y:Y', 40, dateformat)
-            sheet.set_column('Z:Z', 20)
-            sheet.set_column('AA:AA', 50)
-            sheet.set_column('AB:AB', 20, dateformat)
-            sheet.set_column('AC:AC', 20)
-            sheet.set_column('AD:AD', 20, dateformat)
-            sheet.set_column('AE:AE', 20, timeformat)
-            #sheet.set_column('AF:AF', 20)
-            sheet.set_column('AF:AF', 20)
-            sheet.set_column('AG:AG', 60)
-            sheet.set_column('AH:AH', 60)
-            sheet.set_column('AI:AI', 20)
-            sheet.set_column('AJ:AJ', 40)
-            sheet.set_column('AK:AK', 20)
-            sheet.set_column('AL:AL', 40, datetimeformat)
-
-            #sheet.merge_range('B2:I3', 'REPORTE DE AGENDAMIENTOS', head)
-            sheet.write('A1', 'ID SOLICITUD', head)
-            sheet.write('B1', 'TIPO DE SOLICITUD', head)
-            sheet.write('C1', 'TIPO DE AUDIENCIA', head)
-            sheet.write('D1', 'FECHA DE REALIZACIÓN', head)
-            sheet.write('E1', 'HORA DE INICIO', head)
-            sheet.write('F1', 'CÓDIGO DESPACHO SOLICITANTE', head)
-            sheet.write('G1', 'DESPACHO SOLICITANTE', head)
-            sheet.write('H1', 'CIUDAD ORIGEN', head)
-            sheet.write('I1', 'DEPARTAMENTO ORIGEN', head)
-            sheet.write('J1', 'DESTINOS', head)
-            sheet.write('K1', 'MEDIO DE RECEPCIÓN', head)
-            sheet.write('L1', 'DETALLES MEDIO DE RECEPCIÓN', head)
-            sheet.write('M1', 'OBSERVACIONES', head)
-            sheet.write('N1', 'FECHA DE SOLICITUD', head)
-            sheet.write('O1', 'NOMBRE DEL SOLICITANTE', head)
-            sheet.write('P1', 'ESTADO', head)
-            sheet.write('Q1', 'CORREO SALIENTE', head)
-            sheet.write('R1', 'NÚMERO DE PROCESO', head)
-            sheet.write('S1', 'SALA', head)
-            sheet.write('T1', 'CORREO PARTICIPANTES', head)
-            sheet.write('U1', 'CELULAR', head)
-            sheet.write('V1', 'CLASE DE VIDEOCONFERENCIA', head)
-            sheet.write('W1', 'TIPO DE AUDIENCIA', head)
-            #sheet.write('X1', 'DECLARANTE', head)
-            #sheet.write('Y1', 'PROCESADO', head)
-            sheet.write('X1', 'FECHA AGENDAMIENTO', head)
-            sheet.write('Y1', 'USUARIO AGENDAMIENTO', head)
-            sheet.write('Z1', 'FECHA CIERRE', head)
-            sheet.write('AA1', 'USUARIO DE CIERRE', head)
-            sheet.write('AB1', 'FECHA FINAL', head)
-            sheet.write('AC1', 'HORA FINAL', head)
-            sheet.write('AD1', 'DESCRIPCION', head)
-            sheet.write('AE1', 'ETIQUETA', head)
-            #sheet.write('AF1', 'LINK DE GRABACIÓN', head)
-            sheet.write('AF1', 'LINK DE GRABACIÓN', head)
-            sheet.write('AG1', 'CREADO POR', head)
-            sheet.write('AH1', 'NOMBRE SALA LIFESIZE', head)
-            sheet.write('AI1', 'URL LIFESIZE', head)
-            sheet.write('AJ1', 'FECHA Y HORA DE REALIZACIÓN', head)
-            row = 2
-
-            for appointment in appointments_total:
-    ########## ##TRADUCCION ESTADOS ###################
-                if appointment.state == 'open':
-                    state_label='AGENDADO'
-                if appointment.state == 'realized':
-                    state_label='REALIZADA'
-                if appointment.state == 'unrealized':
-                    state_label='NO REALIZADA'
-                if appointment.state == 'assist_postpone':
-                    state_label='ASISTIDA Y APLAZADA'
-                if appointment.state == 'postpone':
-                    state_label='APLAZADA'
-                if appointment.state == 'assist_cancel':
-                    state_label='ASISTIDA Y CANCELADA'
-                if appointment.state == 'cancel':
-                    state_label='CANCELADO'
-                if appointment.state == 'draft':
-                    state_label='DUPLICADO'
-########## ##TRADUCIÓN TIPO AUDIENCIA ###################
-
-                if appointment.type == 'audience':
-                    type_label='AUDIENCIA'
-                if appointment.type == 'conference':
-                    type_label='VIDEO CONFERENCIA'
-                if appointment.type == 'streaming':
-                    type_label='STREAMING'
-
-                sheet.write('A'+str(row), appointment.appointment_code, cell_format)
-                sheet.write('B'+str(row), appointment.request_type_label, cell_format)
-                sheet.write('C'+str(row), type_label, cell_format)
-                sheet.write('D'+str(row), str(appointment.calendar_date), cell_format)
-                newstrtime = '{0:02.0f}:{1:02.0f}'.format(*divmod(appointment.calendar_time * 60, 60))
-                sheet.write('E'+str(row), newstrtime, cell_format)
-                sheet.write('F'+str(row), appointment.judged_only_code, cell_format)
-                sheet.write('G'+str(row), appointment.judged_only_name, cell_format)
-                sheet.write('H'+str(row), appointment.city_id.name.upper(), cell_format)
-                sheet.write('I'+str(row), appointment.country_state_id.name.upper(), cell_format)
-                sheet.write('J'+str(row), appointment.destination_ids_label, cell_format)
-                sheet.write('K'+str(row), appointment.reception_id.name, cell_format)
-                sheet.write('L'+str(row), appointment.reception_detail.upper(), cell_format)
-                sheet.write('M'+str(row), appointment.observations.upper(), cell_format)
-                sheet.write('N'+str(row), str(appointment.request_date), dateformat)
-                #sheet.write('O'+str(row), appointment.applicant_id.name.upper(), cell_format)
-                sheet.write('O'+str(row), appointment.applicant_raw_name.upper() if appointment.applicant_raw_name else '', cell_format)
-                sheet.write('P'+str(row), state_label, cell_format)
-                sheet.write('Q'+str(row), appointment.applicant_email, cell_format)
-                sheet.write('R'+str(row), appointment.process_number, cell_format)
-                sheet.write('S'+str(row), appointment.room_id_mame.upper() if appointment.room_id_mame else '', cell_format)
-                sheet.write('T'+str(row), appointment.partner_ids_label, cell_format)
-                sheet.write('U'+str(row), appointment.applicant_mobile, cell_format)
-                sheet.write('V'+str(row), appointment.class_id.name.upper(), cell_format)
-                sheet.write('W'+str(row), appointment.request_type.upper(), cell_format)
-                #sheet.write('X'+str(row), appointment.declarant_text.upper(), cell_format)
-                #sheet.write('Y'+str(row), appointment.indicted_text.upper(), cell_format)
-                sheet.write('X'+str(row), str(appointment.appointment_date), cell_format)
-                sheet.write('Y'+str(row), appointment.create_uid_login, cell_format)
-                sheet.write('Z'+str(row), str(appointment.appointment_close_date) if appointment.appointment_close_date else '', cell_format)
-                sheet.write('AA'+str(row), appointment.appointment_close_user_login if appointment.appointment_close_user_login else '', cell_format)
-                sheet.write('AB'+str(row), str(appointment.end_date) if appointment.end_date else '', cell_format)
-                newstrtime_end_hour = '{0:02.0f}:{1:02.0f}'.format(*divmod(appointment.end_hour * 60, 60))
-                sheet.write('AC'+str(row), str(newstrtime_end_hour) if newstrtime_end_hour else '', cell_format)
-                sheet.write('AD'+str(row), appointment.state_description.upper() if appointment.state_description else '', cell_format)
-                sheet.write('AE'+str(row), appointment.tag_number, cell_format)
-                #sheet.write('AF'+str(row), appointment.link_download if appointment.link_download and  else '', cell_format)
-                sheet.write('AF'+str(row), appointment.link_download_text if appointment.link_download_text else '', cell_format)
-                sheet.write('AG'+str(row), appointment.create_uid.login, cell_format)
-                sheet.write('AH'+str(row), appointment.name, cell_format)
-                sheet.write('AI'+str(row), appointment.lifesize_url, cell_format)
-                sheet.write('AJ'+str(row), str(appointment.calendar_datetime - relativedelta(hours=5)), cell_format)
-
-                row+=1
-
-            workbook.close()
-            output.seek(0)
-            response.stream.write(output.read())
-            output.close()
-
-            #response.set_cookie('fileToken', token)
-            return response
+            if groupby == 'state':
+                order = "state, %s" % order
+            appointments = Appointment.sudo().search(domain, order=order, limit=self._items_per_page, offset=pager['offset'])
+        if groupby == 'state':
+            grouped_appointments = [Appointment.sudo().concat(*g) for k, g in groupbyelem(appointments, itemgetter('state'))]
+        else:
+            grouped_appointments = [appointments]
+        #request.session['my_appointments_history'] = appointments.ids[:100]
 
         values.update({
             'date_begin': date_begin,
@@ -417,10 +267,13 @@ class CustomerPortal(CustomerPortal):
             'appointments': appointments,
             'grouped_appointments': grouped_appointments,
             'total': appointment_count,
+            'total_approximate': count_approximate,
             'page_name': 'appointment',
             'archive_groups': archive_groups,
             'default_url': '/my/appointments',
-            #'pager': pager,
+            'pager': pager,
+            'after': after,
+            'next_cursor': next_cursor,
             'searchbar_sortings': searchbar_sortings,
             'searchbar_groupby': searchbar_groupby,
             'searchbar_inputs': searchbar_inputs,
@@ -522,7 +375,9 @@ class CustomerPortal(CustomerPortal):
             ]
 
         # search
-        if search and search_in:
+        if search and search_in == 'all':
+            domain += request.env['calendar.appointment']._search_text_domain(search)
+        elif search and search_in:
             search_domain = []
             if search_in in ('appointment_code', 'all'):
                 search_domain = OR([search_domain, [('appointment_code', 'ilike', search)]])
@@ -544,13 +399,10 @@ class CustomerPortal(CustomerPortal):
                 search_domain = OR([search_domain, [('indicted_text', 'ilike', search)]])
             if search_in in ('applicant_email', 'all'):
                 search_domain = OR([search_domain, [('applicant_email', 'ilike', search)]])
-            domain += search_domain
             #if search_in in ('lifesize_meeting_ext', 'all'):
             #    search_domain = OR([search_domain, [('lifesize_meeting_ext', 'ilike', search)]])
-            domain += search_domain
             if search_in in ('name', 'all'):
                 search_domain = OR([search_domain, [('name', 'ilike', search)]])
-            domain += search_domain
             if search_in in ('state', 'all'):
                 search_domain = OR([search_domain, [('state', 'ilike', search)]])
             domain += search_domain
@@ -588,188 +440,10 @@ class CustomerPortal(CustomerPortal):
         #request.session['my_appointments_history'] = appointments.ids[:100]
 
         if export == 'true' and request.env.user.has_permission_download_report:
-            appointments_total = request.env['calendar.appointment'].sudo().search(domain, order=order, limit=20)
-            response = request.make_response(
-                None,
-                headers=[('Content-Type', 'application/vnd.ms-excel'), ('Content-Disposition', content_disposition('Reporte_Agendamientos.xlsx'))
-                ]
-            )
-            output = io.BytesIO()
-            workbook = xlsxwriter.Workbook(output, {'in_memory': True, 'default_date_format': 'yyyy/mm/dd'})
-            sheet = workbook.add_worksheet('Agendamientos')
-            cell_format = workbook.add_format()
-            cell_format.set_font_name('Calibri')
-            cell_format.set_font_size(8)
-            head = workbook.add_format()
-            txt = workbook.add_format()
-            dateformat = workbook.add_format()
-            timeformat = workbook.add_format()
-            datetimeformat = workbook.add_format()
-
-            workbook.formats[0].set_font_size(8)
-
-            sheet.set_column('A:A', 20)
-            sheet.set_column('B:B', 40)
-            sheet.set_column('C:C', 20)
-            sheet.set_column('C:C', 20)
-            sheet.set_column('D:D', 20, dateformat)
-            sheet.set_column('E:E', 20)
-            sheet.set_column('F:F', 20)
-            sheet.set_column('G:G', 60)
-            sheet.set_column('H:H', 20)
-            sheet.set_column('I:I', 20)
-            sheet.set_column('J:J', 20)
-            #sheet.set_column('K:K', 20)
-            #sheet.set_column('L:L', 50)
-            sheet.set_column('K:K', 50)
-            sheet.set_column('L:L', 20, dateformat)
-            sheet.set_column('M:M', 60)
-            sheet.set_column('N:N', 20)
-            #sheet.set_column('Q:Q', 50)
-            sheet.set_column('O:O', 30)
-            sheet.set_column('P:P', 30)
-            #sheet.set_column('T:T', 40)
-            #sheet.set_column('U:U', 20)
-            sheet.set_column('Q:Q', 20)
-            sheet.set_column('R:R', 20)
-            #sheet.set_column('X:X', 20)
-            #sheet.set_column('Y:Y', 40, dateformat)
-            sheet.set_column('S:S', 20)
-            #sheet.set_column('AA:AA', 50)
-            sheet.set_column('T:T', 20)
-            #sheet.set_column('AC:AC', 20)
-            sheet.set_column('U:U', 20)
-            #sheet.set_column('AE:AE', 20, timeformat)
-            sheet.set_column('V:V', 20)
-            sheet.set_column('W:W', 70)
-            #sheet.set_column('X:X', 60)
-            sheet.set_column('X:X', 60)
-            sheet.set_column('Y:Y', 50)
-            sheet.set_column('Z:Z', 40)
-            sheet.set_column('AA:AA', 40)
-            sheet.set_column('AB:AB', 30, datetimeformat)
-
-            #sheet.merge_range('B2:I3', 'REPORTE DE AGENDAMIENTOS', head)
-            sheet.write('A1', 'ID SOLICITUD', head)
-            sheet.write('B1', 'TIPO DE SOLICITUD', head)
-            sheet.write('C1', 'TIPO DE AUDIENCIA', head)
-            sheet.write('D1', 'FECHA DE REALIZACIÓN', head)
-            sheet.write('E1', 'HORA DE INICIO', head)
-            sheet.write('F1', 'CÓDIGO DESPACHO SOLICITANTE', head)
-            sheet.write('G1', 'DESPACHO SOLICITANTE', head)
-            sheet.write('H1', 'CIUDAD ORIGEN', head)
-            sheet.write('I1', 'DEPARTAMENTO ORIGEN', head)
-            sheet.write('J1', 'DESTINOS', head)
-            #sheet.write('K1', 'MEDIO DE RECEPCIÓN', head)
-            #sheet.write('L1', 'DETALLES MEDIO DE RECEPCIÓN', head)
-            sheet.write('K1', 'OBSERVACIONES', head)
-            sheet.write('L1', 'FECHA DE SOLICITUD', head)
-            sheet.write('M1', 'NOMBRE DEL SOLICITANTE', head)
-            sheet.write('N1', 'ESTADO', head)
-            #sheet.write('Q1', 'CORREO SALIENTE', head)
-            sheet.write('O1', 'NÚMERO DE PROCESO', head)
-            sheet.write('P1', 'SALA', head)
-            #sheet.write('T1', 'CORREO PARTICIPANTES', head)
-            #sheet.write('U1', 'CELULAR', head)
-            sheet.write('Q1', 'CLASE DE VIDEOCONFERENCIA', head)
-            sheet.write('R1', 'TIPO DE AUDIENCIA', head)
-            #sheet.write('X1', 'DECLARANTE', head)
-            #sheet.write('Y1', 'PROCESADO', head)
-            sheet.write('S1', 'FECHA AGENDAMIENTO', head)
-            #sheet.write('AA1', 'USUARIO AGENDAMIENTO', head)
-            sheet.write('T1', 'FECHA CIERRE', head)
-            #sheet.write('AC1', 'USUARIO DE CIERRE', head)
-            sheet.write('U1', 'FECHA FINAL', head)
-            #sheet.write('AE1', 'HORA FINAL', head)
-            sheet.write('V1', 'DESCRIPCION', head)
-            sheet.write('W1', 'ETIQUETA', head)
-            #sheet.write('X1', 'URL DE AGENDAMIENTO', head)
-            sheet.write('X1', 'LINK DE GRABACIÓN', head)
-            sheet.write('Y1', 'CREADO POR', head)
-            sheet.write('Z1', 'NOMBRE SALA LIFESIZE', head)
-            sheet.write('AA1', 'URL LIFESIZE', head)
-            sheet.write('AB1', 'FECHA Y HORA DE REALIZACIÓN', head)
-            row = 2
-
-            for appointment in appointments_total:
-    ########## ##TRADUCCION ESTADOS ###################
-                if appointment.state == 'open':
-                    state_label='AGENDADO'
-                if appointment.state == 'realized':
-                    state_label='REALIZADA'
-                if appointment.state == 'unrealized':
-                    state_label='NO REALIZADA'
-                if appointment.state == 'assist_postpone':
-                    state_label='ASISTIDA Y APLAZADA'
-                if appointment.state == 'postpone':
-                    state_label='APLAZADA'
-                if appointment.state == 'assist_cancel':
-                    state_label='ASISTIDA Y CANCELADA'
-                if appointment.state == 'cancel':
-                    state_label='CANCELADO'
-                if appointment.state == 'draft':
-                    state_label='DUPLICADO'
-########## ##TRADUCIÓN TIPO AUDIENCIA ###################
-
-                if appointment.type == 'audience':
-                    type_label='AUDIENCIA'
-                if appointment.type == 'conference':
-                    type_label='VIDEO CONFERENCIA'
-                if appointment.type == 'streaming':
-                    type_label='STREAMING'
-
-                sheet.write('A'+str(row), appointment.appointment_code, cell_format)
-                sheet.write('B'+str(row), appointment.request_type_label, cell_format)
-                sheet.write('C'+str(row), type_label, cell_format)
-                sheet.write('D'+str(row), str(appointment.calendar_date), cell_format)
-                newstrtime = '{0:02.0f}:{1:02.0f}'.format(*divmod(appointment.calendar_time * 60, 60))
-                sheet.write('E'+str(row), newstrtime, cell_format)
-                sheet.write('F'+str(row), appointment.judged_only_code, cell_format)
-                sheet.write('G'+str(row), appointment.judged_only_name, cell_format)
-                sheet.write('H'+str(row), appointment.city_id.name.upper(), cell_format)
-                sheet.write('I'+str(row), appointment.country_state_id.name.upper(), cell_format)
-                sheet.write('J'+str(row), appointment.destination_ids_label, cell_format)
-                #sheet.write('K'+str(row), appointment.reception_id.name, cell_format)
-                #sheet.write('L'+str(row), appointment.reception_detail, cell_format)
-                sheet.write('K'+str(row), appointment.observations.upper(), cell_format)
-                sheet.write('L'+str(row), str(appointment.request_date), cell_format)
-                #sheet.write('M'+str(row), appointment.applicant_id.name.upper(), cell_format)
-                sheet.write('M'+str(row), appointment.applicant_raw_name.upper() if appointment.applicant_raw_name else '', cell_format)
-                sheet.write('N'+str(row), state_label, cell_format)
-                #sheet.write('Q'+str(row), appointment.applicant_email, cell_format)
-                sheet.write('O'+str(row), appointment.process_number, cell_format)
-                sheet.write('P'+str(row), appointment.room_id_mame.upper(), cell_format)
-                #sheet.write('T'+str(row), appointment.partner_ids_label, cell_format)
-                #sheet.write('U'+str(row), appointment.applicant_mobile, cell_format)
-                sheet.write('Q'+str(row), appointment.class_id.name.upper(), cell_format)
-                sheet.write('R'+str(row), appointment.request_type.upper(), cell_format)
-                #sheet.write('X'+str(row), appointment.declarant_text, cell_format)
-                #sheet.write('Y'+str(row), appointment.indicted_text, cell_format)
-                sheet.write('S'+str(row), str(appointment.appointment_date), cell_format)
-                #sheet.write('AA'+str(row), appointment.create_uid_login, cell_format)
-                sheet.write('T'+str(row), str(appointment.appointment_close_date) if appointment.appointment_close_date else '', cell_format)
-                #sheet.write('AC'+str(row), appointment.appointment_close_user_login if appointment.appointment_close_user_login else '', cell_format)
-                sheet.write('U'+str(row), str(appointment.end_date) if appointment.end_date else '', cell_format)
-                #sheet.write('AE'+str(row), str(appointment.end_hour) if appointment.end_hour else '', cell_format)
-                sheet.write('V'+str(row), appointment.state_description.upper() if appointment.state_description else '', cell_format)
-                sheet.write('W'+str(row), appointment.tag_number, cell_format)
-                #sheet.write('X'+str(row), appointment.link_download if appointment.link_download else '', cell_format)
-                sheet.write('X'+str(row), appointment.link_download_text if appointment.link_download_text and appointment.request_type == 'l' else '', cell_format)
-                sheet.write('Y'+str(row), appointment.create_uid.name.upper() if appointment.create_uid else '', cell_format)
-                sheet.write('Z'+str(row), appointment.name, cell_format)
-                sheet.write('AA'+str(row), appointment.lifesize_url, cell_format)
-                sheet.write('AB'+str(row), str(appointment.calendar_datetime - relativedelta(hours=5)), cell_format)
-
-                row+=1
-
-            workbook.close()
-            output.seek(0)
-            response.stream.write(output.read())
-            output.close()
-
-            #response.set_cookie('fileToken', token)
-            #request.redirect('/public')
-            return response
+            if appointment_count > self._appointments_xlsx_sync_limit():
+                request.env['calendar.appointment.export']._create_from_domain(domain, order=order, layout='public')
+                return request.redirect('/my/appointments/exports')
+            return self._appointments_xlsx_response(domain, order, 'public')
 
         values.update({
             'date_begin': date_begin,
@@ -796,6 +470,42 @@ class CustomerPortal(CustomerPortal):
 
         return request.render("calendar_csj.portal_appointments_public", values)
 
+    @http.route(['/my/appointments/exports'], type='http', auth="user", website=True)
+    def portal_my_appointment_exports(self, **kw):
+        values = self._prepare_portal_layout_values()
+        exports = request.env['calendar.appointment.export'].sudo().search([('user_id', '=', request.env.user.id)], limit=20)
+        values.update({
+            'exports': exports,
+            'page_name': 'appointment',
+        })
+        return request.render("calendar_csj.portal_my_appointment_exports", values)
+
+    @http.route(['/my/appointments/exports/<int:export_id>/status'], type='json', auth="user", website=True)
+    def portal_my_appointment_export_status(self, export_id, **kw):
+        export = request.env['calendar.appointment.export'].sudo().browse(export_id)
+        if not export.exists() or export.user_id != request.env.user:
+            return {'error': _('Reporte no encontrado')}
+        return {
+            'state': export.state,
+            'progress': export.progress,
+            'record_count': export.record_count,
+            'url': export._get_download_url() if export.state == 'done' else False,
+        }
+
+    @http.route(['/my/appointments/exports/<int:export_id>/download'], type='http', auth="user", website=True)
+    def portal_my_appointment_export_download(self, export_id, **kw):
+        export = request.env['calendar.appointment.export'].sudo().browse(export_id)
+        if not export.exists() or export.user_id != request.env.user or not export.attachment_id:
+            raise werkzeug.exceptions.NotFound()
+        attachment = export.attachment_id
+        if attachment.store_fname:
+            return http.send_file(attachment._full_path(attachment.store_fname), mimetype=attachment.mimetype,
+                                  as_attachment=True, filename=attachment.name)
+        return request.make_response(base64.b64decode(attachment.datas), headers=[
+            ('Content-Type', attachment.mimetype),
+            ('Content-Disposition', content_disposition(attachment.name)),
+        ])
+
     @http.route([
         '/my/appointment/<int:appointment_id>'
     ], type='http', auth="public", website=True)
@@ -1101,24 +811,7 @@ class CustomerPortal(CustomerPortal):
         judge_name = kwargs['judge_name']
         process_number = kwargs['process_number']
 
-        if len(process_number) != 23:
-            return request.render("calendar_csj.recording_add_content_confirm", {
-                'process_number': process_number,
-                'message': 'process_longer_failed',
-            })
-        city = request.env['res.entity'].sudo().search_city(process_number[0:5])
-        entity = request.env['res.entity'].sudo().search_entity(process_number[5:7])
-        speciality = request.env['res.entity'].sudo().search_speciality(process_number[7:9])
-        rad_year = process_number[12:16]
-        year = datetime.now()
-        year_limit = int(year.strftime("%Y")) + 1
-        if city and entity and speciality:
-            if not int(rad_year) in range(1900,year_limit):
-                return request.render("calendar_csj.recording_add_content_confirm", {
-                    'process_number': process_number,
-                    'message': 'process_longer_failed',
-                })
-        else:
+        if request.env['res.entity'].sudo().decode_process_number(process_number)['error']:
             return request.render("calendar_csj.recording_add_content_confirm", {
                 'process_number': process_number,
                 'message': 'process_longer_failed',
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+_logger = logging.getLogger(__name__)
+
+# (connect, read) timeout in seconds used when the caller does not give one
+DEFAULT_TIMEOUT = (5, 30)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# statuses meaning the request was refused without being run
+REJECTED_STATUSES = (429, 503)
+
+_local = threading.local()
+
+
+def get_session(name, pool_maxsize=10):
+    """ Return the requests session ``name`` of the current thread.
+
+        Sessions keep their connections alive between requests, so the
+        TLS handshake with a remote API is done once per worker thread
+        instead of once per call.
+    """
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    session = sessions.get(name)
+    if session is None:
+        session = sessions[name] = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    return session
+
+
+def _retry_after(response):
+    """ Seconds to wait given by the Retry-After header, if any. """
+    return parse_retry_after(response.headers.get('Retry-After'))
+
+
+def parse_retry_after(value):
+    """ Seconds to wait given by a Retry-After value, in seconds or as a date. """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def can_retry(method, status, retry_after=None):
+    """ Whether a request answered with ``status`` can be sent again. Other
+        methods than IDEMPOTENT_METHODS are only retried when the server
+        refused to run them, as a gateway error may come after the request
+        was run. """
+    if status not in RETRY_STATUSES:
+        return False
+    return method in IDEMPOTENT_METHODS or status in REJECTED_STATUSES or retry_after is not None
+
+
+def request(session_name, method, url, timeout=None, retries=3, backoff=0.5, max_backoff=30, **kwargs):
+    """ Send a request with the pooled session ``session_name``.
+
+        Responses with a status in RETRY_STATUSES are retried up to
+        ``retries`` times, waiting for the Retry-After header when the
+        server sends it and for an exponential backoff with jitter
+        otherwise. Connection errors and timeouts are retried the same way
+        for idempotent methods; other methods are only retried when the
+        connection could not be established or the server refused the
+        request (see can_retry), so a POST is never sent twice.
+
+        :return: the last response received
+        :raise requests.exceptions.RequestException: when no response was received
+    """
+    method = method.upper()
+    session = get_session(session_name)
+    timeout = timeout or DEFAULT_TIMEOUT
+    for attempt in range(retries + 1):
+        delay = min(backoff * (2 ** attempt), max_backoff) * (1 + random.random() / 2)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.exceptions.ConnectTimeout)
+            if attempt == retries or not retryable:
+                raise
+            _logger.warning('%s %s failed (%s), retry %s/%s in %.1fs', method, url, e, attempt + 1, retries, delay)
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            retry_after = _retry_after(response)
+            if not can_retry(method, response.status_code, retry_after):
+                return response
+            if retry_after is not None:
+                if retry_after > max_backoff:
+                    # do not hold the worker longer than that, let the caller fail
+                    return response
+                delay = retry_after
+            _logger.warning('%s %s answered %s, retry %s/%s in %.1fs', method, url, response.status_code, attempt + 1, retries, delay)
+        time.sleep(delay)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+""" Minimal iCalendar (RFC 5545) writer for the invitations.
+
+    The invitations only use a handful of properties, writing their lines
+    directly is much cheaper than building and validating a vobject tree,
+    which matters for meetings with many attendees that are sent again on
+    each reschedule.
+"""
+
+import datetime
+
+ICS_PRODID = '-//CSJ//Agendamiento//ES'
+# content lines longer than that are folded
+ICS_LINE_LENGTH = 75
+
+
+def escape_text(value):
+    """ Escape a TEXT property value. """
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def format_param(value):
+    """ Quote a parameter value when it holds a separator. """
+    value = str(value).replace('"', "'")
+    if any(char in value for char in ':;,'):
+        return '"%s"' % value
+    return value
+
+
+def format_datetime(value, allday=False):
+    """ DATE of an all day event, UTC DATE-TIME otherwise; naive datetimes are UTC. """
+    if allday:
+        return value.strftime('%Y%m%d')
+    if value.tzinfo:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_duration(delta):
+    """ DURATION value of a timedelta, e.g. P1D, PT15M, -PT1H30M. """
+    sign = '-' if delta < datetime.timedelta(0) else ''
+    delta = abs(delta)
+    hours, rest = divmod(delta.seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    res = 'P%sD' % delta.days if delta.days else 'P'
+    time = ''.join('%s%s' % (amount, unit) for amount, unit in ((hours, 'H'), (minutes, 'M'), (seconds, 'S')) if amount)
+    if time:
+        res += 'T' + time
+    elif not delta.days:
+        res += 'T0S'
+    return sign + res
+
+
+def fold(line):
+    """ Split a content line in chunks of ICS_LINE_LENGTH octets, without
+        cutting a multibyte character. """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= ICS_LINE_LENGTH:
+        return line
+    chunks = []
+    limit = ICS_LINE_LENGTH
+    while encoded:
+        cut = min(limit, len(encoded))
+        # do not cut inside a UTF-8 sequence
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        # continuation lines start with a space
+        limit = ICS_LINE_LENGTH - 1
+    return '\r\n '.join(chunks)
+
+
+def content_line(name, value, params=None):
+    """ ``NAME;PARAM=value:value`` with ``params`` a list of (name, value). """
+    if params:
+        name += ''.join(';%s=%s' % (param, format_param(param_value)) for param, param_value in params)
+    return fold('%s:%s' % (name, value))
+
+
+class IcsWriter(object):
+    """ Accumulate the lines of one VCALENDAR, see serialize(). """
+
+    def __init__(self, method='REQUEST'):
+        self.lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:%s' % ICS_PRODID,
+            'CALSCALE:GREGORIAN',
+            'METHOD:%s' % method,
+        ]
+
+    def add(self, name, value, params=None):
+        self.lines.append(content_line(name, value, params))
+
+    def add_text(self, name, value, params=None):
+        self.add(name, escape_text(value), params)
+
+    def begin(self, component):
+        self.lines.append('BEGIN:%s' % component)
+
+    def end(self, component):
+        self.lines.append('END:%s' % component)
+
+    def serialize(self):
+        """ :return: the calendar as utf-8 bytes """
+        return ('\r\n'.join(self.lines + ['END:VCALENDAR']) + '\r\n').encode('utf-8')
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import split_every
+
+import logging
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# search_document, which includes the tag, is filled by the 13.1.2 migration
+FIELDS = ['calendar_date', 'calendar_time', 'record_data', 'tag_number']
+
+
+def migrate(cr, version):
+    """ Fill the stored calendar_date, calendar_time, record_data and
+        tag_number of the existing appointments, by batches. """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Appointment = env['calendar.appointment'].with_context(active_test=False)
+    ids = Appointment.search([]).ids
+    for done, batch_ids in enumerate(split_every(BATCH_SIZE, ids), 1):
+        records = Appointment.browse(batch_ids)
+        for name in FIELDS:
+            env.add_to_compute(Appointment._fields[name], records)
+        records.recompute()
+        records.flush()
+        records.invalidate_cache()
+        _logger.info('calendar.appointment stored fields: %s/%s', min(done * BATCH_SIZE, len(ids)), len(ids))
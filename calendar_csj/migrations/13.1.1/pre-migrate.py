@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """ Create the columns of the fields stored in this version, so the
+        update does not compute them for every appointment in one go;
+        they are filled by batches in post-migrate. """
+    cr.execute("""
+        ALTER TABLE calendar_appointment
+            ADD COLUMN IF NOT EXISTS calendar_date date,
+            ADD COLUMN IF NOT EXISTS calendar_time double precision,
+            ADD COLUMN IF NOT EXISTS record_data varchar,
+            ADD COLUMN IF NOT EXISTS tag_number varchar,
+            ADD COLUMN IF NOT EXISTS search_document text
+    """)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import split_every
+
+import logging
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def migrate(cr, version):
+    """ Fill the search document of the existing appointments, which now
+        includes their state, by batches. """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Appointment = env['calendar.appointment'].with_context(active_test=False)
+    field = Appointment._fields['search_document']
+    ids = Appointment.search([]).ids
+    for done, batch_ids in enumerate(split_every(BATCH_SIZE, ids), 1):
+        records = Appointment.browse(batch_ids)
+        env.add_to_compute(field, records)
+        records.recompute()
+        records.flush()
+        records.invalidate_cache()
+        _logger.info('calendar.appointment search document: %s/%s', min(done * BATCH_SIZE, len(ids)), len(ids))
@@ -7,8 +7,12 @@ from . import res_partner
 from . import process_process
 from . import recording_content
 from . import calendar_appointment
+from . import calendar_appointment_export
+from . import calendar_appointment_outbox
+from . import calendar_appointment_portal
 from . import calendar_event
 from . import calendar_recording_notification
 from . import event
+from . import ir_sequence
 from . import res_city
 from . import res_users
\ No newline at end of file
@@ -1,254 +1,184 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from .. import http_client
 import requests
 import json
-import random
-import string
 
 import logging
 
 _logger = logging.getLogger(__name__)
 
 
+LIFESIZE_MEETING_URL = "http://meetingapi.lifesizecloud.com/meeting"
+LIFESIZE_USER_URL = "http://userapi.lifesizecloud.com/user"
+LIFESIZE_USER_PASSWORD = "Password_LifeSize_User#2="
+
+
+def _response_json(resp):
+    try:
+        return resp.json()
+    except ValueError:
+        return resp.text
+
+
+def _meeting_request(vals):
+    """ (http method, url, params, body) of a meeting operation """
+    method = vals["method"]
+    if method == "create":
+        try:
+            description = vals.get("description").replace("\n", " - ")
+        except:
+            description = vals.get("description")
+        body = {
+            "displayName": vals.get("displayName"),
+            "description": description,
+            # "pin": code(),
+            "ownerExtension": vals.get("ownerExtension"),
+            "tempMeeting": "false",
+            "hiddenMeeting": vals.get("hiddenMeeting"),
+        }
+        if vals.get("moderatorExtension"):
+            body.update(
+                {"moderatorExtension": vals.get("moderatorExtension"),}
+            )
+        return "POST", LIFESIZE_MEETING_URL + "/create", None, body
+    elif method == "read":
+        return "GET", LIFESIZE_MEETING_URL + "/get", {"uuid": vals.get("uuid")}, None
+    elif method == "update":
+        # body = {
+        #     "uuid": vals.get("uuid"), #Mandatory
+        #     "description": vals.get("description"),
+        #     "ownerExtension": vals.get("ownerExtension"),#Mandatory
+        # }
+        body = dict(vals)
+        del body["method"]
+        return "PUT", LIFESIZE_MEETING_URL + "/update", None, body
+    elif method == "delete":
+        return "DELETE", LIFESIZE_MEETING_URL + "/delete", None, {"uuid": vals.get("uuid")}
+    elif method == "load":
+        return "GET", LIFESIZE_MEETING_URL + "/load", {"limitSize": vals.get("number")}, None
+    raise ValidationError("Unknown Lifesize method: %s" % method)
+
+
+def _user_request(vals):
+    """ (http method, url, params, body) of a user operation """
+    method = vals["method"]
+    if method == "create":
+        body = {
+            "email": vals.get("email"),
+            "name": vals.get("name"),
+            # "password": vals.get("password"), #In case that you want pass the password
+            "password": LIFESIZE_USER_PASSWORD,
+        }
+        return "POST", LIFESIZE_USER_URL + "/createUser", None, body
+    elif method == "search":
+        # "uuid": vals.get("uuid"), #It is not necesary
+        return "GET", LIFESIZE_USER_URL + "/searchUser", {"email": vals.get("email")}, None
+    elif method == "update":
+        body = dict(vals)
+        del [body["method"], body["uuid"]]
+        return "PUT", LIFESIZE_USER_URL + "/updateUser", {"uuid": vals.get("uuid")}, body
+    elif method == "delete":
+        return "DELETE", LIFESIZE_USER_URL + "/deleteUser", None, {"uuid": vals.get("uuid")}
+    raise ValueError("Unknown Lifesize method: %s" % method)
+
+
+def _send(options, http_method, url, params, body):
+    return http_client.request(
+        "lifesize",
+        http_method,
+        url,
+        timeout=options["timeout"],
+        retries=options["retries"],
+        params=params,
+        data=json.dumps(body) if body is not None else None,
+        headers={"key": options["token"], "Content-type": "application/json"},
+    )
+
+
+def _meeting_call(options, vals):
+    """ Run a meeting operation, without using the environment so it can
+        be called from the threads of the bulk helpers. """
+    try:
+        resp = _send(options, *_meeting_request(vals))
+    except requests.exceptions.RequestException as e:
+        _logger.exception("Lifesize request failed: %s", vals["method"])
+        raise ValidationError("No se pudo establecer la conexión con Lifesize: %s" % e)
+    if not resp.ok:
+        raise ValidationError("Bad response: %s." % (_response_json(resp)))
+    res = resp.json()
+    if vals["method"] in ("create", "update") and res.get("errorDescription"):
+        raise ValidationError(
+            "API message: {}".format(res.get("errorDescription"))
+        )
+    return res
+
+
+def _user_call(options, vals):
+    """ Run a user operation, same as _meeting_call. ValueError is raised
+        when Lifesize answers with an error, callers rely on it to create
+        the users that are not found. """
+    resp = _send(options, *_user_request(vals))
+    if not resp.ok:
+        raise ValueError("Bad response: %s." % (_response_json(resp)))
+    return resp.json()
+
+
 class ApiLifesize(models.TransientModel):
     _name = "api.lifesize"
     _description = "Api Lifesize"
 
-    def api_crud(self, vals):
+    def _get_request_options(self):
         token_company = self.env.user.company_id.key_lifesize
         if not token_company:
             raise ValidationError("Please write token")
+        params = self.env["ir.config_parameter"].sudo()
+        return {
+            "token": token_company,
+            "timeout": (5, float(params.get_param("calendar_csj.lifesize_timeout", 30))),
+            "retries": int(params.get_param("calendar_csj.lifesize_retries", 2)),
+            "concurrency": int(params.get_param("calendar_csj.lifesize_concurrency", 4)),
+        }
+
+    def _run_many(self, call, vals_list):
+        """ Run ``call`` for every vals with at most ``concurrency`` requests
+            at a time.
+
+            :return: one dict per vals, in the same order, with ``success``
+                     and either ``result`` or ``error`` (the exception raised)
+        """
+        options = self._get_request_options()
+        results = [None] * len(vals_list)
+        if not vals_list:
+            return results
+        workers = max(1, min(options["concurrency"], len(vals_list)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(call, options, vals): index for index, vals in enumerate(vals_list)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = {"success": True, "result": future.result()}
+                except Exception as e:
+                    results[index] = {"success": False, "error": e}
+        return results
 
-        def code(length=4, chars=string.digits):
-            return "".join([random.choice(chars) for i in range(length)])
-
-        def api_create(vals):
-            url = "http://meetingapi.lifesizecloud.com" + "/meeting/create"
-            try:
-                description = vals.get("description").replace("\n", " - ")
-            except:
-                description = vals.get("description")
-            body = {
-                "displayName": vals.get("displayName"),
-                "description": description,
-                # "pin": code(),
-                "ownerExtension": vals.get("ownerExtension"),
-                "tempMeeting": "false",
-                "hiddenMeeting": vals.get("hiddenMeeting"),
-            }
-            if vals.get("moderatorExtension"):
-                body.update(
-                    {"moderatorExtension": vals.get("moderatorExtension"),}
-                )
-            resp = requests.post(
-                url=url,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                if not resp.json().get("errorDescription"):
-                    res = resp.json()
-                    resp.close
-                    return res
-                else:
-                    resp.close
-                    raise ValidationError(
-                        "API message: {}".format(resp.json().get("errorDescription"))
-                    )
-            else:
-                resp.close
-                raise ValidationError("Bad response: %s." % (resp.json()))
-
-        def api_read(vals):
-            url = "http://meetingapi.lifesizecloud.com" + "/meeting/get"
-            params = {
-                "uuid": vals.get("uuid"),
-            }
-            resp = requests.get(
-                url=url,
-                params=params,
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                res = resp.json()
-                resp.close
-                return res
-            else:
-                resp.close
-                raise ValidationError("Bad response: %s." % (resp.json()))
-
-        def api_update(body):
-            url = "http://meetingapi.lifesizecloud.com" + "/meeting/update"
-            del body["method"]
-            # body = {
-            #     "uuid": vals.get("uuid"), #Mandatory
-            #     "description": vals.get("description"),
-            #     "ownerExtension": vals.get("ownerExtension"),#Mandatory
-            # }
-            resp = requests.put(
-                url=url,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                if not resp.json().get("errorDescription"):
-                    res = resp.json()
-                    resp.close
-                    return res
-                else:
-                    resp.close
-                    raise ValidationError(
-                        "API message: {}".format(resp.json().get("errorDescription"))
-                    )
-            else:
-                raise ValidationError("Bad response: %s." % (resp.json()))
-
-        def api_delete(vals):
-            url = "http://meetingapi.lifesizecloud.com" + "/meeting/delete"
-            body = {
-                "uuid": vals.get("uuid"),
-            }
-            resp = requests.delete(
-                url=url,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                if not vals.get("errorDescription"):
-                    res = resp.json()
-                    resp.close
-                    return res
-                else:
-                    raise ValidationError(
-                        "API message: {}".format(resp.json().get("errorDescription"))
-                    )
-            else:
-                raise ValidationError("Bad response: %s." % (resp.json()))
-
-        def api_load(vals):
-            url = "http://meetingapi.lifesizecloud.com" + "/meeting/load"
-            params = {"limitSize": vals.get("number")}
-            resp = requests.get(
-                url=url,
-                params=params,
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                res = resp.json()
-                resp.close
-                return res
-            else:
-                raise ValidationError("Bad response: %s." % (resp.json()))
-
-        if vals["method"] == "create":
-            return api_create(vals)
-        elif vals["method"] == "read":
-            return api_read(vals)
-        elif vals["method"] == "update":
-            return api_update(vals)
-        elif vals["method"] == "delete":
-            return api_delete(vals)
-        elif vals["method"] == "load":
-            return api_load(vals)
+    def api_crud(self, vals):
+        return _meeting_call(self._get_request_options(), vals)
 
     def api_user_crud(self, vals):
-        token_company = self.env.user.company_id.key_lifesize
-
-        if not token_company:
-            raise ValidationError("Please write token")
+        return _user_call(self._get_request_options(), vals)
 
-        def api_Create(vals):
-            url = "http://userapi.lifesizecloud.com/user" + "/createUser"
-            body = {
-                "email": vals.get("email"),
-                "name": vals.get("name"),
-                # "password": vals.get("password"), #In case that you want pass the password
-                "password": "Password_LifeSize_User#2=",
-            }
-            resp = requests.post(
-                url=url,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                if not vals.get("errorDescription"):
-                    res = resp.json()
-                    resp.close
-                    return res
-                else:
-                    resp.close
-                    raise ValueError("Api ERROR: %s." % (resp.json()))
-            else:
-                resp.close
-                raise ValueError("Bad response: %s." % (resp.json()))
-
-        def api_Search(vals):
-            url = "http://userapi.lifesizecloud.com/user" + "/searchUser"
-            params = {
-                "email": vals.get("email"),
-                # "uuid": vals.get("uuid"), #It is not necesary
-            }
-            resp = requests.get(
-                url=url,
-                params=params,
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                res = resp.json()
-                resp.close
-                return res
-            else:
-                resp.close
-                raise ValueError("Bad response: %s." % (resp.json()))
-
-        def api_Update(body):
-            url = "http://userapi.lifesizecloud.com/user" + "/updateUser"
-            params = {
-                "uuid": body.get("uuid"),
-            }
-            del [body["method"], body["uuid"]]
-            resp = requests.put(
-                url=url,
-                params=params,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json",},
-            )
-            if resp.ok:
-                res = resp.json()
-                resp.close
-                return res
-            else:
-                resp.close
-                raise ValueError("Bad response: %s." % (resp.json()))
-
-        def api_Delete(vals):
-            url = "http://userapi.lifesizecloud.com/user" + "/deleteUser"
-            body = {
-                "uuid": vals.get("uuid"),
-            }
-            resp = requests.delete(
-                url=url,
-                data=json.dumps(body),
-                headers={"key": token_company, "Content-type": "application/json"},
-            )
-            if resp.ok:
-                res = resp.json()
-                resp.close
-                return res
-            else:
-                resp.close
-                raise ValueError("Bad response: %s." % (resp.json()))
+    def api_crud_many(self, vals_list):
+        """ Meeting operations of ``vals_list`` run concurrently, see _run_many. """
+        return self._run_many(_meeting_call, vals_list)
 
-        if vals["method"] == "create":
-            return api_Create(vals)
-        elif vals["method"] == "search":
-            return api_Search(vals)
-        elif vals["method"] == "update":
-            return api_Update(vals)
-        elif vals["method"] == "delete":
-            return api_Delete(vals)
+    def api_user_crud_many(self, vals_list):
+        """ User operations of ``vals_list`` run concurrently, see _run_many. """
+        return self._run_many(_user_call, vals_list)
 
     def resp2dict(self, resp):
         body = resp.get("body")
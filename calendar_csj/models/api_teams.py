@@ -1,531 +1,534 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 import pytz
 from dateutil.relativedelta import relativedelta
 import requests
 import urllib.parse
-from odoo import models, fields, api, _
+from http.client import responses as HTTP_REASONS
+from odoo import models, fields, api, tools, _, SUPERUSER_ID
 from odoo.exceptions import UserError, ValidationError
-import string
+from .. import http_client
 
 _logger = logging.getLogger(__name__)
 
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+# maximum number of requests of a Graph JSON $batch
+GRAPH_BATCH_SIZE = 20
+TEAMS_TENANT_ID = "622cba98-80f8-41f3-8df5-8eb99901598b"
+TEAMS_ERROR_MESSAGES = {
+    "create": "Error creating online meeting link",
+    "update": "Error updating online meeting",
+    "delete": "Error deleting online meeting",
+}
+
+# user holding the Microsoft Teams token of the company
+TEAMS_TOKEN_USER_ID = 2
+# the token is refreshed this number of seconds before it expires
+TEAMS_TOKEN_MARGIN = 120
+# pg_advisory_xact_lock key serializing the refresh of the token
+TEAMS_TOKEN_LOCK = 7204811
+
+# per worker token cache {dbname: (access_token, expiration)}
+_token_cache = {}
+_token_lock = threading.Lock()
+# how the token was obtained: memory, database or refresh
+TEAMS_TOKEN_STATS = collections.Counter()
+
 
 class ApiTeams(models.TransientModel):
     _name = "api.teams"
     _description = "Api Teams"
 
-    def api_crud(self, vals):
-        token_company = self.env['res.users'].browse(2).teams_access_token
-        if not token_company:
+    def _graph_request(self, method, path, token, **kwargs):
+        """ Call the Microsoft Graph API through the pooled session of the
+            worker, with the timeout and retries of the system parameters.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        timeout = float(params.get_param('calendar_csj.graph_timeout', 30))
+        retries = int(params.get_param('calendar_csj.graph_retries', 3))
+        url = GRAPH_URL + path
+        headers = {"Authorization": "Bearer {}".format(token)}
+        if 'json' in kwargs:
+            headers["Content-Type"] = "application/json"
+        try:
+            return http_client.request('graph', method, url, timeout=(5, timeout), retries=retries, headers=headers, **kwargs)
+        except requests.exceptions.Timeout:
+            _logger.exception("Timeout at %s", url)
+            raise ValidationError(_("Microsoft Teams no respondió a tiempo, intente nuevamente."))
+        except requests.exceptions.RequestException:
+            _logger.exception("No se pudo establecer la conexión en %s", url)
+            raise ValidationError(_("No se pudo establecer la conexión con Microsoft Teams."))
+
+    @tools.ormcache('client_email')
+    def _get_organizer_id(self, client_email, token):
+        """ Graph id of the organizer of the meetings, it does not change so
+            it is only asked once per worker and email. """
+        response = self._graph_request("GET", "/users/%s" % client_email, token)
+        if response.status_code != 200:
+            raise ValidationError("No se pudo obtener el ID del usuario: %s %s" % (response.status_code, response.reason))
+        return response.json().get('id')
+
+    @api.model
+    def _read_access_token(self, cr):
+        """ Token of the Teams user read from the database, bypassing the
+            cache of the environment. """
+        cr.execute("""
+            SELECT is_authenticated, teams_access_token, teams_refresh_token, token_expire
+            FROM res_users WHERE id = %s
+        """, (TEAMS_TOKEN_USER_ID,))
+        is_authenticated, access_token, refresh_token, token_expire = cr.fetchone()
+        if not access_token and not refresh_token:
             raise ValidationError("Please write token")
-
-        def code(length=4, chars=string.digits):
-            return "".join([random.choice(chars) for i in range(length)])
-
-        def api_create(vals):
-            """Call Function to generate Teams Meeting link with appropriate
-            Time format and time zone if 'teams_link_check' is True.
-            """
-            active_user = self.env['res.users'].browse(2)
-            """Generate Microsoft Teams Meeting link
-            Get new Access token if older one is expired
-            """
-            active_user.refresh_token()
-            if active_user.is_authenticated:
-                if active_user.token_expire:
-                    if active_user.token_expire <= datetime.now():
-                        active_user.refresh_token()
-                else:
-                    raise ValidationError("Generar nuevo token para el agendamiento usando Microsoft Teams.")
-
-            if active_user.teams_refresh_token and not active_user.teams_access_token:
-                active_user.refresh_token()
-            token = active_user.teams_access_token
-            # Primero obtenemos el ID del usuario con el que vamos a crear los teams
-            url = f"https://graph.microsoft.com/v1.0/users/{self.env.user.company_id.client_email}"
-            # Encabezados de la solicitud
-            headers = {
-                "Authorization": f"Bearer {token}"
-            }
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()  # Verificar si hay errores en la respuesta HTTP
-                user_data = response.json()
-                user_id = user_data.get('id')
-            except requests.exceptions.RequestException as e:
-                raise ValidationError(f"No se pudo obtener el ID del usuario: {e}")
-
-            judged_id = self.env['res.partner'].browse(int(vals.get('judged_id')))
-
-            if not active_user.is_authenticated:
-                raise ValidationError("Genere un token de acceso para crear una reunión de Microsoft Teams")
-            #attendees = self.prepare_attendee_vals(vals.get('partner_ids'))
-
-            tenantId = "622cba98-80f8-41f3-8df5-8eb99901598b"
-            url = f"https://graph.microsoft.com/v1.0/users/{user_id}/onlineMeetings"
-            header = {
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(token)
-            }
-            try:
-                description = vals.get("description").replace("\n", " - ")
-            except:
-                description = vals.get("description")
-
-            # Convertir las cadenas de fecha y hora a objetos datetime
-            start_datetime = datetime.strptime(vals.get('start'), '%Y-%m-%d %H:%M:%S')
-            end_datetime = datetime.strptime(vals.get('stop'), '%Y-%m-%d %H:%M:%S')
-
-            # Aplicar la zona horaria UTC a las fechas y horas
-            start_datetime_utc = start_datetime.replace(tzinfo=pytz.timezone('UTC'))
-            end_datetime_utc = end_datetime.replace(tzinfo=pytz.timezone('UTC'))
-
-            # Formatear las fechas y horas en el nuevo formato
-            formatted_start = start_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            formatted_end = end_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-
-            coorganizers = vals.get('coorganizer')
-
-            payload = {
-                "creationDateTime": formatted_start,
-                "startDateTime": formatted_start,
-                "endDateTime": formatted_end,
-                "isBroadcast": False,
-                #"autoAdmittedUsers": "everyone",
-                #"outerMeetingAutoAdmittedUsers": "everyone",
-                "capabilities": [],
-                "externalId": None,
-                "iCalUid": None,
-                "meetingType": None,
-                "meetingsMigrationMode": None,
-                "subject": vals.get("displayName") if vals.get("displayName") else None,
-                "videoTeleconferenceId": None,
-                "isEntryExitAnnounced": False,
-                "allowedPresenters": "organizer",
-                "allowAttendeeToEnableMic": True,
-                "allowAttendeeToEnableCamera": True,
-                "allowMeetingChat": "limited",
-                "shareMeetingChatHistoryDefault": "none",
-                "allowTeamworkReactions": False,
-                "anonymizeIdentityForRoles": [],
-                "recordAutomatically": False,
-                "allowParticipantsToChangeName": False,
-                "allowTranscription": True,
-                "allowRecording": True,
-                "allowCloudRecording": True,
-                "meetingTemplateId": "customtemplate_b37c308d-4d3b-4ef5-ab65-3cb86a438436",
-                "broadcastSettings": None,
-                #"meetingInfo": vals.get("description") if vals.get("description") else None,
-                "audioConferencing": None,
-                "watermarkProtection": False,
-                "chatRestrictions": None,
-                "isDialInBypassEnabled": True,
-                "isEntryExitAnnounced": False,
-                "lobbyBypassSettings": {
-                    "scope": "everyone"
-                },
-                "watermarkProtection": {
-                    "isEnabledForContentSharing": False,
-                    "isEnabledForVideo": False
-                },
-                "joinMeetingIdSettings": {
-                    "isPasscodeRequired": True
-                },
-                "participants": {
-                    "organizer": {
-                        "upn": self.env.user.company_id.client_email,
-                        "role": "presenter",
-                        "identity": {
-                            "application": None,
-                            "device": None,
-                            "user": {
-                                "id": user_id,
-                                "displayName": None,
-                                "tenantId": tenantId,
-                                "identityProvider": "AAD"
-                            }
+        if not is_authenticated:
+            raise ValidationError("Genere un token de acceso para crear una reunión de Microsoft Teams")
+        if not token_expire:
+            raise ValidationError("Generar nuevo token para el agendamiento usando Microsoft Teams.")
+        return access_token, token_expire
+
+    @api.model
+    def _get_access_token(self):
+        """ Access token of the Teams user, refreshed only when it is about
+            to expire.
+
+            The token is kept in memory by each worker. When it expires, the
+            first thread of the worker reads it again from the database, and
+            only if the database copy expired too it is refreshed, on its own
+            cursor under an advisory lock: the other workers wait for that
+            refresh and reuse its token instead of refreshing it again, and
+            the res.users row is not kept locked until the end of the booking.
+        """
+        dbname = self.env.cr.dbname
+        margin = timedelta(seconds=TEAMS_TOKEN_MARGIN)
+
+        def valid(cached):
+            return cached and cached[0] and cached[1] - margin > datetime.now()
+
+        cached = _token_cache.get(dbname)
+        if valid(cached):
+            TEAMS_TOKEN_STATS['memory'] += 1
+            return cached[0]
+        with _token_lock:
+            cached = _token_cache.get(dbname)
+            if valid(cached):
+                TEAMS_TOKEN_STATS['memory'] += 1
+                return cached[0]
+            cached = self._read_access_token(self.env.cr)
+            if valid(cached):
+                TEAMS_TOKEN_STATS['database'] += 1
+            else:
+                with self.pool.cursor() as cr:
+                    cr.execute("SELECT pg_advisory_xact_lock(%s)", (TEAMS_TOKEN_LOCK,))
+                    cached = self._read_access_token(cr)
+                    if valid(cached):
+                        TEAMS_TOKEN_STATS['database'] += 1
+                    else:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        env['res.users'].browse(TEAMS_TOKEN_USER_ID).refresh_token()
+                        env['res.users'].flush()
+                        cached = self._read_access_token(cr)
+                        TEAMS_TOKEN_STATS['refresh'] += 1
+                        _logger.info("Microsoft Teams token refreshed, usage: %s", dict(TEAMS_TOKEN_STATS))
+            _token_cache[dbname] = cached
+            return cached[0]
+
+    def _prepare_create_payload(self, vals, user_id):
+        """ onlineMeeting body of a create request of api_crud. """
+        judged_id = self.env['res.partner'].browse(int(vals.get('judged_id')))
+
+        #attendees = self.prepare_attendee_vals(vals.get('partner_ids'))
+
+        tenantId = TEAMS_TENANT_ID
+        try:
+            description = vals.get("description").replace("\n", " - ")
+        except:
+            description = vals.get("description")
+
+        # Convertir las cadenas de fecha y hora a objetos datetime
+        start_datetime = datetime.strptime(vals.get('start'), '%Y-%m-%d %H:%M:%S')
+        end_datetime = datetime.strptime(vals.get('stop'), '%Y-%m-%d %H:%M:%S')
+
+        # Aplicar la zona horaria UTC a las fechas y horas
+        start_datetime_utc = start_datetime.replace(tzinfo=pytz.timezone('UTC'))
+        end_datetime_utc = end_datetime.replace(tzinfo=pytz.timezone('UTC'))
+
+        # Formatear las fechas y horas en el nuevo formato
+        formatted_start = start_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        formatted_end = end_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+        coorganizers = vals.get('coorganizer')
+
+        payload = {
+            "creationDateTime": formatted_start,
+            "startDateTime": formatted_start,
+            "endDateTime": formatted_end,
+            "isBroadcast": False,
+            #"autoAdmittedUsers": "everyone",
+            #"outerMeetingAutoAdmittedUsers": "everyone",
+            "capabilities": [],
+            "externalId": None,
+            "iCalUid": None,
+            "meetingType": None,
+            "meetingsMigrationMode": None,
+            "subject": vals.get("displayName") if vals.get("displayName") else None,
+            "videoTeleconferenceId": None,
+            "isEntryExitAnnounced": False,
+            "allowedPresenters": "organizer",
+            "allowAttendeeToEnableMic": True,
+            "allowAttendeeToEnableCamera": True,
+            "allowMeetingChat": "limited",
+            "shareMeetingChatHistoryDefault": "none",
+            "allowTeamworkReactions": False,
+            "anonymizeIdentityForRoles": [],
+            "recordAutomatically": False,
+            "allowParticipantsToChangeName": False,
+            "allowTranscription": True,
+            "allowRecording": True,
+            "allowCloudRecording": True,
+            "meetingTemplateId": "customtemplate_b37c308d-4d3b-4ef5-ab65-3cb86a438436",
+            "broadcastSettings": None,
+            #"meetingInfo": vals.get("description") if vals.get("description") else None,
+            "audioConferencing": None,
+            "watermarkProtection": False,
+            "chatRestrictions": None,
+            "isDialInBypassEnabled": True,
+            "isEntryExitAnnounced": False,
+            "lobbyBypassSettings": {
+                "scope": "everyone"
+            },
+            "watermarkProtection": {
+                "isEnabledForContentSharing": False,
+                "isEnabledForVideo": False
+            },
+            "joinMeetingIdSettings": {
+                "isPasscodeRequired": True
+            },
+            "participants": {
+                "organizer": {
+                    "upn": self.env.user.company_id.client_email,
+                    "role": "presenter",
+                    "identity": {
+                        "application": None,
+                        "device": None,
+                        "user": {
+                            "id": user_id,
+                            "displayName": None,
+                            "tenantId": tenantId,
+                            "identityProvider": "AAD"
                         }
-                    },
-                    "attendees": [
-                        {
-                            "upn": judged_id.email,
-                            "role": "coorganizer",
-                        },
-                        {
-                            "upn": judged_id.email,
-                            "role": "presenter",
-                        },
-                    ]
-                }
-            }
-
-            # Agregar los coorganizadores adicionales como coorganizadores y presentadores
-            if coorganizers:
-                for email in coorganizers.split(','):
-                    payload["participants"]["attendees"].append({
-                        "upn": email.strip(),
+                    }
+                },
+                "attendees": [
+                    {
+                        "upn": judged_id.email,
                         "role": "coorganizer",
-                    })
-                    payload["participants"]["attendees"].append({
-                        "upn": email.strip(),
+                    },
+                    {
+                        "upn": judged_id.email,
                         "role": "presenter",
-                    })
-
-            #_logger.error(payload)
-            try:
-                meeting_obj = requests.request(
-                    "POST", url, headers=header, json=payload)
-            except requests.exceptions.ConnectionError:
-                _logger.exception("No se pudo establecer la conexión en %s", url)
-                raise ValidationError(
-                    _("No se pudo establecer la conexión con Microsoft Teams.")
-                    )
-            except requests.exceptions.HTTPError:
-                _logger.exception(
-                    "Invalid API request at %s", url
-                    )
-                raise ValidationError(
-                    _(
-                        "Webshipper: Invalid API request at %s",
-                        url,
-                        )
-                    )
-            if meeting_obj.status_code in [201, 200]:
-                meeting = meeting_obj.json()
-                #_logger.error(meeting)
-                # Decodificar el contenido
-                decoded_content = urllib.parse.unquote(meeting.get('joinInformation').get('content'))
-                meeting_id = meeting.get('id')
-                join_url = meeting.get('joinUrl')
-                meetingCode = meeting.get('meetingCode')
-                videoTeleconferenceId = meeting.get('videoTeleconferenceId')
-                organizer_id = user_id
-                tenant_id = tenantId
-                thread_id = meeting.get('chatInfo').get('threadId')
-                passCode = meeting.get('joinMeetingIdSettings').get('passcode')
-                conferenceId = meeting.get('audioConferencing').get('conferenceId')
-                tollNumber = meeting.get('audioConferencing').get('tollNumber')
-                dialinUrl = meeting.get('audioConferencing').get('dialinUrl')
-                tel = f"tel:{tollNumber},,{conferenceId}#"
-
-                content_html = """
-                    <div style="max-width: 520px; color: #242424; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif" class="me-email-text">
-                    <div style="margin-bottom:24px;overflow:hidden;white-space:nowrap;">________________________________________________________________________________</div>
-
-                    <div style="margin-bottom:12px;">
-                        <span class="me-email-text" style="font-size: 24px;font-weight: 700;margin-right:12px;">Reunión de Microsoft Teams</span>
-                        <a id="meet_invite_block.action.help" class="me-email-link" style="font-size:14px;text-decoration:underline;color: #5B5FC7;" href="https://aka.ms/JoinTeamsMeeting?omkt=en-US">Necesita Ayuda?</a>
-                    </div>
-                    <div style="margin-top:0px; margin-bottom:0px; font-weight:bold">
-                        <span style="font-size:14px; color:#252424">
-                            Únase a través de su ordenador, aplicación móvil o dispositivo de sala
-                        </span>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 20px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{joinUrl}" target="_blank" rel="noreferrer noopener">
-                            Haga clic aquí para unirse a la reunión
-                        </a>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
-                            ID de la reunión: <b>{meetingCode}</b>
-                        </span>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
-                            Código de acceso: <b>{passCode}</b>
-                        </span>
-                    </div>
-                    <div style="margin-bottom:24px;overflow:hidden;white-space:nowrap;">________________________________________________________________________________</div>
-                    <div style="margin-top:0px; margin-bottom:10px; font-weight:bold">
-                        <span style="font-size:14px; color:#252424">
-                            Marcar por teléfono
-                        </span>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 16px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{tel}" target="_blank" rel="noreferrer noopener">
-                            {tollNumber},,{conferenceId}# Colombia, Bogotá
-                        </a>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 16px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{dialinUrl}" target="_blank" rel="noreferrer noopener">
-                            Buscar un número local
-                        </a>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
-                            Id. de conferencia telefónica: <b>{meetingCode}#</b>
-                        </span>
-                    </div>
-                    <div style="margin-top:10px; margin-bottom:0px; font-weight:bold">
-                        <span style="font-size:14px; color:#252424">
-                            Unirse en un dispositivo de videoconferencia
-                        </span>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
-                            Clave de inquilino: <a href="mailto:teams@cendoj.onpexip.com">teams@cendoj.onpexip.com</a>
-                        </span>
-                    </div>
-                    <div style="margin-bottom:6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
-                            ID del video o dispositivo de sala: <b>{videoTeleconferenceId}</b>
-                        </span>
-                    </div>
-
-                    <!--<div style="margin-bottom: 6px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px; color: #616161;">Video ID: </span>
-                        <span class="me-email-text" style="font-size: 14px; color: #242424;">111 108 139 5</span>
-                    </div>-->
-                    <div style="font-size:14px">
-                        <a href="https://pexip.me/teams/cendoj.onpexip.com/{videoTeleconferenceId2}" class="me-email-link" style="font-size:14px; text-decoration:underline;color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
-                            Más información
-                        </a>
-                    </div>
-
-                    <div style="font-size:14px">
-                        <a href="https://www.microsoft.com/en-us/microsoft-teams/download-app" class="me-email-link" style="font-size:14px; text-decoration:underline;color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
-                            Descargar Teams
-                        </a>
-                        <a href="https://www.microsoft.com/microsoft-teams/join-a-meeting" class="me-email-link" style="font-size:14px; text-decoration:underline; color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
-                            Unirse en la web
-                        </a>
-                    </div>
-                    <div>
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">Para organizadores: </span>
-                        <a id="meet_invite_block.action.organizer_meet_options" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://teams.microsoft.com/meetingOptions/?organizerId={organizer_id}&tenantId={tenant_id}&threadId={thread_id}&messageId=0&language=en-US" rel="noreferrer noopener">
-                            Opciones de la réunion
-                        </a>
-                        <span style="color: #D1D1D1">|</span>
-                        <a id="meet_invite_block.action.organizer_reset_dialin_pin" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://dialin.teams.microsoft.com/usp/pstnconferencing" rel="noreferrer noopener">
-                            Restablecer PIN de acceso telefónico
-                        </a>
-                    </div>
-                    <div style="margin-top: 15px;">
-                        <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">Para organizadores: </span>
-                        <a id="meet_invite_block.action.organizer_meet_options" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://www.ramajudicial.gov.co/portal/politicas-de-privacidad-y-condiciones-de-uso" rel="noreferrer noopener">
-                            Privacidad y seguridad
-                        </a>
-                    </div>
-                """.format(
-                        meetingCode=meetingCode,
-                        passCode=passCode,
-                        dialinUrl=dialinUrl,
-                        tollNumber=tollNumber,
-                        conferenceId=conferenceId,
-                        tel=tel,
-                        videoTeleconferenceId=videoTeleconferenceId,
-                        videoTeleconferenceId2=videoTeleconferenceId,
-                        joinUrl=join_url,
-                        organizer_id=organizer_id,
-                        tenant_id=tenant_id,
-                        thread_id=thread_id
-                    )
-
-                return {
-                    "meeting_body": content_html if content_html else '',
-                    "meeting_url": join_url if join_url else False,
-                    "meeting_id": meeting_id if meeting_id else False,
-                    "meeting_passcode": passCode if passCode else False,
-                    "meeting_conference_id": conferenceId if conferenceId else False,
-                    "meeting_toll_number": tollNumber if tollNumber else False,
-                    "meeting_dial_url": dialinUrl if dialinUrl else False,
-                    "action": 'CREATED'
-                }
-            else:
-                error_body = meeting_obj.json().get('error')
-                error_message = "Error creating online meeting link" + \
-                    "\nStatus Code: %d \nReason: %s\n" % (
-                        meeting_obj.status_code, meeting_obj.reason) + \
-                            "Error: %s\nError Message: %s\n" % (
-                                error_body.get('code'), error_body.get('message'))
-
-                raise ValidationError(error_message)
-
-        def api_update(values):
-            """Update properties of existing Teams Meeting event. only meeting
-            organizer(Who enables 'teams_link_check' boolean) can update event.
-            """
-            active_user = self.env['res.users'].browse(2)
-            """Generate Microsoft Teams Meeting link
-            Get new Access token if older one is expired
-            """
-            active_user.refresh_token()
-            if active_user.is_authenticated:
-                if active_user.token_expire:
-                    if active_user.token_expire <= datetime.now():
-                        active_user.refresh_token()
-                else:
-                    raise ValidationError("Generar nuevo token para el agendamiento usando Microsoft Teams.")
-
-            if active_user.teams_refresh_token and not active_user.teams_access_token:
-                active_user.refresh_token()
-            token = active_user.teams_access_token
-
-            # Primero obtenemos el ID del usuario con el que vamos a crear los teams
-            url = f"https://graph.microsoft.com/v1.0/users/{self.env.user.company_id.client_email}"
-            # Encabezados de la solicitud
-            headers = {
-                "Authorization": f"Bearer {token}"
-            }
-            try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()  # Verificar si hay errores en la respuesta HTTP
-                user_data = response.json()
-                user_id = user_data.get('id')
-            except requests.exceptions.RequestException as e:
-                raise ValidationError(f"No se pudo obtener el ID del usuario: {e}")
-
-            calendar_appointment = self.env['calendar.appointment'].search([('teams_uuid', '=', vals.get('teams_uuid'))])
-            judged_id = calendar_appointment.appointment_type_id.judged_id
-
-            if not active_user.is_authenticated:
-                raise ValidationError("Genere un token de acceso para crear una reunión de Microsoft Teams")
-
-            tenantId = "622cba98-80f8-41f3-8df5-8eb99901598b"
-            update_url = f"https://graph.microsoft.com/v1.0/users/{user_id}/onlineMeetings/{values.get('teams_uuid')}"
-            header = {
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(token)
+                    },
+                ]
             }
+        }
+
+        # Agregar los coorganizadores adicionales como coorganizadores y presentadores
+        if coorganizers:
+            for email in coorganizers.split(','):
+                payload["participants"]["attendees"].append({
+                    "upn": email.strip(),
+                    "role": "coorganizer",
+                })
+                payload["participants"]["attendees"].append({
+                    "upn": email.strip(),
+                    "role": "presenter",
+                })
+
+        return payload
+
+    def _parse_create_response(self, meeting, user_id):
+        """ api_crud result of a created onlineMeeting. """
+        tenantId = TEAMS_TENANT_ID
+        #_logger.error(meeting)
+        # Decodificar el contenido
+        decoded_content = urllib.parse.unquote(meeting.get('joinInformation').get('content'))
+        meeting_id = meeting.get('id')
+        join_url = meeting.get('joinUrl')
+        meetingCode = meeting.get('meetingCode')
+        videoTeleconferenceId = meeting.get('videoTeleconferenceId')
+        organizer_id = user_id
+        tenant_id = tenantId
+        thread_id = meeting.get('chatInfo').get('threadId')
+        passCode = meeting.get('joinMeetingIdSettings').get('passcode')
+        conferenceId = meeting.get('audioConferencing').get('conferenceId')
+        tollNumber = meeting.get('audioConferencing').get('tollNumber')
+        dialinUrl = meeting.get('audioConferencing').get('dialinUrl')
+        tel = f"tel:{tollNumber},,{conferenceId}#"
+
+        content_html = """
+            <div style="max-width: 520px; color: #242424; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif" class="me-email-text">
+            <div style="margin-bottom:24px;overflow:hidden;white-space:nowrap;">________________________________________________________________________________</div>
+
+            <div style="margin-bottom:12px;">
+                <span class="me-email-text" style="font-size: 24px;font-weight: 700;margin-right:12px;">Reunión de Microsoft Teams</span>
+                <a id="meet_invite_block.action.help" class="me-email-link" style="font-size:14px;text-decoration:underline;color: #5B5FC7;" href="https://aka.ms/JoinTeamsMeeting?omkt=en-US">Necesita Ayuda?</a>
+            </div>
+            <div style="margin-top:0px; margin-bottom:0px; font-weight:bold">
+                <span style="font-size:14px; color:#252424">
+                    Únase a través de su ordenador, aplicación móvil o dispositivo de sala
+                </span>
+            </div>
+            <div style="margin-bottom:6px;">
+                <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 20px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{joinUrl}" target="_blank" rel="noreferrer noopener">
+                    Haga clic aquí para unirse a la reunión
+                </a>
+            </div>
+            <div style="margin-bottom:6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
+                    ID de la reunión: <b>{meetingCode}</b>
+                </span>
+            </div>
+            <div style="margin-bottom:6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
+                    Código de acceso: <b>{passCode}</b>
+                </span>
+            </div>
+            <div style="margin-bottom:24px;overflow:hidden;white-space:nowrap;">________________________________________________________________________________</div>
+            <div style="margin-top:0px; margin-bottom:10px; font-weight:bold">
+                <span style="font-size:14px; color:#252424">
+                    Marcar por teléfono
+                </span>
+            </div>
+            <div style="margin-bottom:6px;">
+                <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 16px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{tel}" target="_blank" rel="noreferrer noopener">
+                    {tollNumber},,{conferenceId}# Colombia, Bogotá
+                </a>
+            </div>
+            <div style="margin-bottom:6px;">
+                <a id="meet_invite_block.action.join_link" class="me-email-headline" style="font-size: 16px;font-weight:600;text-decoration:underline;color: #5B5FC7;" href="{dialinUrl}" target="_blank" rel="noreferrer noopener">
+                    Buscar un número local
+                </a>
+            </div>
+            <div style="margin-bottom:6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
+                    Id. de conferencia telefónica: <b>{meetingCode}#</b>
+                </span>
+            </div>
+            <div style="margin-top:10px; margin-bottom:0px; font-weight:bold">
+                <span style="font-size:14px; color:#252424">
+                    Unirse en un dispositivo de videoconferencia
+                </span>
+            </div>
+            <div style="margin-bottom:6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
+                    Clave de inquilino: <a href="mailto:teams@cendoj.onpexip.com">teams@cendoj.onpexip.com</a>
+                </span>
+            </div>
+            <div style="margin-bottom:6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">
+                    ID del video o dispositivo de sala: <b>{videoTeleconferenceId}</b>
+                </span>
+            </div>
+
+            <!--<div style="margin-bottom: 6px;">
+                <span class="me-email-text-secondary" style="font-size: 14px; color: #616161;">Video ID: </span>
+                <span class="me-email-text" style="font-size: 14px; color: #242424;">111 108 139 5</span>
+            </div>-->
+            <div style="font-size:14px">
+                <a href="https://pexip.me/teams/cendoj.onpexip.com/{videoTeleconferenceId2}" class="me-email-link" style="font-size:14px; text-decoration:underline;color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
+                    Más información
+                </a>
+            </div>
+
+            <div style="font-size:14px">
+                <a href="https://www.microsoft.com/en-us/microsoft-teams/download-app" class="me-email-link" style="font-size:14px; text-decoration:underline;color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
+                    Descargar Teams
+                </a>
+                <a href="https://www.microsoft.com/microsoft-teams/join-a-meeting" class="me-email-link" style="font-size:14px; text-decoration:underline; color:#6264a7; font-family:'Segoe UI','Helvetica Neue',Helvetica,Arial,sans-serif">
+                    Unirse en la web
+                </a>
+            </div>
+            <div>
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">Para organizadores: </span>
+                <a id="meet_invite_block.action.organizer_meet_options" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://teams.microsoft.com/meetingOptions/?organizerId={organizer_id}&tenantId={tenant_id}&threadId={thread_id}&messageId=0&language=en-US" rel="noreferrer noopener">
+                    Opciones de la réunion
+                </a>
+                <span style="color: #D1D1D1">|</span>
+                <a id="meet_invite_block.action.organizer_reset_dialin_pin" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://dialin.teams.microsoft.com/usp/pstnconferencing" rel="noreferrer noopener">
+                    Restablecer PIN de acceso telefónico
+                </a>
+            </div>
+            <div style="margin-top: 15px;">
+                <span class="me-email-text-secondary" style="font-size: 14px;color: #616161;">Para organizadores: </span>
+                <a id="meet_invite_block.action.organizer_meet_options" class="me-email-link" style="font-size: 14px;text-decoration:underline;color: #5B5FC7;" target="_blank" href="https://www.ramajudicial.gov.co/portal/politicas-de-privacidad-y-condiciones-de-uso" rel="noreferrer noopener">
+                    Privacidad y seguridad
+                </a>
+            </div>
+        """.format(
+                meetingCode=meetingCode,
+                passCode=passCode,
+                dialinUrl=dialinUrl,
+                tollNumber=tollNumber,
+                conferenceId=conferenceId,
+                tel=tel,
+                videoTeleconferenceId=videoTeleconferenceId,
+                videoTeleconferenceId2=videoTeleconferenceId,
+                joinUrl=join_url,
+                organizer_id=organizer_id,
+                tenant_id=tenant_id,
+                thread_id=thread_id
+            )
 
+        return {
+            "meeting_body": content_html if content_html else '',
+            "meeting_url": join_url if join_url else False,
+            "meeting_id": meeting_id if meeting_id else False,
+            "meeting_passcode": passCode if passCode else False,
+            "meeting_conference_id": conferenceId if conferenceId else False,
+            "meeting_toll_number": tollNumber if tollNumber else False,
+            "meeting_dial_url": dialinUrl if dialinUrl else False,
+            "action": 'CREATED'
+        }
+
+    def _prepare_request(self, vals, user_id):
+        """ (http method, Graph path, json body) of an api_crud request. """
+        if vals["method"] == "create":
+            return "POST", "/users/%s/onlineMeetings" % user_id, self._prepare_create_payload(vals, user_id)
+        elif vals["method"] == "update":
             # Convertir las cadenas de fecha y hora a objetos datetime
             start_datetime = datetime.strptime(vals.get('start'), '%Y-%m-%d %H:%M:%S')
             end_datetime = datetime.strptime(vals.get('stop'), '%Y-%m-%d %H:%M:%S')
-
-            # Aplicar la zona horaria UTC a las fechas y horas
-            start_datetime_utc = start_datetime.replace(tzinfo=pytz.timezone('UTC'))
-            end_datetime_utc = end_datetime.replace(tzinfo=pytz.timezone('UTC'))
-
-            # Formatear las fechas y horas en el nuevo formato
-            formatted_start = start_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            formatted_end = end_datetime_utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-
-            coorganizers = calendar_appointment.coorganizer
-
             payload = {
-                "startDateTime": formatted_start,
-                "endDateTime": formatted_end,
+                "startDateTime": start_datetime.replace(tzinfo=pytz.timezone('UTC')).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                "endDateTime": end_datetime.replace(tzinfo=pytz.timezone('UTC')).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
             }
-            #_logger.error(payload)
+            return "PATCH", "/users/%s/onlineMeetings/%s" % (user_id, vals.get('teams_uuid')), payload
+        elif vals["method"] == "delete":
+            return "DELETE", "/users/%s/onlineMeetings/%s" % (user_id, vals.get('teams_uuid')), None
+        raise ValidationError("Unknown Teams method: %s" % vals["method"])
 
-            if payload:
+    def _parse_response(self, vals, user_id, status_code, reason, body):
+        """ Result of an api_crud request from the Graph response.
+
+            :raise ValidationError: when Graph answered with an error
+        """
+        method = vals["method"]
+        if method == "create" and status_code in [201, 200]:
+            return self._parse_create_response(body, user_id)
+        elif method == "update" and status_code == 200:
+            return None
+        elif method == "delete" and status_code == 204:
+            return None
+        error_body = (body or {}).get('error') or body or {}
+        error_message = TEAMS_ERROR_MESSAGES[method] + \
+            "\nStatus Code: %d \nReason: %s\n" % (status_code, reason) + \
+                "Error: %s\nError Message: %s\n" % (
+                    error_body.get('code'), error_body.get('message'))
+        raise ValidationError(error_message)
+
+    def _graph_batch(self, requests_list, token):
+        """ Send Graph requests by JSON $batch of GRAPH_BATCH_SIZE requests.
+
+            Sub-requests answered with a status of http_client.RETRY_STATUSES
+            are sent again in a later batch, following the same rules as
+            http_client.request: Retry-After is honoured and a POST is only
+            sent again when Graph refused it (see http_client.can_retry).
+
+            A $batch request that fails is not sent again, as Graph may have
+            run some of its sub-requests: they get (None, exception) and the
+            results of the other batches are kept.
+
+            :param requests_list: list of (http method, path, json body)
+            :return: list of (status code, body) in the order of requests_list
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        retries = int(params.get_param('calendar_csj.graph_retries', 3))
+        results = [None] * len(requests_list)
+        pending = list(range(len(requests_list)))
+        for attempt in range(retries + 1):
+            retry, delay = [], min(0.5 * (2 ** attempt), 30)
+            for chunk in tools.split_every(GRAPH_BATCH_SIZE, pending):
+                batch = []
+                for index in chunk:
+                    method, path, payload = requests_list[index]
+                    item = {"id": str(index), "method": method, "url": path}
+                    if payload is not None:
+                        item.update(body=payload, headers={"Content-Type": "application/json"})
+                    batch.append(item)
                 try:
-                    update_response = requests.request(
-                        "PATCH", update_url, headers=header, json=payload)
-
-                except requests.exceptions.ConnectionError:
-                    _logger.exception(
-                        "Could not establish the connection at %s", update_url)
-                    raise ValidationError(
-                        _("Could not establish the connection.")
-                        )
-
-                except requests.exceptions.HTTPError:
-                    _logger.exception(
-                        "Invalid API request at %s", update_url
-                        )
-                    raise ValidationError(
-                        _(
-                            "Webshipper: Invalid API request at %s",
-                            update_url,
-                            )
-                        )
-
-                if update_response.status_code != 200:
-                    error_body = update_response.json().get('error')
-
-                    error_message = "Error updating online meeting" + \
-                        "\nStatus Code: %d \nReason: %s\n" % (
-                            update_response.status_code,
-                            update_response.reason) + \
-                                "Error: %s\nError Message: %s\n" % (
-                                    error_body.get('code'),
-                                    error_body.get('message'))
-
-                    raise ValidationError(error_message)
-
-
-        def api_delete(vals):
-            """Delete existing Teams Meeting event.only meeting
-            organizer(Who enables 'teams_link_check' boolean) can delete event.
-            """
-            active_user = self.env['res.users'].browse(2)
-            if self.env.user.is_authenticated:
-                if active_user.token_expire:
-                    if active_user.token_expire <= datetime.now():
-                        active_user.refresh_token()
-                else:
-                    raise ValidationError("Generate new token for Microsoft teams meeting.")
-            #else:
-            #    raise ValidationError("Generate an access token to delete a Microsoft Teams meeting.")
-
-            if active_user.teams_refresh_token and not active_user.teams_access_token:
-                active_user.refresh_token()
-            token = active_user.teams_access_token
-
-            # Primero obtenemos el ID del usuario con el que vamos a crear los teams
-            url = f"https://graph.microsoft.com/v1.0/users/{self.env.user.company_id.client_email}"
-            # Encabezados de la solicitud
-            headers = {
-                "Authorization": f"Bearer {token}"
-            }
+                    response = self._graph_request("POST", "/$batch", token, json={"requests": batch})
+                    if response.status_code != 200:
+                        raise ValidationError("Error en la solicitud $batch de Microsoft Teams: %s %s" % (response.status_code, response.reason))
+                    responses = response.json().get("responses", [])
+                except Exception as e:
+                    _logger.warning("Graph $batch of %s requests failed: %s", len(chunk), e)
+                    for index in chunk:
+                        results[index] = (None, e)
+                    continue
+                for item in responses:
+                    index, status = int(item["id"]), item["status"]
+                    retry_after = http_client.parse_retry_after((item.get("headers") or {}).get("Retry-After"))
+                    retryable = http_client.can_retry(requests_list[index][0], status, retry_after)
+                    if retryable and attempt < retries and (retry_after is None or retry_after <= 30):
+                        retry.append(index)
+                        delay = max(delay, retry_after or 0)
+                    else:
+                        results[index] = (status, item.get("body"))
+            if not retry:
+                break
+            _logger.warning("Graph $batch: %s requests throttled, retry %s/%s in %.1fs", len(retry), attempt + 1, retries, delay)
+            time.sleep(delay)
+            pending = retry
+        missing = ValidationError("Microsoft Teams no respondió la solicitud en el $batch")
+        return [result or (None, missing) for result in results]
+
+    def api_crud(self, vals):
+        token = self._get_access_token()
+        # ID del usuario con el que vamos a crear los teams
+        user_id = self._get_organizer_id(self.env.user.company_id.client_email, token)
+        method, path, payload = self._prepare_request(vals, user_id)
+        kwargs = {'json': payload} if payload is not None else {}
+        response = self._graph_request(method, path, token, **kwargs)
+        try:
+            body = response.json() if response.content else {}
+        except ValueError:
+            body = {}
+        return self._parse_response(vals, user_id, response.status_code, response.reason, body)
+
+    def api_crud_many(self, vals_list):
+        """ api_crud of several requests sent with Graph $batch requests,
+            the organizer and the token are looked up once.
+
+            :return: one dict per vals, in the same order, with ``success``
+                     and either ``result`` or ``error`` (the exception raised)
+        """
+        if not vals_list:
+            return []
+        token = self._get_access_token()
+        user_id = self._get_organizer_id(self.env.user.company_id.client_email, token)
+        results = [None] * len(vals_list)
+        requests_list, indexes = [], []
+        for index, vals in enumerate(vals_list):
             try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()  # Verificar si hay errores en la respuesta HTTP
-                user_data = response.json()
-                user_id = user_data.get('id')
-            except requests.exceptions.RequestException as e:
-                raise ValidationError(f"No se pudo obtener el ID del usuario: {e}")
-
-            #delete_url = "https://graph.microsoft.com/" + \
-            #    "v1.0/users/{0}/events/{1}".format(self.env.user.company_id.client_email, vals.get('teams_uuid'))
-            delete_url = f"https://graph.microsoft.com/v1.0/users/{user_id}/onlineMeetings/{vals.get('teams_uuid')}"
-            header = {
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(token)
-                }
+                requests_list.append(self._prepare_request(vals, user_id))
+                indexes.append(index)
+            except Exception as e:
+                results[index] = {"success": False, "error": e}
+        responses = self._graph_batch(requests_list, token)
+        for index, (status, body) in zip(indexes, responses):
+            if status is None:
+                # the $batch carrying the request failed
+                results[index] = {"success": False, "error": body}
+                continue
             try:
-                delete_response = requests.request(
-                    "DELETE", delete_url, headers=header)
-
-            except requests.exceptions.ConnectionError:
-                _logger.exception(
-                    "Could not establish the connection at %s", delete_url)
-                raise ValidationError(
-                    _("Could not establish the connection.")
-                    )
-
-            except requests.exceptions.HTTPError:
-                _logger.exception(
-                    "Invalid API request at %s", delete_url
-                    )
-                raise ValidationError(
-                    _(
-                        "Webshipper: Invalid API request at %s",
-                        delete_url,
-                        )
-                    )
-
-            if delete_response.status_code != 204:
-                error_body = delete_response.json()
-                error_message = "Error deleting online meeting" + \
-                    "\nStatus Code: %d \nReason: %s\n" % (
-                        delete_response.status_code, delete_response.reason) + \
-                            "Error: %s\nError Message: %s\n" % (
-                                error_body.get('code'), error_body.get('message'))
-                raise ValidationError(error_message)
-
-        if vals["method"] == "create":
-            return api_create(vals)
-        elif vals["method"] == "update":
-            return api_update(vals)
-        elif vals["method"] == "delete":
-            return api_delete(vals)
-
+                result = self._parse_response(vals_list[index], user_id, status, HTTP_REASONS.get(status, ''), body or {})
+                results[index] = {"success": True, "result": result}
+            except Exception as e:
+                results[index] = {"success": False, "error": e}
+        return results
 
     def resp2dict(self, resp):
         if resp.get("action") == "UPDATED":
@@ -1,15 +1,40 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 import datetime
 import math
 import pytz
 from dateutil.relativedelta import relativedelta
 from odoo.exceptions import UserError, ValidationError
+from ..tools import SuggestionIndex
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import logging
 _logger = logging.getLogger(__name__)
 
+# conversion applied by export_data to each exported field
+EXPORT_TRANSFORMERS = {
+    'calendar_time': 'time',
+    'end_hour': 'time',
+    'request_type': 'request_type',
+    'city_id': 'upper',
+    'country_state_id': 'upper',
+    'reception_detail': 'upper',
+    'observations': 'upper',
+    'aplicant_id': 'upper',
+    'applicant_raw_name': 'upper',
+    'room_id_mame': 'upper',
+    'class_id': 'upper',
+}
+# below this number of rows the time columns are converted without NumPy
+EXPORT_NUMPY_MIN_ROWS = 10000
+# timezone of the stored local date, time and tag of the appointments
+APPOINTMENT_TZ = 'America/Bogota'
+
 class CalendarClass(models.Model):
     _name = 'calendar.class'
     _description = 'Calendar class'
@@ -125,8 +150,8 @@ class CalendarAppointment(models.Model):
     appointment_close_user_login = fields.Char('Closing User Login', related='appointment_close_user_id.login', store=False)  # Date
     calendar_type = fields.Selection([('unique', 'Unique'), ('multi', 'Multi')], 'Calendar type', default='unique')  # Agenda
     calendar_datetime = fields.Datetime('Calendar datetime', tracking=True, required=True)  # Fechatag_number
-    calendar_date = fields.Date('Calendar date', compute='_compute_calendar_datetime')
-    calendar_time = fields.Float('Calendar time', compute='_compute_calendar_datetime')
+    calendar_date = fields.Date('Calendar date', compute='_compute_calendar_datetime', store=True, index=True)
+    calendar_time = fields.Float('Calendar time', compute='_compute_calendar_datetime', store=True)
     calendar_duration = fields.Float('Calendar duration', default=1.00)
 
     applicant_id = fields.Many2one('res.partner', 'Applicant', ondelete='set null')  # Solicitante
@@ -158,8 +183,8 @@ class CalendarAppointment(models.Model):
     request_type = fields.Selection([('l', 'Free'), ('r', 'Reserved')], 'Request type', default='r')
     request_type_label = fields.Char('Request Type Label', compute='_get_request_type_label', store=False)
     process_number = fields.Char('Process number')
-    tag_number = fields.Char('Tag number', compute='_compute_tag_number')
-    record_data = fields.Char('Record data', compute='_compute_record_data')
+    tag_number = fields.Char('Tag number', compute='_compute_tag_number', store=True, index=True)
+    record_data = fields.Char('Record data', compute='_compute_record_data', store=True)
     reception_id = fields.Many2one('calendar.reception', 'Reception medium', ondelete='set null')
     reception_detail = fields.Char('Reception Detail')
     recording_ids = fields.Many2many('calendar.recording', 'appointment_recording_rel', 'appointment_id', 'recording_id', string='Recordings')
@@ -202,6 +227,10 @@ class CalendarAppointment(models.Model):
     teams_tollnumber = fields.Char('Conexión telefónica')
     teams_dialinurl = fields.Char('Dial URL')
     teams_conference_id = fields.Char('ID Conferencia')
+    provisioning_state = fields.Selection([
+        ('pending', 'Provisioning'),
+        ('done', 'Provisioned'),
+        ('failed', 'Provisioning failed')], 'Meeting provisioning', copy=False, tracking=True)
 
     @api.depends('teams_ok')
     def _compute_platform_type(self):
@@ -273,18 +302,25 @@ class CalendarAppointment(models.Model):
                 record.applicant_id.phone if record.applicant_id.phone else '',
             )
 
+    def _get_local_datetime(self):
+        """ calendar_datetime in APPOINTMENT_TZ, the stored local fields do
+            not depend on the timezone of the user computing them. """
+        self.ensure_one()
+        if not self.calendar_datetime:
+            return False
+        return pytz.utc.localize(self.calendar_datetime).astimezone(pytz.timezone(APPOINTMENT_TZ)).replace(tzinfo=None)
+
     @api.depends('calendar_datetime')
     def _compute_record_data(self):
         for record in self:
             if record.calendar_datetime:
-                tz_offset = self.env.user.tz_offset if self.env.user.tz_offset else False
-                tz = int(tz_offset)/100 if tz_offset else 0
-                date = record.calendar_datetime + datetime.timedelta(hours=tz) if \
-                record.calendar_datetime else False
-                res = date.strftime("%Y%m%d_%H%M%S")
+                res = record._get_local_datetime().strftime("%Y%m%d_%H%M%S")
                 record.record_data = '01_' + res + '_V'
+            else:
+                record.record_data = False
 
-    @api.depends('city_id', 'room_id', 'process_number', 'partner_id', 'request_type', 'record_data')
+    @api.depends('city_id.zipcode', 'room_id.mame', 'process_number', 'type', 'request_type', 'record_data',
+                 'partner_id.entity_id.code', 'partner_id.specialty_id.code', 'partner_id.code')
     def _compute_tag_number(self):
         for record in self:
             if record.city_id and record.city_id.zipcode \
@@ -312,23 +348,9 @@ class CalendarAppointment(models.Model):
     @api.depends('calendar_datetime')
     def _compute_calendar_datetime(self):
         for record in self:
-            # record.write({'state': 'postpone'})
-            record.calendar_date = (record.calendar_datetime - datetime.timedelta(hours=5)).date() if \
-                record.calendar_datetime else False
-
-            calendar_datetime_timez = record.calendar_datetime - datetime.timedelta(hours=5)
-
-
-            tz_offset = self.env.user.tz_offset if self.env.user.tz_offset else False
-            tz = int(tz_offset)/100 if tz_offset else 0
-            if (record.calendar_datetime).hour <5:
-                record.calendar_time = (calendar_datetime_timez).hour + \
-                record.calendar_datetime.minute/60.0 if \
-                record.calendar_datetime else False
-            else:
-                record.calendar_time = (record.calendar_datetime).hour + tz + \
-                record.calendar_datetime.minute/60.0 if \
-                record.calendar_datetime else False
+            local_datetime = record._get_local_datetime()
+            record.calendar_date = local_datetime.date() if local_datetime else False
+            record.calendar_time = local_datetime.hour + local_datetime.minute / 60.0 if local_datetime else False
 
     # @api.depends('appointment_date')
     # def _get_date_today(self):
@@ -382,16 +404,16 @@ class CalendarAppointment(models.Model):
         if email.split('@')[-1] not in domain_emails:
             raise UserError('Los correos de la lista de Coorganizadores deben pertenecer a un dominio de organización valido.')
 
-    @api.model
-    def create(self, vals):
-        vals["name"] = vals.get("process_number")[0:23] + "s" + self.env[
-            "ir.sequence"
-        ].next_by_code("calendar.appointment").replace("s", "") or _("None")
+    def _prepare_create_vals(self, vals, sequence, appointment_code, tz, provisioning_async):
+        """ Complete the values of a new appointment, creating its meeting
+            unless ``provisioning_async``.
+
+            :return: (platform, api vals) of the meeting to queue, or False
+        """
+        vals["name"] = vals.get("process_number")[0:23] + "s" + sequence.replace("s", "") or _("None")
         vals["partner_id"] = vals.get("appointment_id")
         vals["sequence_icsfile_ctl"] = 1
-        vals["appointment_code"] = self.env["ir.sequence"].next_by_code(
-            "calendar.appointment.document.number"
-        )
+        vals["appointment_code"] = appointment_code
 
         if vals.get('platform') and vals.get('platform') == 'Lifesize':
             vals['platform_type'] = 'lifesize'
@@ -402,9 +424,7 @@ class CalendarAppointment(models.Model):
             self.validateCoorganizer(vals.get('coorganizer'))
         vals['coorganizer'] = vals.get('coorganizer')
 
-        online_appointment_type = self.env["calendar.appointment.type"].search(
-            [("id", "=", vals.get("appointment_type_id"))]
-        )[0]
+        online_appointment_type = self.env["calendar.appointment.type"].browse(vals.get("appointment_type_id"))
         partner = (
             online_appointment_type.judged_id
             if online_appointment_type and online_appointment_type.judged_id
@@ -427,8 +447,6 @@ class CalendarAppointment(models.Model):
                                         partner.code,
                                         room_code)
 
-            tz_offset = self.env.user.tz_offset if self.env.user.tz_offset else False
-            tz = int(tz_offset)/100 if tz_offset else 0
             calendar_datetime = fields.Datetime.from_string(vals.get('calendar_datetime'))
             date = calendar_datetime + datetime.timedelta(hours=tz) if calendar_datetime else False
             record_date = date.strftime("%Y%m%d_%H%M%S")
@@ -441,6 +459,7 @@ class CalendarAppointment(models.Model):
         if not vals.get('name'):
             raise UserError('No fue posible definir un nombre para la Sala de Lifesize. Consulte al Administrador')
 
+        provisioning = False
         # ERROR REPORT THIS JUDGED :C res.partner(11307,), False
         if partner and partner.permanent_room:
             #if not partner.teams_api_ok:
@@ -464,8 +483,6 @@ class CalendarAppointment(models.Model):
         else:
             #if partner.teams_api_ok:
             if vals.get('platform') == 'Teams':
-                tz_offset = self.env.user.tz_offset if self.env.user.tz_offset else False
-                tz = int(tz_offset)/100 if tz_offset else 0
                 calendar_datetime = fields.Datetime.from_string(vals.get('calendar_datetime'))
                 vals['calendar_duration'] = '0.083333333333333'
                 date_end = calendar_datetime + relativedelta(hours=float(vals.get('calendar_duration'))) if calendar_datetime else False
@@ -476,27 +493,64 @@ class CalendarAppointment(models.Model):
                     'judged_id': online_appointment_type.judged_id.id,
                     'coorganizer': vals.get('coorganizer') if vals.get('coorganizer') else False,
                 })
-                vals.update(self.create_teams(vals))
+                if provisioning_async:
+                    provisioning = ('teams', self._prepare_teams_api(vals))
+                else:
+                    vals.update(self.create_teams(vals))
                 if 'start' in vals:
                     vals.pop('start')
                 if 'stop' in vals:
                     vals.pop('stop')
                 if 'judged_id' in vals:
                     vals.pop('judged_id')
+            elif provisioning_async:
+                provisioning = ('lifesize', self._prepare_lifesize_api(vals))
             else:
                 vals.update(self.create_lifesize(vals))
             _logger.error("\nSTATUS: CREADA EN TEAMS {}".format(vals))
-        res = super(CalendarAppointment, self).create(vals)
-        return res
+        if provisioning:
+            vals['provisioning_state'] = 'pending'
+        return provisioning
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """ Besides the bookings of the portal, whole weekly plans are imported
+            at once: the sequences are reserved by blocks, the appointment
+            types, judged and rooms are read once for all the appointments,
+            and the meetings of several appointments are always created by
+            the outbox. """
+        Sequence = self.env["ir.sequence"]
+        sequences = Sequence.next_block_by_code("calendar.appointment", len(vals_list))
+        appointment_codes = Sequence.next_block_by_code("calendar.appointment.document.number", len(vals_list))
+        # prefetch what _prepare_create_vals reads
+        appointment_types = self.env["calendar.appointment.type"].browse(
+            {vals["appointment_type_id"] for vals in vals_list if vals.get("appointment_type_id")})
+        judged = appointment_types.mapped('judged_id')
+        for path in ('city_id.zipcode', 'entity_id.code', 'specialty_id.code'):
+            judged.mapped(path)
+        self.env['res.judged.room'].browse({int(vals['room_id']) for vals in vals_list if vals.get('room_id')}).mapped('mame')
+
+        tz_offset = self.env.user.tz_offset if self.env.user.tz_offset else False
+        tz = int(tz_offset)/100 if tz_offset else 0
+        provisioning_async = self._provisioning_async() or len(vals_list) > 1
+        provisionings = [
+            self._prepare_create_vals(vals, sequence, appointment_code, tz, provisioning_async)
+            for vals, sequence, appointment_code in zip(vals_list, sequences, appointment_codes)
+        ]
+        records = super(CalendarAppointment, self).create(vals_list)
+        for record, provisioning in zip(records, provisionings):
+            if provisioning:
+                # the meeting is created by the outbox once the booking is committed
+                self.env['calendar.appointment.outbox']._enqueue(record, provisioning[0], provisioning[1], notify=True)
+        return records
 
     def unlink(self):
-        if self.platform_type == 'teams':
-            self.unlink_teams()
-        else:
-            self.unlink_lifesize()
+        teams = self.filtered(lambda appointment: appointment.platform_type == 'teams')
+        teams.unlink_teams()
+        (self - teams).unlink_lifesize()
         return super(CalendarAppointment, self).unlink()
 
-    def create_lifesize(self, vals):
+    def _prepare_lifesize_api(self, vals):
         api = {
             'method': 'create',
             'displayName': vals.get('name'),
@@ -508,8 +562,7 @@ class CalendarAppointment(models.Model):
         judged_extension_lifesize = False
         if vals.get('appointment_type_id'):
             #SEARCH appointment type
-            online_appointment_type = self.env['calendar.appointment.type'].search(
-                [('id', '=', vals.get('appointment_type_id'))])[0]
+            online_appointment_type = self.env['calendar.appointment.type'].browse(vals.get('appointment_type_id'))
             #SELECT partner from judged_id field
             partner = online_appointment_type.judged_id if online_appointment_type \
                 and online_appointment_type.judged_id else False
@@ -541,11 +594,14 @@ class CalendarAppointment(models.Model):
             api.update(lecturerExtension=self.env.user.company_id.lecturer_extension)
         # if self.env.user.company_id.moderator_extension:
         #     api.update(moderatorExtension=self.env.user.company_id.moderator_extension)
-        resp = self.env['api.lifesize'].api_crud(api)
+        return api
+
+    def create_lifesize(self, vals):
+        resp = self.env['api.lifesize'].api_crud(self._prepare_lifesize_api(vals))
         dic = self.env['api.lifesize'].resp2dict(resp)
         return dic
 
-    def create_teams(self, vals):
+    def _prepare_teams_api(self, vals):
         api = {
             'method': 'create',
             'displayName': vals.get('name'),
@@ -558,8 +614,7 @@ class CalendarAppointment(models.Model):
 
         judged_extension_lifesize = False
         if vals.get('appointment_type_id'):
-            online_appointment_type = self.env['calendar.appointment.type'].search(
-                [('id', '=', vals.get('appointment_type_id'))])[0]
+            online_appointment_type = self.env['calendar.appointment.type'].browse(vals.get('appointment_type_id'))
             partner = online_appointment_type.judged_id if online_appointment_type \
                 and online_appointment_type.judged_id else False
             if partner and partner.extension_lifesize:
@@ -589,8 +644,10 @@ class CalendarAppointment(models.Model):
             api.update(description=vals.get('observations'))
         if self.env.user.company_id.lecturer_extension:
             api.update(lecturerExtension=self.env.user.company_id.lecturer_extension)
+        return api
 
-        resp = self.env['api.teams'].api_crud(api)
+    def create_teams(self, vals):
+        resp = self.env['api.teams'].api_crud(self._prepare_teams_api(vals))
         dic = self.env['api.teams'].resp2dict(resp)
         return dic
 
@@ -636,8 +693,8 @@ class CalendarAppointment(models.Model):
                     'moderatorExtension': judged_extension_lifesize or \
                         self.env.user.company_id.owner_extension,
                 }
-                resp = self.env['api.lifesize'].api_crud(api)
-                dic = self.env['api.lifesize'].resp2dict(resp)
+                resp = record._call_provider('lifesize', api)
+                dic = self.env['api.lifesize'].resp2dict(resp) if resp else {}
                 dic.update(state='postpone')
             else:
                 _logger.error('\nSTATUS: NO MODIFICADA EN LIFESIZE')
@@ -652,11 +709,12 @@ class CalendarAppointment(models.Model):
                     'method': 'delete',
                     'uuid': record.lifesize_uuid,
                 }
-                self.env['api.lifesize'].api_crud(api)
+                record._call_provider('lifesize', api)
             else:
                 _logger.error('\nSTATUS: NO CANCELADA EN LIFESIZE')
 
     def write_teams(self, vals):
+        requests = []
         for record in self:
             partner = record.partner_id
             description = ("Updated to: %s " % (
@@ -695,12 +753,13 @@ class CalendarAppointment(models.Model):
                 'start': str(datetime.datetime.strptime(str(vals.get('start')), '%Y-%m-%d %H:%M:%S')),
                 'stop': str(datetime.datetime.strptime(str(vals.get('stop')), '%Y-%m-%d %H:%M:%S')),
             }
-            resp = self.env['api.teams'].api_crud(api)
+            requests.append((record, api))
             dic = {'state':'postpone'}
-
+        self._call_provider_many('teams', requests)
         return dic
 
     def unlink_teams(self):
+        requests = []
         for record in self:
             partner = record.partner_id
             _logger.error('\n{}, {}'.format(partner,partner.permanent_room))
@@ -709,9 +768,10 @@ class CalendarAppointment(models.Model):
                     'method': 'delete',
                     'teams_uuid': record.teams_uuid,
                 }
-                self.env['api.teams'].api_crud(api)
+                requests.append((record, api))
             else:
                 _logger.error('\nSTATUS: NO CANCELADA EN LIFESIZE')
+        self._call_provider_many('teams', requests)
 
     def create_event(self, vals):
         dic = {}
@@ -835,7 +895,11 @@ class CalendarAppointment(models.Model):
                 'lifesize_meeting_ext': None,
                 'lifesize_moderator': None,
             })
-            vals.update(self.create_teams(vals))
+            if self._provisioning_async():
+                self.env['calendar.appointment.outbox']._enqueue(self, 'teams', self._prepare_teams_api(vals))
+                vals['provisioning_state'] = 'pending'
+            else:
+                vals.update(self.create_teams(vals))
             self.unlink_lifesize()
             if 'start' in vals:
                 vals.pop('start')
@@ -861,11 +925,14 @@ class CalendarAppointment(models.Model):
         self.event_id.write(dic)
         self.event_id.cancel_calendar_event()
         self.state = 'cancel'
-        if self.teams_ok:
-            self.unlink_teams()
-        else:
-            self.write_lifesize(dic)
-            self.unlink_lifesize()
+        # several appointments are queued, the outbox batches their Graph calls
+        records = self.with_context(provisioning_async=True) if len(self) > 1 else self
+        teams = records.filtered('teams_ok')
+        teams.unlink_teams()
+        lifesize = records - teams
+        if lifesize:
+            lifesize.write_lifesize(dic)
+            lifesize.unlink_lifesize()
 
     def action_postpone(self):
         self.write({'state': 'postpone'})
@@ -875,82 +942,60 @@ class CalendarAppointment(models.Model):
         val = abs(float_val)
         return (factor * int(math.floor(val)), int(round((val % 1) * 60)))
 
+    def _export_float_time_column(self, values):
+        """ Float hours to 'HH:MM:00', with NumPy for big exports when available. """
+        filled = [index for index, value in enumerate(values) if value not in ('', False, None)]
+        floats = [float(values[index]) for index in filled]
+        if numpy is not None and len(floats) >= EXPORT_NUMPY_MIN_ROWS:
+            array = numpy.array(floats, dtype=float)
+            hours = (numpy.sign(array) + (array == 0)) * numpy.floor(numpy.abs(array))
+            minutes = numpy.round(numpy.abs(array) % 1 * 60)
+            pairs = zip(hours.astype(int).tolist(), minutes.astype(int).tolist())
+        else:
+            pairs = (self.float_time_convert(value) for value in floats)
+        result = list(values)
+        for index, (hour, minute) in zip(filled, pairs):
+            result[index] = '{0:02d}:{1:02d}:00'.format(hour, minute)
+        return result
+
     def export_data(self, fields_to_export):
         """ Override to fix hour format in export file """
         res = super(CalendarAppointment, self).export_data(fields_to_export)
-        index = range(len(fields_to_export))
-        fields_name = dict(zip(fields_to_export,index))
-        try:
-            for index, val in enumerate(res['datas']):
-                if fields_name.get('calendar_time'):
-                    fieldindex = fields_name.get('calendar_time')
-                    calendar_time = float(res['datas'][index][fieldindex])
-                    hour, minute = self.float_time_convert(calendar_time)
-                    res['datas'][index][fieldindex] = '{0:02d}:{1:02d}:00'.format(hour, minute)
-                if fields_name.get('end_hour'):
-                    fieldindex = fields_name.get('end_hour')
-                    end_hour = float(res['datas'][index][fieldindex])
-                    hour, minute = self.float_time_convert(end_hour)
-                    res['datas'][index][fieldindex] = '{0:02d}:{1:02d}:00'.format(hour, minute)
-
-                if fields_name.get('request_type'):
-                    fieldindex = fields_name.get('request_type')
-                    request_type_value = str(res['datas'][index][fieldindex])
-                    request_type_value = 'L' if request_type_value == 'Libre' else 'R'
-                    res['datas'][index][fieldindex] = request_type_value
-
-                if fields_name.get('city_id'):
-                    fieldindex = fields_name.get('city_id')
-                    city_id = str(res['datas'][index][fieldindex])
-                    city_id = city_id.upper()
-                    res['datas'][index][fieldindex] = city_id
-
-                if fields_name.get('country_state_id'):
-                    fieldindex = fields_name.get('country_state_id')
-                    country_state_id = str(res['datas'][index][fieldindex])
-                    country_state_id = country_state_id.upper()
-                    res['datas'][index][fieldindex] = country_state_id
-
-                if fields_name.get('reception_detail'):
-                    fieldindex = fields_name.get('reception_detail')
-                    reception_detail = str(res['datas'][index][fieldindex])
-                    reception_detail = reception_detail.upper()
-                    res['datas'][index][fieldindex] = reception_detail
-
-                if fields_name.get('observations'):
-                    fieldindex = fields_name.get('observations')
-                    observations = str(res['datas'][index][fieldindex])
-                    observations = observations.upper()
-                    res['datas'][index][fieldindex] = observations
-
-                if fields_name.get('aplicant_id'):
-                    fieldindex = fields_name.get('aplicant_id')
-                    aplicant_id = str(res['datas'][index][fieldindex])
-                    aplicant_id = aplicant_id.upper()
-                    res['datas'][index][fieldindex] = aplicant_id
-
-                if fields_name.get('applicant_raw_name'):
-                    fieldindex = fields_name.get('applicant_raw_name')
-                    applicant_raw_name = str(res['datas'][index][fieldindex])
-                    applicant_raw_name = applicant_raw_name.upper()
-                    res['datas'][index][fieldindex] = applicant_raw_name
-
-                if fields_name.get('room_id_mame'):
-                    fieldindex = fields_name.get('room_id_mame')
-                    room_id_mame = str(res['datas'][index][fieldindex])
-                    room_id_mame = room_id_mame.upper()
-                    res['datas'][index][fieldindex] = room_id_mame
-
-                if fields_name.get('class_id'):
-                    fieldindex = fields_name.get('class_id')
-                    class_id = str(res['datas'][index][fieldindex])
-                    class_id = class_id.upper()
-                    res['datas'][index][fieldindex] = class_id
-
-
-
-        except Exception as e:
-            raise UserError('It was not possible to convert the time format when exporting the file.')
+        datas = res['datas']
+        if not datas:
+            return res
+        transformers = {
+            name: EXPORT_TRANSFORMERS[name]
+            for name in fields_to_export if name in EXPORT_TRANSFORMERS
+        }
+        if not transformers:
+            return res
+        errors = []
+        columns = [list(column) for column in zip(*datas)]
+        for name, kind in transformers.items():
+            fieldindex = fields_to_export.index(name)
+            column = columns[fieldindex]
+            try:
+                if kind == 'time':
+                    columns[fieldindex] = self._export_float_time_column(column)
+                elif kind == 'request_type':
+                    columns[fieldindex] = [
+                        ('L' if str(value) == 'Libre' else 'R') if value not in ('', False, None) else ''
+                        for value in column
+                    ]
+                else:
+                    columns[fieldindex] = [str(value).upper() if value not in ('', False, None) else '' for value in column]
+            except (TypeError, ValueError):
+                # find the rows that can not be converted to report them
+                for row, value in enumerate(column, 1):
+                    try:
+                        if value not in ('', False, None):
+                            float(value)
+                    except (TypeError, ValueError):
+                        errors.append(_('Fila %s, columna %s: %r') % (row, name, value))
+        if errors:
+            raise UserError(_('It was not possible to convert the time format when exporting the file.') + '\n' + '\n'.join(errors[:20]))
+        res['datas'] = [list(row) for row in zip(*columns)]
         return res
 
     @api.onchange('state')
@@ -974,6 +1019,28 @@ class CalendarAppointment(models.Model):
             return False
         return True
 
+    def fetch_calendar_day_availability(self, calendar_appointment_type_id, day):
+        """ Slots of the appointment type on the given day (YYYY-MM-DD), with
+            the availability of the judge for all of them checked in one query.
+        """
+        appointment_type = self.env['calendar.appointment.type'].browse(int(calendar_appointment_type_id))
+        tz_session = pytz.timezone(appointment_type.appointment_tz or 'America/Bogota')
+        day = fields.Date.from_string(day)
+        duration = appointment_type.appointment_duration or 1.0
+        slots = []
+        for slot in appointment_type.slot_ids.filtered(lambda s: int(s.weekday) == day.isoweekday()).sorted('hour'):
+            start = datetime.datetime.combine(day, datetime.time()) + relativedelta(hours=slot.hour)
+            start = tz_session.localize(start).astimezone(pytz.utc)
+            slots.append((start, start + relativedelta(hours=duration)))
+        if not slots:
+            return []
+        availability = appointment_type.judged_id.calendar_slots_availability(slots)
+        return [{
+            'datetime': start.astimezone(tz_session).strftime('%Y-%m-%d %H:%M'),
+            'duration': duration,
+            'available': available,
+        } for (start, stop), available in zip(slots, availability)]
+
 
     @api.depends('state')
     def _get_state_label(self):
@@ -1011,8 +1078,9 @@ class CalendarAppointment(models.Model):
 
 
     def change_lifesize_to_teams_multi(self):
-        vals = [{'platform_type': 'teams'}]
-        self.write(vals[0])
+        # the meetings are created by the outbox, which batches the Graph calls
+        for record in self.with_context(provisioning_async=True):
+            record.write({'platform_type': 'teams'})
         #vals['sequence_icsfile_ctl'] = self.sequence_icsfile_ctl + 1 if int(self.sequence_icsfile_ctl) else 1
         #self.write_event(vals)
 
@@ -1037,10 +1105,72 @@ class CalendarAppointmentType(models.Model):
     process_number = fields.Char('Process number')
     reception_id = fields.Many2one('calendar.reception', 'Reception medium', ondelete='set null')
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(CalendarAppointmentType, self).create(vals_list)
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super(CalendarAppointmentType, self).write(vals)
+        if {'name', 'active', 'judged_id'} & set(vals):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(CalendarAppointmentType, self).unlink()
+        self.clear_caches()
+        return res
+
     def search_calendar(self, judged_id):
         res = self.env['calendar.appointment.type'].search([('judged_id','=',judged_id)])
         return res
 
+    @api.model
+    @tools.ormcache()
+    def _get_suggestion_index(self):
+        """ Index of the "city-agenda" labels used by the typeahead of the
+            scheduling form. It lives in the registry cache of each worker and
+            is dropped with ``clear_caches`` when an agenda, its judged or the
+            city of the judged change.
+            Entries are (id, label, judged_id, city_id, recording_add_ok).
+        """
+        types = self.sudo().search_read([('name', '!=', False)], ['name', 'judged_id'])
+        judged_ids = list({t['judged_id'][0] for t in types if t['judged_id']})
+        judged = {p['id']: p for p in self.env['res.partner'].sudo().browse(judged_ids).read(['city_id', 'recording_add_ok'])}
+        city_ids = list({p['city_id'][0] for p in judged.values() if p['city_id']})
+        cities = {c['id']: c['name'] for c in self.env['res.city'].sudo().browse(city_ids).read(['name'])}
+        entries = []
+        for appointment_type in types:
+            partner = judged.get(appointment_type['judged_id'] and appointment_type['judged_id'][0]) or {}
+            city_id = partner.get('city_id') and partner['city_id'][0]
+            entries.append((
+                appointment_type['id'],
+                '%s-%s' % (cities.get(city_id) or '404', appointment_type['name']),
+                partner.get('id', False),
+                city_id or False,
+                bool(partner.get('recording_add_ok')),
+            ))
+        return SuggestionIndex(entries)
+
+    @api.model
+    def search_suggestion(self, query, city_id=None, judged_id=None, recording_only=False, limit=30):
+        """ Agendas matching ``query`` for the typeahead, best matches first.
+
+            :param city_id: only agendas of the judged of this city
+            :param judged_id: only agendas of this judged (``False`` included)
+            :param recording_only: only judged shown when attaching recordings
+            :return: list of (id, label)
+        """
+        def predicate(entry):
+            return (not city_id or entry[3] == city_id) \
+                and (judged_id is None or entry[2] == judged_id) \
+                and (not recording_only or entry[4])
+
+        filtered = city_id or judged_id is not None or recording_only
+        entries = self._get_suggestion_index().search(query, predicate=predicate if filtered else None, limit=limit)
+        return [(entry[0], entry[1]) for entry in entries]
+
     def fetch_teams_ok(self, calendar_appointment_type_id=False):
         if calendar_appointment_type_id:
             return True if self.env['calendar.appointment.type'].browse(calendar_appointment_type_id).judged_id.teams_api_ok else False
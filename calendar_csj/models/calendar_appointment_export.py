@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import tempfile
+import traceback
+from datetime import date, datetime
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools.safe_eval import safe_eval
+
+import logging
+_logger = logging.getLogger(__name__)
+
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+}
+
+
+class CalendarAppointmentExport(models.Model):
+    _name = 'calendar.appointment.export'
+    _inherit = ['mail.thread']
+    _description = 'Appointments report job'
+    _order = 'id desc'
+
+    name = fields.Char('Name', required=True, default=lambda self: _('Reporte_Agendamientos'))
+    user_id = fields.Many2one('res.users', 'Requested by', required=True, default=lambda self: self.env.user, ondelete='cascade')
+    layout = fields.Selection([('private', 'Appointments'), ('public', 'Public')], 'Layout', required=True, default='private')
+    file_format = fields.Selection([('xlsx', 'XLSX'), ('csv', 'CSV')], 'Format', required=True, default='xlsx')
+    domain = fields.Text('Domain', required=True, default='[]')
+    order = fields.Char('Order')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed')], 'State', default='pending', required=True, tracking=True)
+    progress = fields.Integer('Progress (%)', readonly=True)
+    record_count = fields.Integer('Records', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', 'File', readonly=True, ondelete='set null')
+    error = fields.Text('Error', readonly=True)
+    date_start = fields.Datetime('Started on', readonly=True)
+    date_done = fields.Datetime('Done on', readonly=True)
+
+    def unlink(self):
+        self.env['ir.attachment'].sudo().search([('res_model', '=', self._name), ('res_id', 'in', self.ids)]).unlink()
+        return super(CalendarAppointmentExport, self).unlink()
+
+    def _get_download_url(self):
+        self.ensure_one()
+        return '/my/appointments/exports/%s/download' % self.id
+
+    def action_retry(self):
+        self.filtered(lambda job: job.state == 'failed').write({'state': 'pending', 'progress': 0, 'error': False})
+
+    def _set_progress(self, done, total):
+        """ Progress is written on its own cursor, so it is visible while
+            the job transaction is still open. """
+        progress = int(done * 100 / total) if total else 100
+        with self.pool.cursor() as cr:
+            cr.execute("UPDATE calendar_appointment_export SET progress = %s WHERE id = %s", (progress, self.id))
+
+    def _build_file(self):
+        """ Build the report file of the job and store it as an attachment.
+
+            :return: (attachment, number of appointments)
+        """
+        self.ensure_one()
+        Appointment = self.env['calendar.appointment'].sudo()
+        writer = Appointment._export_xlsx if self.file_format == 'xlsx' else Appointment._export_csv
+        with tempfile.TemporaryFile() as output:
+            count = writer(output, safe_eval(self.domain), order=self.order or None, layout=self.layout, progress=self._set_progress)
+            output.seek(0)
+            attachment = self.env['ir.attachment'].sudo().create({
+                'name': '%s.%s' % (self.name, self.file_format),
+                'datas': base64.b64encode(output.read()),
+                'mimetype': EXPORT_MIMETYPES[self.file_format],
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+        return attachment, count
+
+    def _mark_done(self, attachment, count):
+        self.ensure_one()
+        self.write({
+            'state': 'done',
+            'progress': 100,
+            'record_count': count,
+            'attachment_id': attachment.id,
+            'date_done': fields.Datetime.now(),
+        })
+        self.message_post(
+            body=_('El reporte <a href="%s">%s</a> está listo para descargar (%s registros).') % (
+                self._get_download_url(), attachment.name, count),
+            partner_ids=self.user_id.partner_id.ids,
+            subtype='mail.mt_comment')
+
+    @api.model
+    def _cron_process_jobs(self, limit=5, keep_days=7):
+        """ Build the pending reports, one transaction per job, and remove
+            the jobs done more than ``keep_days`` ago with their file. """
+        jobs = self.search([('state', '=', 'pending')], order='id', limit=limit)
+        for job in jobs:
+            # lock the job so two cron workers do not build the same report
+            self.env.cr.execute("""
+                SELECT id FROM calendar_appointment_export
+                WHERE id = %s AND state = 'pending'
+                FOR UPDATE SKIP LOCKED
+            """, (job.id,))
+            if not self.env.cr.fetchone():
+                continue
+            job.write({'state': 'running', 'progress': 0, 'date_start': fields.Datetime.now()})
+            self.env.cr.commit()
+            try:
+                attachment, count = job._build_file()
+                # _set_progress updated the job row meanwhile, start a new
+                # transaction before writing it again
+                self.env.cr.commit()
+                job._mark_done(attachment, count)
+                self.env.cr.commit()
+            except Exception:
+                self.env.cr.rollback()
+                _logger.exception('Appointments report job %s failed', job.id)
+                job.write({'state': 'failed', 'error': traceback.format_exc()})
+                job.message_post(
+                    body=_('No fue posible generar el reporte %s.') % job.name,
+                    partner_ids=job.user_id.partner_id.ids,
+                    subtype='mail.mt_comment')
+                self.env.cr.commit()
+        self.search([
+            ('state', 'in', ['done', 'failed']),
+            ('create_date', '<', fields.Datetime.subtract(fields.Datetime.now(), days=keep_days)),
+        ]).unlink()
+
+    @api.model
+    def _create_from_domain(self, domain, order=None, layout='private', file_format='xlsx'):
+        """ Queue a report of the appointments of ``domain`` for the current user. """
+        if file_format not in EXPORT_MIMETYPES:
+            raise UserError(_('Formato de reporte no soportado: %s') % file_format)
+        # the domain is stored as text, dates are kept as server strings
+        domain = [
+            (leaf[0], leaf[1], fields.Datetime.to_string(leaf[2]) if isinstance(leaf[2], (date, datetime)) else leaf[2])
+            if isinstance(leaf, (list, tuple)) and len(leaf) == 3 else leaf
+            for leaf in domain
+        ]
+        return self.sudo().create({
+            'user_id': self.env.user.id,
+            'domain': repr(domain),
+            'order': order,
+            'layout': layout,
+            'file_format': file_format,
+        })
+
+
+class CalendarAppointment(models.Model):
+    _inherit = 'calendar.appointment'
+
+    def action_export_background(self):
+        """ Queue a report of the selected appointments instead of building
+            it in the request like the export dialog does. """
+        domain = self.env.context.get('active_domain')
+        if domain is None or len(self) < self.search_count(domain):
+            domain = [('id', 'in', self.ids)]
+        job = self.env['calendar.appointment.export']._create_from_domain(domain)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'calendar.appointment.export',
+            'res_id': job.id,
+            'view_mode': 'form',
+        }
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from odoo import models, fields, api, tools, _
+from .api_teams import GRAPH_BATCH_SIZE
+
+import logging
+_logger = logging.getLogger(__name__)
+
+# (key of the meeting id in the api vals, appointment field holding it)
+PLATFORM_UUID_KEYS = {
+    'teams': ('teams_uuid', 'teams_uuid'),
+    'lifesize': ('uuid', 'lifesize_uuid'),
+}
+
+
+class CalendarAppointmentOutbox(models.Model):
+    _name = 'calendar.appointment.outbox'
+    _description = 'Videoconference operation to run'
+    _order = 'id'
+
+    appointment_id = fields.Many2one('calendar.appointment', 'Appointment', ondelete='set null')
+    # kept when the appointment is deleted, operations are run in order per appointment
+    appointment_ref = fields.Integer('Appointment ID', required=True, index=True)
+    user_id = fields.Many2one('res.users', 'Requested by', required=True, default=lambda self: self.env.user, ondelete='cascade')
+    platform = fields.Selection([('teams', 'TEAMS'), ('lifesize', 'LIFESIZE')], 'Platform', required=True)
+    operation = fields.Selection([('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], 'Operation', required=True)
+    payload = fields.Text('Request', required=True)
+    # set as soon as the provider answered, so a retry does not send the request again
+    result = fields.Text('Result', readonly=True)
+    idempotency_key = fields.Char('Idempotency key', required=True, readonly=True, copy=False,
+                                  default=lambda self: uuid.uuid4().hex)
+    notify = fields.Boolean('Send invitation', help="Send the invitation to the attendees once the meeting is created.")
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancel', 'Canceled')], 'State', default='pending', required=True, index=True)
+    attempts = fields.Integer('Attempts', readonly=True)
+    next_attempt = fields.Datetime('Next attempt', default=fields.Datetime.now, required=True)
+    error = fields.Text('Error', readonly=True)
+    date_done = fields.Datetime('Done on', readonly=True)
+
+    _sql_constraints = [
+        ('idempotency_key_uniq', 'unique(idempotency_key)', 'The operation was already queued.'),
+    ]
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS calendar_appointment_outbox_pending_idx
+            ON calendar_appointment_outbox (next_attempt, id) WHERE state = 'pending'
+        """)
+
+    @api.model
+    def _enqueue(self, appointment, platform, api_vals, notify=False):
+        """ Queue the request ``api_vals`` of the api.teams/api.lifesize
+            api_crud for ``appointment``, it is sent by _cron_process after
+            the current transaction is committed. """
+        operation = api_vals['method']
+        if operation == 'delete':
+            pending = self.search([
+                ('appointment_ref', '=', appointment.id),
+                ('platform', '=', platform),
+                ('state', '=', 'pending'),
+            ])
+            creates = pending.filtered(lambda entry: entry.operation == 'create')
+            # a create holding a result already made the meeting, it must be deleted
+            if creates and not pending.filtered('result') and pending._try_lock():
+                # the meeting was never created, nothing to delete
+                pending.write({'state': 'cancel', 'date_done': fields.Datetime.now()})
+                return self.browse()
+        return self.sudo().create({
+            'appointment_id': appointment.id,
+            'appointment_ref': appointment.id,
+            'user_id': self.env.user.id,
+            'platform': platform,
+            'operation': operation,
+            'payload': json.dumps(api_vals, default=str),
+            'notify': notify,
+        })
+
+    def _try_lock(self):
+        """ Lock the rows of the entries, False when a worker is running one of them. """
+        self.env.cr.execute("""
+            SELECT id FROM calendar_appointment_outbox
+            WHERE id IN %s FOR UPDATE SKIP LOCKED
+        """, (tuple(self.ids),))
+        return len(self.env.cr.fetchall()) == len(self)
+
+    def _created_uuid(self):
+        """ Id of the meeting created by a previous entry of the appointment. """
+        uuid_key, field = PLATFORM_UUID_KEYS[self.platform]
+        create = self.search([
+            ('appointment_ref', '=', self.appointment_ref),
+            ('platform', '=', self.platform),
+            ('operation', '=', 'create'),
+            ('state', '=', 'done'),
+            ('id', '<', self.id),
+        ], order='id desc', limit=1)
+        return create.result and json.loads(create.result).get(field)
+
+    def _get_api(self):
+        return self.env['api.%s' % self.platform].with_user(self.user_id).sudo()
+
+    def _prepare_request(self):
+        """ api_crud vals of the entry, None when there is nothing to send. """
+        self.ensure_one()
+        api_vals = json.loads(self.payload)
+        uuid_key, field = PLATFORM_UUID_KEYS[self.platform]
+        if self.operation == 'create':
+            if self.appointment_id and self.appointment_id.sudo()[field]:
+                # applied by a previous attempt
+                return None
+        elif not api_vals.get(uuid_key):
+            api_vals[uuid_key] = self._created_uuid()
+            if not api_vals[uuid_key]:
+                _logger.info('Outbox %s: no %s meeting to %s', self.id, self.platform, self.operation)
+                return None
+        return api_vals
+
+    def _cancel_orphan(self):
+        """ Cancel a create whose appointment was deleted before the meeting
+            was created.
+
+            :return: whether the entry was canceled
+        """
+        self.ensure_one()
+        if self.operation == 'create' and not self.result and not self.appointment_id.exists():
+            _logger.info('Outbox %s: appointment %s deleted, %s meeting not created', self.id, self.appointment_ref, self.platform)
+            self.write({'state': 'cancel', 'date_done': fields.Datetime.now()})
+            return True
+        return False
+
+    def _send_request(self):
+        """ Send the request of the entry, unless a previous attempt already
+            got its result.
+
+            :return: the result, as returned by resp2dict
+        """
+        if self.result:
+            return json.loads(self.result)
+        api_vals = self._prepare_request()
+        if api_vals is None:
+            return self._store_response(None)
+        return self._store_response(self._get_api().api_crud(api_vals))
+
+    def _store_response(self, resp):
+        """ Keep the result of the request on the entry, see _send_request. """
+        self.ensure_one()
+        res = (resp and self._get_api().resp2dict(resp)) or {}
+        self.write({'result': json.dumps(res, default=str)})
+        return res
+
+    def _apply_response(self, res):
+        """ Write the result of the request on the appointment. """
+        self.ensure_one()
+        appointment = self.appointment_id.sudo()
+        if appointment:
+            vals = dict(res)
+            if self.operation == 'create':
+                vals['provisioning_state'] = 'done'
+            if vals:
+                appointment.write(vals)
+        return res
+
+    def _notify_attendees(self):
+        self.ensure_one()
+        if self.appointment_id:
+            # as the scheduler, the mails and the organizer follow its mail server
+            self.appointment_id.with_user(self.user_id).sudo()._send_provisioned_invitations(self.user_id)
+
+    def _complete(self, res):
+        """ Apply the result ``res`` of the entry and send its invitations,
+            each in a step of its own so their failure retries them without
+            sending the request again, then mark the entry done. """
+        self.ensure_one()
+        success, res = self._run_step('_apply_response', res)
+        if success and self.notify:
+            success, dummy = self._run_step('_notify_attendees')
+        if success:
+            self._mark_done(res)
+
+    def _schedule_retry(self, error):
+        self.ensure_one()
+        params = self.env['ir.config_parameter'].sudo()
+        max_attempts = int(params.get_param('calendar_csj.provisioning_max_attempts', 5))
+        attempts = self.attempts + 1
+        if attempts < max_attempts:
+            self.write({
+                'attempts': attempts,
+                'error': error,
+                'next_attempt': fields.Datetime.now() + timedelta(minutes=min(2 ** attempts, 60)),
+            })
+            return
+        self.write({'attempts': attempts, 'error': error, 'state': 'failed'})
+        appointment = self.appointment_id.sudo()
+        if appointment and self.operation == 'create':
+            appointment.provisioning_state = 'failed'
+            appointment.message_post(
+                body=_('No fue posible crear la sala de %s: %s') % (dict(self._fields['platform'].selection)[self.platform], error.splitlines()[-1]),
+                partner_ids=self.user_id.partner_id.ids,
+                subtype='mail.mt_comment')
+
+    @api.model
+    def _claim(self, limit=1, platform=None, user_id=None):
+        """ Lock the next entries to run. An entry waits for the pending
+            entries queued before it for the same appointment. """
+        where, params = [], []
+        if platform:
+            where.append("AND o.platform = %s")
+            params.append(platform)
+        if user_id:
+            where.append("AND o.user_id = %s")
+            params.append(user_id)
+        self.env.cr.execute("""
+            SELECT o.id FROM calendar_appointment_outbox o
+            WHERE o.state = 'pending'
+              AND o.next_attempt <= (now() at time zone 'UTC')
+              AND NOT EXISTS (
+                SELECT 1 FROM calendar_appointment_outbox p
+                WHERE p.appointment_ref = o.appointment_ref AND p.state = 'pending' AND p.id < o.id
+              )
+              %s
+            ORDER BY o.id
+            LIMIT %%s
+            FOR UPDATE OF o SKIP LOCKED
+        """ % ' '.join(where), params + [limit])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _run_step(self, step, *args):
+        """ Call ``step`` of the entry in a savepoint, scheduling a retry when it fails.
+
+            :return: (success, value returned by the step)
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                return True, getattr(self, step)(*args)
+        except Exception:
+            self.env.clear()
+            _logger.exception('Outbox %s: %s %s failed', self.id, self.platform, self.operation)
+            self._schedule_retry(traceback.format_exc())
+            return False, None
+
+    def _mark_done(self, res):
+        self.write({
+            'state': 'done',
+            'result': json.dumps(res, default=str),
+            'error': False,
+            'date_done': fields.Datetime.now(),
+        })
+
+    def _process(self):
+        """ Run the entries, on the transaction holding their lock. Teams
+            entries are sent together in Graph $batch requests. """
+        batch = self.filtered(lambda entry: entry.platform == 'teams')
+        if len(batch) > 1:
+            batch._process_batch()
+        else:
+            batch = self.browse()
+        for entry in self - batch:
+            if entry._cancel_orphan():
+                continue
+            success, res = entry._run_step('_send_request')
+            if success:
+                entry._complete(res)
+
+    def _process_batch(self):
+        todo = self.browse()
+        requests = []
+        for entry in self:
+            if entry._cancel_orphan():
+                continue
+            if entry.result:
+                # sent by a previous attempt
+                entry._complete(json.loads(entry.result))
+                continue
+            success, api_vals = entry._run_step('_prepare_request')
+            if success and api_vals is None:
+                entry._mark_done({})
+            elif success:
+                todo |= entry
+                requests.append(api_vals)
+        if not todo:
+            return
+        try:
+            results = todo[0]._get_api().api_crud_many(requests)
+        except Exception:
+            _logger.exception('Outbox: Graph $batch of %s entries failed', len(todo))
+            error = traceback.format_exc()
+            for entry in todo:
+                entry._schedule_retry(error)
+            return
+        for entry, result in zip(todo, results):
+            if not result['success']:
+                error = result['error']
+                _logger.warning('Outbox %s: teams %s failed: %s', entry.id, entry.operation, error)
+                entry._schedule_retry('%s: %s' % (type(error).__name__, tools.ustr(error)))
+                continue
+            success, res = entry._run_step('_store_response', result['result'])
+            if success:
+                entry._complete(res)
+
+    @api.model
+    def _work(self, deadline):
+        """ Run entries on a cursor of its own until the queue is empty or
+            ``deadline`` is reached, committing after each claim. """
+        with api.Environment.manage(), self.pool.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            Outbox = env[self._name]
+            while time.time() < deadline:
+                entry = Outbox._claim()
+                if not entry:
+                    break
+                if entry.platform == 'teams':
+                    # same user, the organizer of the meetings depends on its company
+                    # (the entry itself is locked by this transaction, so it is returned again)
+                    entry |= Outbox._claim(GRAPH_BATCH_SIZE, 'teams', entry.user_id.id)
+                entry._process()
+                cr.commit()
+                env.clear()
+
+    @api.model
+    def _cron_process(self, time_limit=50, keep_days=30):
+        """ Run the pending entries with calendar_csj.provisioning_workers
+            threads, then remove the entries done more than ``keep_days`` ago. """
+        workers = int(self.env['ir.config_parameter'].sudo().get_param('calendar_csj.provisioning_workers', 4))
+        deadline = time.time() + time_limit
+        if workers <= 1 or getattr(threading.currentThread(), 'testing', False):
+            self._work(deadline)
+        else:
+            threads = [
+                threading.Thread(target=self._work, args=(deadline,), name='calendar_outbox_%s' % index, daemon=True)
+                for index in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.search([
+            ('state', 'in', ['done', 'cancel']),
+            ('date_done', '<', fields.Datetime.subtract(fields.Datetime.now(), days=keep_days)),
+        ]).unlink()
+
+    def action_retry(self):
+        self.filtered(lambda entry: entry.state == 'failed').write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt': fields.Datetime.now(),
+        })
+        self.mapped('appointment_id').filtered(lambda a: a.provisioning_state == 'failed').write({'provisioning_state': 'pending'})
+
+
+class CalendarAppointment(models.Model):
+    _inherit = 'calendar.appointment'
+
+    @api.model
+    def _provisioning_async(self):
+        """ Meetings are created by the outbox instead of during the booking,
+            the ``provisioning_async`` context key forces it for mass operations. """
+        if self.env.context.get('provisioning_async'):
+            return True
+        return bool(self.env['ir.config_parameter'].sudo().get_param('calendar_csj.async_provisioning'))
+
+    def _call_provider(self, platform, api_vals):
+        """ Send ``api_vals`` to api.teams/api.lifesize, or queue it when the
+            provisioning is asynchronous.
+
+            :return: the response of api_crud, None when queued
+        """
+        self.ensure_one()
+        if self._provisioning_async():
+            self.env['calendar.appointment.outbox']._enqueue(self, platform, api_vals)
+            return None
+        return self.env['api.%s' % platform].api_crud(api_vals)
+
+    def _call_provider_many(self, platform, requests):
+        """ _call_provider of several (appointment, api vals), the Teams
+            requests of several appointments are sent in Graph $batch requests.
+
+            :return: the responses of api_crud, None for the queued ones
+            :raise ValidationError: the first error, once all the requests were sent
+        """
+        if platform != 'teams' or len(requests) < 2 or self._provisioning_async():
+            return [appointment._call_provider(platform, api_vals) for appointment, api_vals in requests]
+        results = self.env['api.teams'].api_crud_many([api_vals for appointment, api_vals in requests])
+        for result in results:
+            if not result['success']:
+                raise result['error']
+        return [result['result'] for result in results]
+
+    def _send_provisioned_invitations(self, user):
+        """ Invitation held back by create_attendees until the meeting link exists. """
+        for appointment in self.filtered('event_id'):
+            to_notify = appointment.event_id.attendee_ids.filtered(lambda a: a.email != user.email)
+            if appointment.teams_ok:
+                to_notify._send_mail_to_attendees('calendar_csj.calendar_template_meeting_invitation')
+            else:
+                to_notify._send_mail_to_attendees('calendar.calendar_template_meeting_invitation')
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+
+import psycopg2
+
+from odoo import models, fields, api
+from odoo.osv import expression
+from ..tools import normalize_text
+
+import logging
+_logger = logging.getLogger(__name__)
+
+# sortby of /my/appointments paginated by seeking: column of the key, it is
+# always sorted descending with the id as tie breaker
+PORTAL_KEYSET_COLUMNS = {
+    'date': 'calendar_datetime',
+    'appointment_code': 'appointment_code',
+}
+
+# fields rendered by the portal_my_appointments template
+PORTAL_LIST_FIELDS = [
+    'appointment_code', 'process_number', 'type', 'calendar_datetime', 'appointment_date',
+    'request_type', 'state', 'request_date', 'lifesize_url', 'applicant_raw_name', 'name',
+    'country_state_id', 'city_id', 'class_id', 'judged_only_code', 'judged_only_name',
+    'calendar_time', 'appointment_close_user_id', 'link_download', 'state_description',
+    'observations', 'tag_number',
+]
+
+# fields of the free text search document, see _compute_search_document
+SEARCH_DOCUMENT_FIELDS = [
+    'appointment_code', 'process_number', 'judged_only_name', 'applicant_raw_name',
+    'declarant_text', 'indicted_text', 'applicant_email', 'partner_ids_label',
+    'tag_number', 'room_id_mame', 'name', 'lifesize_meeting_ext', 'state',
+]
+
+# (expiry, count) by (database, user, domain) for calendar_csj.portal_count_mode = cached
+_count_cache = {}
+_count_lock = threading.Lock()
+COUNT_CACHE_SIZE = 1000
+
+
+class CalendarAppointment(models.Model):
+    _inherit = 'calendar.appointment'
+
+    search_document = fields.Text('Search document', compute='_compute_search_document', store=True,
+                                  help='Normalized text of the appointment searched by the portal and the API.')
+
+    def init(self):
+        super(CalendarAppointment, self).init()
+        # seek indexes of _portal_search_page, same order as its ORDER BY
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS calendar_appointment_datetime_id_idx
+            ON calendar_appointment (calendar_datetime DESC, id DESC)
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS calendar_appointment_code_id_idx
+            ON calendar_appointment (appointment_code DESC NULLS LAST, id DESC)
+        """)
+        # trigram index for the ilike of _search_text_domain, only when pg_trgm is available
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        installed = bool(self.env.cr.fetchone())
+        if not installed:
+            try:
+                with self.env.cr.savepoint():
+                    self.env.cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                installed = True
+            except psycopg2.Error:
+                _logger.warning("The pg_trgm extension could not be installed, the appointments search "
+                                "is not indexed: run CREATE EXTENSION pg_trgm as a database superuser "
+                                "and update the module.")
+        if installed:
+            self.env.cr.execute("""
+                CREATE INDEX IF NOT EXISTS calendar_appointment_search_document_trgm_idx
+                ON calendar_appointment USING gin (search_document gin_trgm_ops)
+            """)
+
+    @api.depends('appointment_code', 'process_number', 'judged_only_name', 'applicant_raw_name',
+                 'declarant_text', 'indicted_text', 'applicant_id.email', 'partner_ids_label',
+                 'tag_number', 'room_id.virtual_room', 'name', 'lifesize_meeting_ext', 'state')
+    def _compute_search_document(self):
+        for record in self:
+            values = (record[name] for name in SEARCH_DOCUMENT_FIELDS)
+            record.search_document = ' '.join(normalize_text(value) for value in values if value)
+
+    @api.model
+    def _search_text_domain(self, text):
+        """ Domain of the appointments whose search document contains every
+            word of ``text``, ignoring case and accents. """
+        words = normalize_text(text).split()
+        if not words:
+            return []
+        return expression.AND([[('search_document', 'ilike', word)] for word in words])
+
+    @api.model
+    def _portal_query(self, domain):
+        """ :return: (from clause, where clauses, params) of ``domain``
+            with the record rules of the current user. """
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        return from_clause, [where_clause] if where_clause else [], list(params)
+
+    @api.model
+    def _portal_encode_cursor(self, column, row):
+        value = row[column]
+        if isinstance(value, fields.datetime):
+            value = fields.Datetime.to_string(value)
+        return '%s|%s' % (row['id'], value or '')
+
+    @api.model
+    def _portal_decode_cursor(self, column, cursor):
+        """ :return: (value of the key, id) of the last row of the previous
+            page, None when the cursor is missing or invalid. """
+        try:
+            last_id, value = (cursor or '').split('|', 1)
+            last_id = int(last_id)
+            if value and self._fields[column].type == 'datetime':
+                value = fields.Datetime.from_string(value)
+        except ValueError:
+            return None
+        return value or None, last_id
+
+    @api.model
+    def _portal_search_page(self, domain, sortby, after=None, limit=20):
+        """ One page of the appointments of ``domain`` sorted by ``sortby``
+            (a key of PORTAL_KEYSET_COLUMNS), following the page whose
+            cursor is ``after``.
+
+            Pages are found by seeking on (key, id) instead of skipping rows
+            with OFFSET, so a page deep in the history costs the same as the
+            first one, and only the columns of the listing are read.
+
+            :return: (appointments, cursor of the next page or None)
+        """
+        column = PORTAL_KEYSET_COLUMNS[sortby]
+        required = self._fields[column].required
+        from_clause, where, params = self._portal_query(domain)
+        key = '"calendar_appointment"."%s"' % column
+        cursor = self._portal_decode_cursor(column, after)
+        if cursor:
+            value, last_id = cursor
+            if value is None:
+                where.append('%s IS NULL AND "calendar_appointment".id < %%s' % key)
+                params.append(last_id)
+            elif required:
+                where.append('(%s, "calendar_appointment".id) < (%%s, %%s)' % key)
+                params.extend([value, last_id])
+            else:
+                # rows without key come last
+                where.append('((%s, "calendar_appointment".id) < (%%s, %%s) OR %s IS NULL)' % (key, key))
+                params.extend([value, last_id])
+        query = 'SELECT "calendar_appointment".id, %s FROM %s %s ORDER BY %s DESC%s, "calendar_appointment".id DESC LIMIT %%s' % (
+            key, from_clause, 'WHERE %s' % ' AND '.join(where) if where else '', key, '' if required else ' NULLS LAST')
+        self.env.cr.execute(query, params + [limit + 1])
+        rows = self.env.cr.dictfetchall()
+        appointments = self.browse([row['id'] for row in rows[:limit]])
+        # load the listed columns only, instead of the whole row on first access
+        appointments.read(PORTAL_LIST_FIELDS)
+        next_cursor = self._portal_encode_cursor(column, rows[limit - 1]) if len(rows) > limit else None
+        return appointments, next_cursor
+
+    @api.model
+    def _portal_count(self, domain):
+        """ Number of appointments of ``domain`` shown by the portal, according
+            to calendar_csj.portal_count_mode:
+
+            - exact: search_count on each request (default)
+            - cached: search_count kept calendar_csj.portal_count_ttl seconds
+              by each worker
+            - estimate: rows estimated by the query planner, without scanning
+
+            :return: (count, whether the count is approximate)
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        mode = ICP.get_param('calendar_csj.portal_count_mode', 'exact')
+        if mode == 'estimate':
+            from_clause, where, params = self._portal_query(domain)
+            self.env.cr.execute('EXPLAIN (FORMAT JSON) SELECT "calendar_appointment".id FROM %s %s' % (
+                from_clause, 'WHERE %s' % ' AND '.join(where) if where else ''), params)
+            plan = self.env.cr.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows']), True
+        if mode == 'cached':
+            key = (self.env.cr.dbname, self.env.uid, repr(domain))
+            now = time.time()
+            cached = _count_cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1], True
+            count = self.search_count(domain)
+            ttl = int(ICP.get_param('calendar_csj.portal_count_ttl', 300))
+            with _count_lock:
+                if len(_count_cache) >= COUNT_CACHE_SIZE:
+                    _count_cache.clear()
+                _count_cache[key] = (now + ttl, count)
+            return count, False
+        return self.search_count(domain), False
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import collections
 import pytz
 
 import logging
@@ -7,6 +8,9 @@ from odoo.exceptions import UserError, ValidationError
 
 _logger = logging.getLogger(__name__)
 
+# time range of an event; LEAST/GREATEST keep the range valid on inconsistent rows
+EVENT_RANGE_SQL = "tsrange(LEAST(%(alias)s.start, %(alias)s.stop), GREATEST(%(alias)s.start, %(alias)s.stop), '[)')"
+
 def is_calendar_id(record_id):
     return len(str(record_id).split('-')) != 1
 
@@ -38,10 +42,54 @@ class CalendarEvent(models.Model):
     destination_ids = fields.Many2many('res.partner', 'calendar_event_res_partner_destination_rel', string='Destinations', states={'done': [('readonly', True)]})
 
 
+    def init(self):
+        # overlap index used by _get_busy_slots, the expression must stay the same in both
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS calendar_event_range_gist_idx
+            ON calendar_event USING gist (%s)
+        """ % (EVENT_RANGE_SQL % {'alias': 'calendar_event'}))
+
     def fetch_calendar_verify_availability(self, date_time, search_appointment):
         date_time = date_time
         return date_time
 
+    @api.model
+    def _get_busy_slots(self, partner_ids, slots):
+        """ Tell which of the candidate slots overlap an event of the partners,
+            with a single query whatever the number of slots.
+
+            :param partner_ids: ids of res.partner attending the events
+            :param slots: list of (start, stop) datetimes, naive ones are UTC
+            :return: list of booleans, True when the slot at that position is busy
+        """
+        if not partner_ids or not slots:
+            return [False] * len(slots)
+
+        def to_utc(value):
+            value = fields.Datetime.to_datetime(value)
+            if value.tzinfo:
+                value = value.astimezone(pytz.utc).replace(tzinfo=None)
+            return value
+
+        starts = [to_utc(start) for start, stop in slots]
+        stops = [to_utc(stop) for start, stop in slots]
+        self.flush(['start', 'stop', 'state', 'active', 'partner_ids'])
+        self.env.cr.execute("""
+            SELECT slot.idx
+            FROM unnest(%%s::timestamp[], %%s::timestamp[]) WITH ORDINALITY AS slot(slot_start, slot_stop, idx)
+            WHERE EXISTS (
+                SELECT 1
+                FROM calendar_event ev
+                JOIN calendar_event_res_partner_rel rel ON rel.calendar_event_id = ev.id
+                WHERE rel.res_partner_id IN %%s
+                  AND ev.active
+                  AND (ev.state IS NULL OR ev.state != 'cancel')
+                  AND %s && tsrange(slot.slot_start, slot.slot_stop, '[)')
+            )
+        """ % (EVENT_RANGE_SQL % {'alias': 'ev'}), (starts, stops, tuple(partner_ids)))
+        busy = {row[0] - 1 for row in self.env.cr.fetchall()}
+        return [index in busy for index in range(len(slots))]
+
     @api.model
     def create(self, vals):
         vals.update(self.create_appointment(vals))
@@ -125,73 +173,77 @@ class CalendarEvent(models.Model):
                     attendee_to_email._send_mail_to_attendees('calendar_csj.calendar_csj_template_meeting_cancel')
 
     def create_attendees(self):
+        """ Create the attendees of the partners and destinations of the
+            meetings that have none yet, and remove the attendees whose partner
+            left the meetings, for all the meetings of ``self`` at once.
+
+            :return: {meeting id: {'new_attendees', 'old_attendees',
+                      'removed_attendees', 'removed_partners'}}
+        """
         current_user = self.env.user
+        Attendee = self.env['calendar.attendee']
+        google_internal_event_id = self._context.get('google_internal_event_id', False)
+
+        vals_list = []
+        for meeting in self:
+            known_partner_ids = set(meeting.attendee_ids.mapped('partner_id').ids)
+            for field_name in ('partner_ids', 'destination_ids'):
+                for partner in meeting[field_name]:
+                    if partner.id in known_partner_ids:
+                        continue
+                    known_partner_ids.add(partner.id)
+                    values = {
+                        'partner_id': partner.id,
+                        'email': partner.email,
+                        'event_id': meeting.id,
+                    }
+                    if google_internal_event_id and field_name == 'partner_ids':
+                        values['google_internal_event_id'] = google_internal_event_id
+                    vals_list.append(values)
+        new_attendees = Attendee.create(vals_list) if vals_list else Attendee
+        new_attendee_ids = collections.defaultdict(list)
+        for values, attendee in zip(vals_list, new_attendees):
+            new_attendee_ids[values['event_id']].append(attendee.id)
+        # the attendees are created on their meeting, reload the one2many
+        # instead of writing (4, id) commands
+        self.invalidate_cache(['attendee_ids'], self.ids)
+
+        to_notify = collections.defaultdict(lambda: Attendee)
+        to_subscribe = collections.defaultdict(list)
         result = {}
         for meeting in self:
-            alreay_meeting_partners = meeting.attendee_ids.mapped('partner_id')
-            meeting_attendees = self.env['calendar.attendee']
-            meeting_partners = self.env['res.partner']
-            for partner in meeting.partner_ids.filtered(lambda partner: partner not in alreay_meeting_partners):
-                values = {
-                    'partner_id': partner.id,
-                    'email': partner.email,
-                    'event_id': meeting.id,
-                }
-
-                if self._context.get('google_internal_event_id', False):
-                    values['google_internal_event_id'] = self._context.get('google_internal_event_id')
-
-                # current user don't have to accept his own meeting
-                #if partner == self.env.user.partner_id:
-                #    values['state'] = 'accepted'
-
-                attendee = self.env['calendar.attendee'].create(values)
-
-                meeting_attendees |= attendee
-                meeting_partners |= partner
-
-            for partner in meeting.destination_ids.filtered(lambda partner: partner not in alreay_meeting_partners):
-                values = {
-                    'partner_id': partner.id,
-                    'email': partner.email,
-                    'event_id': meeting.id,
-                }
-                attendee = self.env['calendar.attendee'].create(values)
-
-                meeting_attendees |= attendee
-                meeting_partners |= partner
-
-            if meeting_attendees and not self._context.get('detaching'):
-                to_notify = meeting_attendees.filtered(lambda a: a.email != current_user.email)
+            meeting_attendees = Attendee.browse(new_attendee_ids[meeting.id])
+            if meeting_attendees and not self._context.get('detaching') \
+                    and meeting.appointment_id.provisioning_state != 'pending':
+                # otherwise the outbox sends the invitation once the meeting link exists
                 if meeting.appointment_id.teams_ok:
-                    to_notify._send_mail_to_attendees('calendar_csj.calendar_template_meeting_invitation')
+                    template_xmlid = 'calendar_csj.calendar_template_meeting_invitation'
                 else:
-                    to_notify._send_mail_to_attendees('calendar.calendar_template_meeting_invitation')
-
-            if meeting_attendees:
-                meeting.write({'attendee_ids': [(4, meeting_attendee.id) for meeting_attendee in meeting_attendees]})
-
-
+                    template_xmlid = 'calendar.calendar_template_meeting_invitation'
+                to_notify[template_xmlid] |= meeting_attendees.filtered(lambda a: a.email != current_user.email)
+            meeting_partners = meeting_attendees.mapped('partner_id')
             if meeting_partners:
-                meeting.message_subscribe(partner_ids=meeting_partners.ids)
+                to_subscribe[tuple(meeting_partners.ids)].append(meeting.id)
 
             # We remove old attendees who are not in partner_ids now.
-            all_partners = meeting.partner_ids
-            all_partner_attendees = meeting.attendee_ids.mapped('partner_id')
             old_attendees = meeting.attendee_ids
-            partners_to_remove = all_partner_attendees + meeting_partners - all_partners
-
-            attendees_to_remove = self.env["calendar.attendee"]
-            if partners_to_remove:
-                attendees_to_remove = self.env["calendar.attendee"].search([('partner_id', 'in', partners_to_remove.ids), ('event_id', '=', meeting.id)])
-                attendees_to_remove.unlink()
-
+            partners_to_remove = old_attendees.mapped('partner_id') - meeting.partner_ids
+            remove_ids = set(partners_to_remove.ids)
             result[meeting.id] = {
                 'new_attendees': meeting_attendees,
                 'old_attendees': old_attendees,
-                'removed_attendees': attendees_to_remove,
-                'removed_partners': partners_to_remove
+                'removed_attendees': old_attendees.filtered(lambda a: a.partner_id.id in remove_ids),
+                'removed_partners': partners_to_remove,
             }
+
+        for template_xmlid, attendees in to_notify.items():
+            if attendees:
+                attendees._send_mail_to_attendees(template_xmlid)
+        for partner_ids, meeting_ids in to_subscribe.items():
+            self.browse(meeting_ids).message_subscribe(partner_ids=list(partner_ids))
+        attendees_to_remove = Attendee.concat(*(changes['removed_attendees'] for changes in result.values()))
+        if attendees_to_remove:
+            attendees_to_remove.unlink()
         return result
 
 
@@ -23,6 +23,7 @@ from odoo.tools.translate import _
 from odoo.tools.misc import get_lang
 from odoo.tools import DEFAULT_SERVER_DATE_FORMAT, DEFAULT_SERVER_DATETIME_FORMAT, pycompat
 from odoo.exceptions import UserError, ValidationError
+from .. import ics
 
 
 _logger = logging.getLogger(__name__)
@@ -30,6 +31,17 @@ _logger = logging.getLogger(__name__)
 
 VIRTUALID_DATETIME_FORMAT = "%Y%m%d%H%M%S"
 
+# organizer of the invitations of the users without their own mail server
+ICS_DEFAULT_ORGANIZER = "csj@agendamiento.co"
+ALARM_INTERVALS = {
+    'days': timedelta(days=1),
+    'hours': timedelta(hours=1),
+    'minutes': timedelta(minutes=1),
+}
+# a template reading the attendee itself, and not only its event, renders
+# a different mail for each attendee
+PERSONAL_TEMPLATE_RE = re.compile(r'object\.(?!event_id\b)')
+
 
 def calendar_id2real_id(calendar_id=None, with_date=False):
     """ Convert a "virtual/recurring event id" (type string) into a real event id (type int).
@@ -98,98 +110,90 @@ class Meeting(models.Model):
     _inherit = 'calendar.event'
 
 
+    @api.model
+    def _get_organizer_email(self):
+        """ SMTP login of the mail server of the current user, the organizer
+            of the invitations it sends, from the cached routing of
+            smtp_by_user when it is installed. The users without a server of
+            their own keep ICS_DEFAULT_ORGANIZER, not the default server. """
+        Server = self.env['ir.mail_server']
+        if hasattr(Server, '_get_user_routing'):
+            outgoing = Server._get_user_routing()[0].get(self.env.uid)
+            if outgoing and outgoing[1]:
+                return outgoing[1]
+        return ICS_DEFAULT_ORGANIZER
+
     def _get_ics_file(self):
         """ Returns iCalendar file for the event invitation.
             :returns a dict of .ics file content for each meeting
         """
         result = {}
-        def ics_datetime(idate, allday=False):
-            if idate:
-                if allday:
-                    return idate
-                else:
-                    return idate.replace(tzinfo=pytz.timezone('UTC'))
-            return False
+        if any(not meeting.start or not meeting.stop for meeting in self):
+            raise UserError(_("First you have to specify the date of the invitation."))
 
-        try:
-            # FIXME: why isn't this in CalDAV?
-            import vobject
-        except ImportError:
-            _logger.warning("The `vobject` Python module is not installed, so iCal file generation is unavailable. Please install the `vobject` Python module")
-            return result
+        organizer = self._get_organizer_email()
+        now = ics.format_datetime(fields.Datetime.now())
+        # read the attendees, alarms and appointments of all the meetings at once
+        self.mapped('attendee_ids.email')
+        self.mapped('alarm_ids.duration')
+        self.mapped('appointment_id.process_number')
 
         for meeting in self:
-            cal = vobject.iCalendar()
-            cal.add('method').value = 'REQUEST'
-            cal.add('calscale').value = 'GREGORIAN'
-            event = cal.add('vevent')
-            if not meeting.start or not meeting.stop:
-                raise UserError(_("First you have to specify the date of the invitation."))
-
-            event.add('created').value = ics_datetime(fields.Datetime.now())
-            event.add('dtstart').value = ics_datetime(meeting.start, meeting.allday)
-            event.add('dtend').value = ics_datetime(meeting.stop, meeting.allday)
-            event.add('summary').value = meeting.name
-            event.add('class').value = 'PUBLIC'
-            event.add('trans').value = 'OPAQUE'
-            event.add('location').value = 'COLOMBIA'
-
-            #event already cancel state
-            if self.state == 'cancel':
-                event.add('status').value = 'CANCELLED'
+            cal = ics.IcsWriter('REQUEST')
+            cal.begin('VEVENT')
+            appointment = meeting.appointment_id
+            if appointment:
+                uid = '%s%s' % (appointment.process_number or '', appointment.calendar_datetime.strftime("%Y%m%d %H%M%S"))
             else:
-                event.add('status').value = 'CONFIRMED'
-            #event.add('uid').value = self.appointment_id.process_number + datetime.datetime.now().strftime("%Y%m%Y/%H:%M:%S")
-            event.add('uid').value = self.appointment_id.process_number + self.appointment_id.calendar_datetime.strftime("%Y%m%d %H%M%S")
-
-            event.add('sequence').value = str(self.appointment_id.sequence_icsfile_ctl)
+                uid = '%s@%s' % (meeting.id, self.env.cr.dbname)
+            cal.add_text('UID', uid)
+            cal.add('DTSTAMP', now)
+            cal.add('CREATED', now)
+            if meeting.allday:
+                cal.add('DTSTART', ics.format_datetime(meeting.start, True), [('VALUE', 'DATE')])
+                cal.add('DTEND', ics.format_datetime(meeting.stop, True), [('VALUE', 'DATE')])
+            else:
+                cal.add('DTSTART', ics.format_datetime(meeting.start))
+                cal.add('DTEND', ics.format_datetime(meeting.stop))
+            cal.add_text('SUMMARY', meeting.name)
+            cal.add('CLASS', 'PUBLIC')
+            cal.add('TRANSP', 'OPAQUE')
+            cal.add_text('LOCATION', 'COLOMBIA')
+            #event already cancel state
+            cal.add('STATUS', 'CANCELLED' if meeting.state == 'cancel' else 'CONFIRMED')
+            cal.add('SEQUENCE', str(appointment.sequence_icsfile_ctl or 0))
             if meeting.description:
-                event.add('description').value = meeting.description
-            #if meeting.location:
-            #    event.add('location').value = meeting.location
+                cal.add_text('DESCRIPTION', meeting.description)
             if meeting.rrule:
-                event.add('rrule').value = meeting.rrule
-
-            organizer_add = event.add('organizer')
-
-            cn_value = "csj@agendamiento.co"
-            for server_id in self.env['ir.mail_server'].search([]):
-                for user_id in server_id.user_ids:
-                    if self.env.uid == user_id.id:
-                        cn_value = server_id.smtp_user
-
-            organizer_add.params['CN'] = ["sistemaaudiencias.ramajudicial.gov.co"]
-            organizer_add.params['ROLE'] = ["CHAIR"]
-            organizer_add.params['RSVP'] = ["TRUE"]
-            organizer_add.value = cn_value
-
-            if meeting.alarm_ids:
-                for alarm in meeting.alarm_ids:
-                    valarm = event.add('valarm')
-                    interval = alarm.interval
-                    duration = alarm.duration
-                    trigger = valarm.add('TRIGGER')
-                    trigger.params['related'] = ["START"]
-                    if interval == 'days':
-                        delta = timedelta(days=duration)
-                    elif interval == 'hours':
-                        delta = timedelta(hours=duration)
-                    elif interval == 'minutes':
-                        delta = timedelta(minutes=duration)
-                    trigger.value = delta
-                    valarm.add('DESCRIPTION').value = alarm.name or u'Odoo'
+                cal.add('RRULE', meeting.rrule)
+
+            cal.add('ORGANIZER', organizer, [
+                ('CN', 'sistemaaudiencias.ramajudicial.gov.co'),
+                ('ROLE', 'CHAIR'),
+                ('RSVP', 'TRUE'),
+            ])
+
+            for alarm in meeting.alarm_ids:
+                delta = ALARM_INTERVALS.get(alarm.interval)
+                if not delta:
+                    continue
+                cal.begin('VALARM')
+                cal.add('ACTION', 'DISPLAY')
+                cal.add('TRIGGER', ics.format_duration(delta * alarm.duration), [('RELATED', 'START')])
+                cal.add_text('DESCRIPTION', alarm.name or u'Odoo')
+                cal.end('VALARM')
             for attendee in meeting.attendee_ids:
-                attendee_add = event.add('attendee')
-                attendee_add.params['CUTYPE'] = ["INDIVIDUAL"]
-                attendee_add.params['ROLE'] = ["REQ-PARTICIPANT"]
-                attendee_add.params['PARTSTAT'] = ["ACCEPTED"]
-                #attendee_add.params['PARTSTAT'] = ["NEEDS-ACTION"]
-                attendee_add.params['RSVP'] = ["TRUE"]
-                attendee_add.params['CN'] = [attendee.email]
-                attendee_add.params['X-NUM-GUESTS'] = ["0"]
-                attendee_add.value = (attendee.email or u'')
-
-            result[meeting.id] = cal.serialize().encode('utf-8')
+                cal.add('ATTENDEE', attendee.email or u'', [
+                    ('CUTYPE', 'INDIVIDUAL'),
+                    ('ROLE', 'REQ-PARTICIPANT'),
+                    ('PARTSTAT', 'ACCEPTED'),
+                    ('RSVP', 'TRUE'),
+                    ('CN', attendee.email or u''),
+                    ('X-NUM-GUESTS', '0'),
+                ])
+
+            cal.end('VEVENT')
+            result[meeting.id] = cal.serialize()
 
         return result
 
@@ -241,6 +245,60 @@ class Meeting(models.Model):
 class Attendee(models.Model):
     _inherit = 'calendar.attendee'
 
+    @api.model
+    def _get_mail_priority(self, event):
+        """ Lane of the outgoing queue (see smtp_by_user) of the mails about
+            ``event``: urgent when it starts within calendar_csj.urgent_mail_hours
+            hours, high otherwise, ahead of the bulk notifications. """
+        hours = int(self.env['ir.config_parameter'].sudo().get_param('calendar_csj.urgent_mail_hours', 24))
+        if event.start and event.start - fields.Datetime.now() < timedelta(hours=hours):
+            return '0'
+        return '1'
+
+    @api.model
+    def _is_personal_template(self, template):
+        return any(PERSONAL_TEMPLATE_RE.search(template[name] or '') for name in ('subject', 'body_html'))
+
+    def _send_grouped_invitation(self, template, ics_file, force_event_id=None):
+        """ Render ``template`` once for the attendees of ``self`` (same
+            event and language) and queue a single mail addressed to all
+            of them, sent in one SMTP transaction.
+
+            :return: id of the mail.mail
+        """
+        first = self[0]
+        event = force_event_id or first.event_id
+        values = template.generate_email(first.id, fields=['subject', 'body_html', 'email_from', 'reply_to', 'mail_server_id'])
+        if values.get('body_html'):
+            # same layout as send_mail, titled with the event instead of the first attendee
+            layout = self.env.ref('mail.mail_notification_light', raise_if_not_found=False)
+            if layout:
+                body = layout.render({
+                    'message': self.env['mail.message'].sudo().new(dict(body=values['body_html'], record_name=event.display_name)),
+                    'model_description': self.env['ir.model']._get(event._name).display_name,
+                    'company': self.env.company,
+                    'record': event,
+                }, engine='ir.qweb', minimal_qcontext=True)
+                values['body_html'] = self.env['mail.thread']._replace_local_links(body)
+        attachment_ids = [(4, attachment_id) for attachment_id in values.pop('attachment_ids', [])]
+        values.pop('attachments', None)
+        if ics_file:
+            attachment_ids.append((0, 0, {
+                'name': 'invitation.ics',
+                'mimetype': 'text/calendar; method=REQUEST; charset=UTF-8',
+                'datas': base64.b64encode(ics_file),
+            }))
+        if not values.get('email_from'):
+            values.pop('email_from', None)
+        values.update({
+            'email_to': ','.join(attendee.email or attendee.partner_id.email for attendee in self),
+            'model': None,
+            'res_id': None,
+            'auto_delete': template.auto_delete,
+            'attachment_ids': attachment_ids,
+        })
+        return self.env['mail.mail'].sudo().create(values).id
+
     def _send_mail_to_attendees(self, template_xmlid, force_send=False, force_event_id=None):
         """ Send mail for event invitation to event attendees.
             :param template_xmlid: xml id of the email template to use to send the invitation
@@ -277,11 +335,33 @@ class Attendee(models.Model):
 
         # send email with attachments
         mail_ids = []
-        for attendee in self:
+        attendees = self.filtered(lambda attendee: attendee.email or attendee.partner_id.email)
+        # when the template does not depend on the attendee, the attendees of
+        # an event speaking the same language get one mail with several
+        # recipients, up to calendar_csj.invitation_max_recipients
+        max_recipients = int(self.env['ir.config_parameter'].sudo().get_param('calendar_csj.invitation_max_recipients', 50))
+        if max_recipients > 1 and len(attendees) > 1 and not self._is_personal_template(invitation_template):
+            groups = collections.defaultdict(list)
+            for attendee in attendees:
+                event_id = force_event_id.id if force_event_id else attendee.event_id.id
+                groups[(event_id, attendee.partner_id.lang)].append(attendee.id)
+            alone = self.browse()
+            for (event_id, lang), attendee_ids in groups.items():
+                if len(attendee_ids) == 1:
+                    alone |= self.browse(attendee_ids)
+                    continue
+                chunk_priority = self._get_mail_priority(self.env['calendar.event'].browse(event_id))
+                for chunk_ids in tools.split_every(max_recipients, attendee_ids):
+                    mail_ids.append(self.browse(chunk_ids).with_context(mail_priority=chunk_priority)._send_grouped_invitation(
+                        invitation_template, ics_files.get(event_id), force_event_id))
+            attendees = alone
+        for attendee in attendees:
             if attendee.email or attendee.partner_id.email:
                 # FIXME: is ics_file text or bytes?
                 event_id = force_event_id.id if force_event_id else attendee.event_id.id
                 ics_file = ics_files.get(event_id)
+                template = invitation_template.with_context(
+                    mail_priority=self._get_mail_priority(force_event_id or attendee.event_id))
 
                 email_values = {
                     'model': None,  # We don't want to have the mail in the tchatter while in queue!
@@ -293,9 +373,9 @@ class Attendee(models.Model):
                                 'mimetype': 'text/calendar; method=REQUEST; charset=UTF-8',
                                 'datas': base64.b64encode(ics_file)})
                     ]
-                    mail_ids.append(invitation_template.with_context(no_document=True).send_mail(attendee.id, email_values=email_values, notif_layout='mail.mail_notification_light'))
+                    mail_ids.append(template.with_context(no_document=True).send_mail(attendee.id, email_values=email_values, notif_layout='mail.mail_notification_light'))
                 else:
-                    mail_ids.append(invitation_template.send_mail(attendee.id, email_values=email_values, notif_layout='mail.mail_notification_light'))
+                    mail_ids.append(template.send_mail(attendee.id, email_values=email_values, notif_layout='mail.mail_notification_light'))
 
 
         if force_send and mail_ids:
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def next_block_by_code(self, sequence_code, count):
+        """ Reserve ``count`` values of the sequence ``sequence_code`` at once,
+            instead of calling next_by_code ``count`` times.
+
+            :return: list of the ``count`` values in increasing order, or of
+                     False when there is no such sequence, like next_by_code
+        """
+        if count <= 0:
+            return []
+        self.check_access_rights('read')
+        company_id = self.env.company.id
+        sequence = self.search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])], order='company_id', limit=1)
+        if not sequence:
+            _logger.debug("No ir.sequence has been found for code '%s'. Please make sure a sequence is set for current company." % sequence_code)
+            return [False] * count
+        if sequence.use_date_range:
+            # the numbers depend on the date range, keep the standard path
+            return [sequence._next() for index in range(count)]
+        if sequence.implementation == 'standard':
+            self.env.cr.execute("SELECT nextval('ir_sequence_%03d') FROM generate_series(1, %%s)" % sequence.id, (count,))
+            numbers = sorted(row[0] for row in self.env.cr.fetchall())
+        else:
+            self.env.cr.execute("SELECT number_next FROM ir_sequence WHERE id = %s FOR UPDATE NOWAIT", (sequence.id,))
+            number_next = self.env.cr.fetchone()[0]
+            self.env.cr.execute("UPDATE ir_sequence SET number_next = number_next + %s WHERE id = %s",
+                                (sequence.number_increment * count, sequence.id))
+            sequence.invalidate_cache(['number_next'], sequence.ids)
+            numbers = [number_next + sequence.number_increment * index for index in range(count)]
+        return [sequence.get_next_char(number) for number in numbers]
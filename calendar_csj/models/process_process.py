@@ -99,22 +99,27 @@ class ProcessProcess(models.Model):
             #return True, process_obj.city_id.name, process_obj.appointment_type_id.name, process_obj.judge_id.name
             return True, process_obj.city_id.name, process_obj.city_id.id, process_obj.appointment_type_id.name, process_obj.tag_number
         else:
-            if len(process_number) != 23:
-                return False, 'failed length'
-            city = self.env['res.entity'].sudo().search_city(process_number[0:5])
-            entity = self.env['res.entity'].sudo().search_entity(process_number[5:7])
-            speciality = self.env['res.entity'].sudo().search_speciality(process_number[7:9])
-            rad_year = process_number[12:16]
-            year = datetime.now()
-            year_limit = int(year.strftime("%Y")) + 1
-
-            if not city or not entity or not speciality:
-                return False, 'failed composition'
-            if not int(rad_year) in range(1900,year_limit):
-                return False, 'failed composition'
+            error = self.env['res.entity'].sudo().decode_process_number(process_number)['error']
+            if error:
+                return False, error
             else:
                 return False
 
+    @api.model
+    def fetch_process_exist_many(self, process_numbers):
+        """ fetch_process_exist of several numbers with one search.
+
+            :return: {process number: result of fetch_process_exist}
+        """
+        process_numbers = [number for number in process_numbers if number]
+        processes = {process.name: process for process in self.search([('name', 'in', process_numbers)])}
+        decoded = self.env['res.entity'].sudo().decode_process_numbers(
+            [number for number in process_numbers if number not in processes])
+        res = {decode['process_number']: (False, decode['error']) if decode['error'] else False for decode in decoded}
+        for name, process_obj in processes.items():
+            res[name] = True, process_obj.city_id.name, process_obj.city_id.id, process_obj.appointment_type_id.name, process_obj.tag_number
+        return res
+
     @api.model
     def fetch_scheduler_default_data(self):
         partner = self.env.user.partner_id
@@ -133,21 +138,13 @@ class ProcessProcess(models.Model):
 
     @api.model
     def process_create_from_add_content(self, process_number, city_id, calendar_appointment_type_id, judge_name, process_datetime, tag_number, request_type, prepare_file):
-        if len(process_number) != 23:
+        error = self.env['res.entity'].sudo().decode_process_number(process_number)['error']
+        if error == 'failed length':
             return False, 'La longitud del proceso no es correcta!.'
+        elif error:
+            return False, 'La estructura del número del proceso no es correcta!.'
 
         appointment_obj = self.env['calendar.appointment.type'].browse(int(calendar_appointment_type_id))
-        city = self.env['res.entity'].sudo().search_city(process_number[0:5])
-        entity = self.env['res.entity'].sudo().search_entity(process_number[5:7])
-        speciality = self.env['res.entity'].sudo().search_speciality(process_number[7:9])
-        rad_year = process_number[12:16]
-        year = datetime.now()
-        year_limit = int(year.strftime("%Y")) + 1
-        if city and entity and speciality:
-            if not int(rad_year) in range(1900,year_limit):
-                return False, 'La estructura del número del proceso no es correcta!.'
-        else:
-            return False, 'La estructura del número del proceso no es correcta!.'
 
         if request_type == 'Libre':
             request_type = 'l'
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+import hashlib
+
+from odoo import models, fields, api, tools, _
+from ..tools import SuggestionIndex
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -15,8 +18,66 @@ class ResCity(models.Model):
             result.append((rec.id, rec.name + ' - ' + rec.state_id.name + ' - ' + rec.zipcode))
         return result
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(ResCity, self).create(vals_list)
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super(ResCity, self).write(vals)
+        if {'name', 'zipcode', 'state_id'} & set(vals):
+            # cities are part of the typeahead indexes of res.city and calendar.appointment.type
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(ResCity, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_suggestion_index(self):
+        """ City table of the typeahead, kept in the registry cache of each worker.
+            Entries are (id, 'city - department', zipcode, department).
+
+            :return: (index, etag, last modification datetime)
+        """
+        cities = self.sudo().search_read([], ['name', 'zipcode', 'state_id', 'write_date'], order='name')
+        state_ids = list({city['state_id'][0] for city in cities if city['state_id']})
+        states = {state['id']: state for state in self.env['res.country.state'].sudo().browse(state_ids).read(['name', 'write_date'])}
+        entries = []
+        last_modified = False
+        for city in cities:
+            state = states.get(city['state_id'] and city['state_id'][0]) or {}
+            entries.append((city['id'], '%s - %s' % (city['name'], state.get('name') or ''), city['zipcode'] or '', state.get('name') or ''))
+            for date in (city['write_date'], state.get('write_date')):
+                if date and (not last_modified or date > last_modified):
+                    last_modified = date
+        etag = hashlib.sha1(repr((entries, last_modified)).encode()).hexdigest()
+        index = SuggestionIndex(entries, key=lambda entry: ' '.join(entry[1:3]))
+        return index, etag, last_modified
+
+    @api.model
+    def search_suggestion(self, query, limit=50, offset=0):
+        """ Cities whose name, zipcode or department start with the words of
+            ``query``, best matches first.
+
+            :return: list of (id, 'city - department')
+        """
+        index = self._get_suggestion_index()[0]
+        return [(entry[0], entry[1]) for entry in index.search(query, limit=limit, offset=offset)]
+
 
 class ResCountryState(models.Model):
     _inherit = "res.country.state"
 
     dane_code = fields.Char('Código Dane', required="True")
+
+    def write(self, vals):
+        res = super(ResCountryState, self).write(vals)
+        if 'name' in vals:
+            # department names are part of the typeahead index of res.city
+            self.clear_caches()
+        return res
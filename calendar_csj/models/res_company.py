@@ -47,6 +47,7 @@ class ResUsers(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
+        portal_indexes = []
         for i in range(len(vals_list)):
             user = vals_list[i]
             portal_flag = False
@@ -67,49 +68,64 @@ class ResUsers(models.Model):
                     pass
 
             if portal_flag:
-                # Search user and if exist fill fields and if not create and fill fields
-                try:
-                    api = {"method": "search", "email": user.get("login")}
-                    resp = self.env["api.lifesize"].api_user_crud(api)
-                    vals_list[i]["extension_lifesize"] = resp["userObject"]["extension"]
-                    vals_list[i]["uuid_lifesize"] = resp["userObject"]["UUID"]
-                    _logger.error(f"\nSEARCH LIFESIZE OK: {user}\n{vals_list}")
-                except ValueError:
-                    try:
-                        api = {
-                            "method": "create",
-                            "email": user.get("login"),
-                            "name": user.get("name"),
-                        }
-                        resp = self.env["api.lifesize"].api_user_crud(api)
-                        vals_list[i]["extension_lifesize"] = resp["userObject"][
-                            "extension"
-                        ]
-                        vals_list[i]["uuid_lifesize"] = resp["userObject"]["UUID"]
-                        _logger.error(f"\nCREATE LIFESIZE OK: {user}\n{vals_list}")
-                    except:
-                        _logger.error(
-                            f"\nSOMETING WENT WRONG LIFESIZE: {user}\n{vals_list}"
-                        )
-                finally:
-                    pass
+                portal_indexes.append(i)
+        if portal_indexes:
+            self._lifesize_provision(vals_list, portal_indexes)
         users = super(ResUsers, self).create(vals_list)
         _logger.error(
             f"\nCREATE USER:\nusers_object: {users}\nvals_list: {vals_list}\n"
         )
         return users
 
-    def unlink(self):
-        for id in self.ids:
-            user = self.env["res.users"].browse(id)
-            if user and user.uuid_lifesize and self.env.user.company_id.key_lifesize:
-                api = {
-                    "method": "delete",
-                    "uuid": user.uuid_lifesize,
+    def _lifesize_provision(self, vals_list, indexes):
+        """ Search the Lifesize users of the portal users being created and
+            create the missing ones, all the requests of a step are sent
+            concurrently. """
+        api = self.env["api.lifesize"]
+        searches = api.api_user_crud_many(
+            [{"method": "search", "email": vals_list[i].get("login")} for i in indexes]
+        )
+        missing = []
+        for i, resp in zip(indexes, searches):
+            user = vals_list[i]
+            if resp["success"]:
+                vals_list[i]["extension_lifesize"] = resp["result"]["userObject"]["extension"]
+                vals_list[i]["uuid_lifesize"] = resp["result"]["userObject"]["UUID"]
+                _logger.error(f"\nSEARCH LIFESIZE OK: {user}\n{vals_list}")
+            elif isinstance(resp["error"], ValueError):
+                missing.append(i)
+            else:
+                raise resp["error"]
+        creates = api.api_user_crud_many(
+            [
+                {
+                    "method": "create",
+                    "email": vals_list[i].get("login"),
+                    "name": vals_list[i].get("name"),
                 }
+                for i in missing
+            ]
+        )
+        for i, resp in zip(missing, creates):
+            user = vals_list[i]
+            try:
+                vals_list[i]["extension_lifesize"] = resp["result"]["userObject"]["extension"]
+                vals_list[i]["uuid_lifesize"] = resp["result"]["userObject"]["UUID"]
+                _logger.error(f"\nCREATE LIFESIZE OK: {user}\n{vals_list}")
+            except:
+                _logger.error(
+                    f"\nSOMETING WENT WRONG LIFESIZE: {user}\n{vals_list}"
+                )
+
+    def unlink(self):
+        users = self.filtered("uuid_lifesize")
+        if users and self.env.user.company_id.key_lifesize:
+            results = self.env["api.lifesize"].api_user_crud_many(
+                [{"method": "delete", "uuid": user.uuid_lifesize} for user in users]
+            )
+            for resp in results:
                 try:
-                    resp = self.env["api.lifesize"].api_user_crud(api)
-                    if resp["success"]:
+                    if resp["result"]["success"]:
                         _logger.error(f"\nDELETE LIFESIZE OK")
                     else:
                         _logger.error(f"\nDELETE LIFESIZE WRONG: {resp}")
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.osv import expression
+from ..tools import split_process_number
 
 import logging
 _logger = logging.getLogger(__name__)
 
+# (part of a process number, model, field holding its code)
+PROCESS_CODE_MODELS = [
+    ('city', 'res.city', 'zipcode'),
+    ('entity', 'res.entity', 'code'),
+    ('specialty', 'res.specialty', 'code'),
+    ('judged', 'res.judged', 'code'),
+]
+
+
 class ResEntity(models.Model):
     _name = 'res.entity'
     _description = 'Res entity'
@@ -22,10 +33,14 @@ class ResEntity(models.Model):
         name = vals.get('mame')
         display_name = code + ' ' + name
         vals.update(name=display_name)
-        return super(ResEntity, self).create(vals)
+        res = super(ResEntity, self).create(vals)
+        self.clear_caches()
+        return res
 
     def write(self, vals):
         res = super(ResEntity, self).write(vals)
+        if 'code' in vals:
+            self.clear_caches()
         if vals.get('code') or vals.get('mame'):
             for record in self:
                 code = vals.get('code') or record.code
@@ -34,33 +49,62 @@ class ResEntity(models.Model):
                 record.name = display_name
         return res
 
+    def unlink(self):
+        res = super(ResEntity, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_process_codes(self):
+        """ Codes a process number is made of, kept in the registry cache of
+            each worker and cleared when a city, entity, specialty or judged
+            is modified.
+
+            :return: {part of the number: frozenset of the known codes}
+        """
+        codes = {}
+        for part, model, field in PROCESS_CODE_MODELS:
+            records = self.env[model].sudo().search_read([(field, '!=', False)], [field])
+            codes[part] = frozenset(record[field] for record in records)
+        return codes
+
+    @api.model
+    def decode_process_number(self, process_number):
+        """ Split a process number and check its parts against the known codes.
+
+            :return: dict with the parts of the number (see
+                     tools.PROCESS_NUMBER_PARTS) and ``error``: False when
+                     the number is valid, 'failed length' or 'failed composition'
+        """
+        parts = split_process_number(process_number)
+        if parts is None:
+            return {'process_number': process_number, 'error': 'failed length'}
+        res = dict(parts, process_number=process_number, error=False)
+        codes = self._get_process_codes()
+        # the judged code is not checked, as in the booking form
+        if any(parts[part] not in codes[part] for part in ('city', 'entity', 'specialty')):
+            res['error'] = 'failed composition'
+        elif not parts['year'].isdigit() or not 1900 <= int(parts['year']) <= fields.Date.today().year:
+            res['error'] = 'failed composition'
+        return res
+
+    @api.model
+    def decode_process_numbers(self, process_numbers):
+        """ decode_process_number of several numbers, in the same order. """
+        return [self.decode_process_number(process_number) for process_number in process_numbers]
+
     def search_city(self, var):
-        res = self.env['res.city'].sudo().search([('zipcode','=',var)])
-        if res:
-            return True
-        else:
-            return False
+        return var in self._get_process_codes()['city']
 
     def search_speciality(self, var):
-        res = self.env['res.specialty'].sudo().search([('code','=',var)])
-        if res:
-            return True
-        else:
-            return False
+        return var in self._get_process_codes()['specialty']
 
     def search_entity(self, var):
-        res = self.env['res.entity'].sudo().search([('code','=',var)])
-        if res:
-            return True
-        else:
-            return False
+        return var in self._get_process_codes()['entity']
 
     def search_judged(self, var):
-        res = self.env['res.judged'].sudo().search([('code','=',var)])
-        if res:
-            return True
-        else:
-            return False
+        return var in self._get_process_codes()['judged']
 
 class ResSpecialty(models.Model):
     _name = 'res.specialty'
@@ -90,10 +134,14 @@ class ResSpecialty(models.Model):
         name = vals.get('mame')
         display_name = code_entity + code + ' ' + name_entity + ' - ' + name
         vals.update(name=display_name)
-        return super(ResSpecialty, self).create(vals)
+        res = super(ResSpecialty, self).create(vals)
+        self.clear_caches()
+        return res
 
     def write(self, vals):
         res = super(ResSpecialty, self).write(vals)
+        if 'code' in vals:
+            self.clear_caches()
         if vals.get('code') or vals.get('mame') or vals.get('entity_id'):
             for record in self:
                 entity_id = self.env['res.entity'].browse(vals.get('entity_id'))
@@ -106,6 +154,11 @@ class ResSpecialty(models.Model):
                 record.name = display_name
         return res
 
+    def unlink(self):
+        res = super(ResSpecialty, self).unlink()
+        self.clear_caches()
+        return res
+
 
 class ResJudgedRoom(models.Model):
     _name = 'res.judged.room'
@@ -186,6 +239,24 @@ class ResJudged(models.Model):
             name = record.mame or ''
             record.name = code_city + code_entity + code_specialty + code + ' ' + name_specialty + ' - ' + name
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(ResJudged, self).create(vals_list)
+        # judged codes are checked when decoding process numbers
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super(ResJudged, self).write(vals)
+        if 'code' in vals:
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super(ResJudged, self).unlink()
+        self.clear_caches()
+        return res
+
 
 class ResPartner(models.Model):
     _inherit = 'res.partner'
@@ -303,7 +374,11 @@ class ResPartner(models.Model):
     def write(self, vals):
         if 'active' in vals or vals.get('company_type'):
             self.write_hr_calendar(vals)
-        return super(ResPartner, self).write(vals)
+        res = super(ResPartner, self).write(vals)
+        if {'city_id', 'recording_add_ok'} & set(vals) and self.env['calendar.appointment.type'].sudo().search_count([('judged_id', 'in', self.ids)]):
+            # drop the typeahead index of calendar.appointment.type
+            self.clear_caches()
+        return res
 
     def create_hr_calendar(self, vals):
         dic = {}
@@ -364,26 +439,55 @@ class ResPartner(models.Model):
             self.hr_employee_id.write({'user_id': user.id})
         self.appointment_user = user
 
+    def init(self):
+        # trigram index for the ilike of the typeahead, only when pg_trgm is available
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if self.env.cr.fetchone():
+            self.env.cr.execute("""
+                CREATE INDEX IF NOT EXISTS res_partner_name_trgm_idx
+                ON res_partner USING gin (name gin_trgm_ops)
+            """)
+
     def search_company_type(self):
         res = self.env['res.partner'].sudo().search([('company_type','=','judged')])
         return res
 
+    @api.model
+    def search_suggestion(self, query, company_type, limit=30, offset=0):
+        """ Partners of ``company_type`` whose name or code contain every word
+            of ``query``, filtered and paginated in SQL.
+
+            :return: list of dicts with id, name, code and city (city name)
+        """
+        domain = [('company_type', '=', company_type)]
+        for word in (query or '').split():
+            domain = expression.AND([domain, ['|', ('name', 'ilike', word), ('code', 'ilike', word)]])
+        partners = self.sudo().search_read(domain, ['name', 'code', 'city_id'], offset=offset, limit=limit, order='name, id')
+        city_ids = list({partner['city_id'][0] for partner in partners if partner['city_id']})
+        cities = {city['id']: city['name'] for city in self.env['res.city'].sudo().browse(city_ids).read(['name'])}
+        return [{
+            'id': partner['id'],
+            'name': partner['name'],
+            'code': partner['code'] or '',
+            'city': cities.get(partner['city_id'] and partner['city_id'][0]) or '',
+        } for partner in partners]
+
+    def calendar_slots_availability(self, slots):
+        """ Availability of the partner(s) for many (start, stop) slots at once,
+            resolved with a single overlap query on their calendar events.
+
+            :return: list of booleans, True when the slot is free for all the partners
+        """
+        busy = self.env['calendar.event'].sudo()._get_busy_slots(self.ids, slots)
+        return [not slot_busy for slot_busy in busy]
+
     def calendar_verify_availability(self, date_start, date_end):
         """ verify availability of the partner(s) between 2 datetimes on their calendar
         """
-        if bool(self.env['calendar.event'].search_count([
-            ('partner_ids', 'in', self.ids),
-            ('state', 'not in', ['cancel',]),
-            '|', '&', ('start_datetime', '<=', fields.Datetime.to_string(date_end)),
-                      ('stop_datetime', '>=', fields.Datetime.to_string(date_start)),
-
-                 '&', ('stop_datetime', '<=', fields.Date.to_string(date_end)),
-                      ('stop_datetime', '>=', fields.Date.to_string(date_start))])):
-            #return False
+        if not self.env['ir.config_parameter'].sudo().get_param('calendar_csj.block_busy_slots'):
+            # overlapping audiences are allowed unless the parameter is set
             return True
-        return True
-
-
+        return self.calendar_slots_availability([(date_start, date_end)])[0]
 
 
 class HrEmployee(models.Model):
@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
 
-from . import calendar_appointment
\ No newline at end of file
+from . import calendar_appointment
+from . import appointment_xlsx
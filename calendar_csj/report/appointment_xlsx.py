@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+
+from dateutil.relativedelta import relativedelta
+from odoo import models, api
+from odoo.tools import split_every
+import xlsxwriter
+
+import logging
+_logger = logging.getLogger(__name__)
+
+XLSX_CHUNK_SIZE = 1000
+
+STATE_LABELS = {
+    'open': 'AGENDADO',
+    'realized': 'REALIZADA',
+    'unrealized': 'NO REALIZADA',
+    'assist_postpone': 'ASISTIDA Y APLAZADA',
+    'postpone': 'APLAZADA',
+    'assist_cancel': 'ASISTIDA Y CANCELADA',
+    'cancel': 'CANCELADO',
+    'draft': 'DUPLICADO',
+}
+
+TYPE_LABELS = {
+    'audience': 'AUDIENCIA',
+    'conference': 'VIDEO CONFERENCIA',
+    'streaming': 'STREAMING',
+}
+
+# fields read by chunk, many2one are read as ids and resolved in _xlsx_related
+XLSX_FIELDS = [
+    'appointment_code', 'request_type_label', 'type', 'calendar_date', 'calendar_time',
+    'judged_only_code', 'judged_only_name', 'city_id', 'country_state_id',
+    'destination_ids_label', 'reception_id', 'reception_detail', 'observations',
+    'request_date', 'applicant_raw_name', 'state', 'applicant_email', 'process_number',
+    'room_id_mame', 'partner_ids_label', 'applicant_mobile', 'class_id', 'request_type',
+    'appointment_date', 'create_uid', 'appointment_close_date', 'appointment_close_user_login',
+    'end_date', 'end_hour', 'state_description', 'tag_number', 'link_download_text', 'name',
+    'lifesize_url', 'calendar_datetime',
+]
+
+
+def _upper(value):
+    return value.upper() if value else ''
+
+
+def _optional(value):
+    return str(value) if value else ''
+
+
+def _float_time(value):
+    return '{0:02.0f}:{1:02.0f}'.format(*divmod((value or 0.0) * 60, 60))
+
+
+# (header, width, value) of the /my/appointments report
+XLSX_PRIVATE_COLUMNS = [
+    ('ID SOLICITUD', 20, lambda r: r['appointment_code']),
+    ('TIPO DE SOLICITUD', 40, lambda r: r['request_type_label']),
+    ('TIPO DE AUDIENCIA', 20, lambda r: TYPE_LABELS.get(r['type'], '')),
+    ('FECHA DE REALIZACIÓN', 20, lambda r: str(r['calendar_date'])),
+    ('HORA DE INICIO', 20, lambda r: _float_time(r['calendar_time'])),
+    ('CÓDIGO DESPACHO SOLICITANTE', 20, lambda r: r['judged_only_code']),
+    ('DESPACHO SOLICITANTE', 60, lambda r: r['judged_only_name']),
+    ('CIUDAD ORIGEN', 20, lambda r: _upper(r['city_name'])),
+    ('DEPARTAMENTO ORIGEN', 20, lambda r: _upper(r['state_name'])),
+    ('DESTINOS', 20, lambda r: r['destination_ids_label']),
+    ('MEDIO DE RECEPCIÓN', 20, lambda r: r['reception_name']),
+    ('DETALLES MEDIO DE RECEPCIÓN', 50, lambda r: _upper(r['reception_detail'])),
+    ('OBSERVACIONES', 50, lambda r: _upper(r['observations'])),
+    ('FECHA DE SOLICITUD', 20, lambda r: str(r['request_date'])),
+    ('NOMBRE DEL SOLICITANTE', 40, lambda r: _upper(r['applicant_raw_name'])),
+    ('ESTADO', 20, lambda r: STATE_LABELS.get(r['state'], '')),
+    ('CORREO SALIENTE', 50, lambda r: r['applicant_email']),
+    ('NÚMERO DE PROCESO', 30, lambda r: r['process_number']),
+    ('SALA', 20, lambda r: _upper(r['room_id_mame'])),
+    ('CORREO PARTICIPANTES', 40, lambda r: r['partner_ids_label']),
+    ('CELULAR', 20, lambda r: r['applicant_mobile']),
+    ('CLASE DE VIDEOCONFERENCIA', 20, lambda r: _upper(r['class_name'])),
+    ('TIPO DE AUDIENCIA', 20, lambda r: _upper(r['request_type'])),
+    ('FECHA AGENDAMIENTO', 20, lambda r: str(r['appointment_date'])),
+    ('USUARIO AGENDAMIENTO', 40, lambda r: r['create_login']),
+    ('FECHA CIERRE', 20, lambda r: _optional(r['appointment_close_date'])),
+    ('USUARIO DE CIERRE', 50, lambda r: r['appointment_close_user_login'] or ''),
+    ('FECHA FINAL', 20, lambda r: _optional(r['end_date'])),
+    ('HORA FINAL', 20, lambda r: _float_time(r['end_hour'])),
+    ('DESCRIPCION', 20, lambda r: _upper(r['state_description'])),
+    ('ETIQUETA', 20, lambda r: r['tag_number']),
+    ('LINK DE GRABACIÓN', 20, lambda r: r['link_download_text'] or ''),
+    ('CREADO POR', 60, lambda r: r['create_login']),
+    ('NOMBRE SALA LIFESIZE', 60, lambda r: r['name']),
+    ('URL LIFESIZE', 20, lambda r: r['lifesize_url']),
+    ('FECHA Y HORA DE REALIZACIÓN', 40, lambda r: str(r['calendar_datetime'] - relativedelta(hours=5))),
+]
+
+# (header, width, value) of the /public report
+XLSX_PUBLIC_COLUMNS = [
+    ('ID SOLICITUD', 20, lambda r: r['appointment_code']),
+    ('TIPO DE SOLICITUD', 40, lambda r: r['request_type_label']),
+    ('TIPO DE AUDIENCIA', 20, lambda r: TYPE_LABELS.get(r['type'], '')),
+    ('FECHA DE REALIZACIÓN', 20, lambda r: str(r['calendar_date'])),
+    ('HORA DE INICIO', 20, lambda r: _float_time(r['calendar_time'])),
+    ('CÓDIGO DESPACHO SOLICITANTE', 20, lambda r: r['judged_only_code']),
+    ('DESPACHO SOLICITANTE', 60, lambda r: r['judged_only_name']),
+    ('CIUDAD ORIGEN', 20, lambda r: _upper(r['city_name'])),
+    ('DEPARTAMENTO ORIGEN', 20, lambda r: _upper(r['state_name'])),
+    ('DESTINOS', 20, lambda r: r['destination_ids_label']),
+    ('OBSERVACIONES', 50, lambda r: _upper(r['observations'])),
+    ('FECHA DE SOLICITUD', 20, lambda r: str(r['request_date'])),
+    ('NOMBRE DEL SOLICITANTE', 60, lambda r: _upper(r['applicant_raw_name'])),
+    ('ESTADO', 20, lambda r: STATE_LABELS.get(r['state'], '')),
+    ('NÚMERO DE PROCESO', 30, lambda r: r['process_number']),
+    ('SALA', 30, lambda r: _upper(r['room_id_mame'])),
+    ('CLASE DE VIDEOCONFERENCIA', 20, lambda r: _upper(r['class_name'])),
+    ('TIPO DE AUDIENCIA', 20, lambda r: _upper(r['request_type'])),
+    ('FECHA AGENDAMIENTO', 20, lambda r: str(r['appointment_date'])),
+    ('FECHA CIERRE', 20, lambda r: _optional(r['appointment_close_date'])),
+    ('FECHA FINAL', 20, lambda r: _optional(r['end_date'])),
+    ('DESCRIPCION', 20, lambda r: _upper(r['state_description'])),
+    ('ETIQUETA', 70, lambda r: r['tag_number']),
+    ('LINK DE GRABACIÓN', 60, lambda r: r['link_download_text'] if r['link_download_text'] and r['request_type'] == 'l' else ''),
+    ('CREADO POR', 50, lambda r: _upper(r['create_name'])),
+    ('NOMBRE SALA LIFESIZE', 40, lambda r: r['name']),
+    ('URL LIFESIZE', 40, lambda r: r['lifesize_url']),
+    ('FECHA Y HORA DE REALIZACIÓN', 30, lambda r: str(r['calendar_datetime'] - relativedelta(hours=5))),
+]
+
+XLSX_COLUMNS = {
+    'private': XLSX_PRIVATE_COLUMNS,
+    'public': XLSX_PUBLIC_COLUMNS,
+}
+
+
+class CalendarAppointment(models.Model):
+    _inherit = 'calendar.appointment'
+
+    @api.model
+    def _xlsx_related(self, rows, cache):
+        """ Add the names of the many2one of a chunk of rows, reading each
+            comodel once per chunk; ``cache`` is shared by all the chunks.
+        """
+        related = [
+            ('city_id', 'res.city', ['name'], {'name': 'city_name'}),
+            ('country_state_id', 'res.country.state', ['name'], {'name': 'state_name'}),
+            ('reception_id', 'calendar.reception', ['name'], {'name': 'reception_name'}),
+            ('class_id', 'calendar.class', ['name'], {'name': 'class_name'}),
+            ('create_uid', 'res.users', ['login', 'name'], {'login': 'create_login', 'name': 'create_name'}),
+        ]
+        for field, model, names, keys in related:
+            values = cache.setdefault(model, {})
+            missing = {row[field] for row in rows if row[field]} - set(values)
+            if missing:
+                for record in self.env[model].sudo().browse(list(missing)).read(names):
+                    values[record['id']] = record
+            for row in rows:
+                record = values.get(row[field]) or {}
+                for name, key in keys.items():
+                    row[key] = record.get(name) or ''
+        return rows
+
+    @api.model
+    def _export_rows(self, domain, order=None, layout='private', progress=None):
+        """ Yield the header then the cells of each appointment of ``domain``.
+
+            Appointments are read by chunks of XLSX_CHUNK_SIZE and the cache
+            is dropped between chunks, so the memory used does not depend on
+            the number of appointments.
+
+            :param progress: optional callable receiving (done, total) after each chunk
+        """
+        columns = XLSX_COLUMNS[layout]
+        yield [header for header, width, value in columns]
+        ids = self.search(domain, order=order).ids
+        done, cache = 0, {}
+        for chunk_ids in split_every(XLSX_CHUNK_SIZE, ids):
+            rows = self.browse(chunk_ids).read(XLSX_FIELDS, load=None)
+            for row in self._xlsx_related(rows, cache):
+                yield [value(row) for header, width, value in columns]
+            done += len(chunk_ids)
+            # drop the records of the chunk and their prefetched relations
+            self.invalidate_cache()
+            if progress:
+                progress(done, len(ids))
+
+    @api.model
+    def _export_xlsx(self, fileobj, domain, order=None, layout='private', progress=None):
+        """ Write the appointments of ``domain`` to ``fileobj`` as an xlsx report,
+            in xlsxwriter constant_memory mode.
+        """
+        columns = XLSX_COLUMNS[layout]
+        workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True, 'default_date_format': 'yyyy/mm/dd'})
+        sheet = workbook.add_worksheet('Agendamientos')
+        cell_format = workbook.add_format()
+        if layout == 'public':
+            cell_format.set_font_name('Calibri')
+            cell_format.set_font_size(8)
+        head = workbook.add_format()
+        workbook.formats[0].set_font_size(8)
+
+        for col, (header, width, value) in enumerate(columns):
+            sheet.set_column(col, col, width)
+        rows = self._export_rows(domain, order=order, layout=layout, progress=progress)
+        sheet.write_row(0, 0, next(rows), head)
+        count = 0
+        for count, cells in enumerate(rows, 1):
+            sheet.write_row(count, 0, cells, cell_format)
+        workbook.close()
+        _logger.info('Appointments xlsx report: %s rows', count)
+        return count
+
+    @api.model
+    def _export_csv(self, fileobj, domain, order=None, layout='private', progress=None):
+        """ Write the appointments of ``domain`` to the binary ``fileobj`` as csv. """
+        stream = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        writer = csv.writer(stream)
+        count = -1
+        for count, cells in enumerate(self._export_rows(domain, order=order, layout=layout, progress=progress)):
+            writer.writerow(cells)
+        stream.flush()
+        # keep fileobj open for the caller
+        stream.detach()
+        _logger.info('Appointments csv report: %s rows', count)
+        return count
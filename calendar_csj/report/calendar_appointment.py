@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 
+from datetime import timedelta
+
 from odoo import models, fields, api, _, tools
 import logging
 
 _logger = logging.getLogger(__name__)
 
+REPORT_SOURCE_VIEW = 'calendar_appointment_report_source'
+# one row table holding the time of the last refresh; a system parameter
+# would clear the registry caches of every worker on each refresh
+REPORT_STATE_TABLE = 'calendar_appointment_report_state'
+REPORT_REFRESH_OVERLAP = timedelta(minutes=15)
+
 
 class ResCompany(models.Model):
     _inherit = "res.company"
@@ -61,7 +69,7 @@ class CalendarAppointmentReport(models.Model):
         query = """
 
                 SELECT 
-                row_number() OVER () as id,
+                ca.id as id,
                 ca.appointment_code,
                 (ch1.name || ' ' || ch2.name || ' ' || ch3.name)::text as request_type_label,
 
@@ -188,5 +196,93 @@ class CalendarAppointmentReport(models.Model):
 
                 where 1=1
             """
-        tools.drop_view_if_exists(self.env.cr, self._table)
-        self.env.cr.execute("""CREATE or REPLACE VIEW %s as (%s)""" % (self._table, query))
+        # the query stays available as a view, the report reads a table
+        # filled from it and kept up to date by _refresh
+        tools.drop_view_if_exists(self.env.cr, REPORT_SOURCE_VIEW)
+        self.env.cr.execute("""CREATE or REPLACE VIEW %s as (%s)""" % (REPORT_SOURCE_VIEW, query))
+        kind = tools.table_kind(self.env.cr, self._table)
+        if kind == 'v':
+            tools.drop_view_if_exists(self.env.cr, self._table)
+        elif kind:
+            self.env.cr.execute("DROP TABLE %s" % self._table)
+        self.env.cr.execute("SELECT now() at time zone 'UTC'")
+        refreshed_at = self.env.cr.fetchone()[0]
+        self.env.cr.execute("CREATE TABLE %s AS SELECT * FROM %s" % (self._table, REPORT_SOURCE_VIEW))
+        self.env.cr.execute("ALTER TABLE %s ADD PRIMARY KEY (id)" % self._table)
+        for column in ('calendar_datetime', 'state', 'judged_only_code'):
+            self.env.cr.execute("CREATE INDEX %s_%s_idx ON %s (%s)" % (self._table, column, self._table, column))
+        # used to find the appointments to refresh
+        self.env.cr.execute("CREATE INDEX IF NOT EXISTS calendar_appointment_write_date_idx ON calendar_appointment (write_date)")
+        self.env.cr.execute("CREATE INDEX IF NOT EXISTS calendar_appointment_appointment_type_id_idx ON calendar_appointment (appointment_type_id)")
+        self.env.cr.execute("CREATE INDEX IF NOT EXISTS calendar_appointment_room_id_idx ON calendar_appointment (room_id)")
+        self.env.cr.execute("CREATE TABLE IF NOT EXISTS %s (refreshed_at timestamp NOT NULL)" % REPORT_STATE_TABLE)
+        self._set_refreshed_at(refreshed_at)
+
+    @api.model
+    def _set_refreshed_at(self, refreshed_at):
+        self.env.cr.execute("DELETE FROM %s" % REPORT_STATE_TABLE)
+        self.env.cr.execute("INSERT INTO %s (refreshed_at) VALUES (%%s)" % REPORT_STATE_TABLE, (refreshed_at,))
+
+    @api.model
+    def _refresh(self):
+        """ Update the rows of the appointments changed since the last refresh,
+            directly or through their online appointment, judge or room.
+
+            write_date is the start of the writing transaction, so the window
+            overlaps the previous refresh by REPORT_REFRESH_OVERLAP to catch
+            transactions that were still running at that time.
+        """
+        self.env['calendar.appointment'].flush()
+        if not tools.table_exists(self.env.cr, REPORT_STATE_TABLE):
+            self.init()
+            return
+        self.env.cr.execute("SELECT refreshed_at FROM %s" % REPORT_STATE_TABLE)
+        row = self.env.cr.fetchone()
+        if not row:
+            self.init()
+            return
+        since = row[0] - REPORT_REFRESH_OVERLAP
+        self.env.cr.execute("SELECT now() at time zone 'UTC'")
+        refreshed_at = self.env.cr.fetchone()[0]
+        self.env.cr.execute("SELECT * FROM %s LIMIT 0" % REPORT_SOURCE_VIEW)
+        columns = [column[0] for column in self.env.cr.description if column[0] != 'id']
+        self.env.cr.execute("""
+            INSERT INTO {table}
+            SELECT * FROM {source}
+            WHERE id IN (
+                SELECT id FROM calendar_appointment WHERE write_date >= %(since)s
+                UNION
+                SELECT ca.id FROM calendar_appointment ca
+                JOIN calendar_appointment_type cat ON ca.appointment_type_id = cat.id
+                JOIN res_partner partner ON cat.judged_id = partner.id
+                WHERE cat.write_date >= %(since)s OR partner.write_date >= %(since)s
+                UNION
+                SELECT ca.id FROM calendar_appointment ca
+                JOIN res_judged_room room ON ca.room_id = room.id
+                WHERE room.write_date >= %(since)s
+            )
+            ON CONFLICT (id) DO UPDATE SET {updates}
+        """.format(
+            table=self._table,
+            source=REPORT_SOURCE_VIEW,
+            updates=', '.join('"%s" = EXCLUDED."%s"' % (column, column) for column in columns),
+        ), {'since': since})
+        _logger.info('calendar.appointment.report: %s rows refreshed', self.env.cr.rowcount)
+        self._set_refreshed_at(refreshed_at)
+        self.invalidate_cache()
+
+    @api.model
+    def _remove_appointments(self, ids):
+        self.env.cr.execute("DELETE FROM %s WHERE id IN %%s" % self._table, (tuple(ids),))
+        self.invalidate_cache(ids=list(ids))
+
+
+class CalendarAppointment(models.Model):
+    _inherit = 'calendar.appointment'
+
+    def unlink(self):
+        ids = self.ids
+        res = super(CalendarAppointment, self).unlink()
+        if ids:
+            self.env['calendar.appointment.report']._remove_appointments(ids)
+        return res
@@ -362,6 +362,7 @@ odoo.define('calendar_csj.calendar_csj', function(require) {
           minLength: 1,
           maxItem: 15,
           delay: 500,
+          dynamic: true,
           order: "asc",
           cache: false,
           autoFocus:true,
@@ -396,6 +397,7 @@ odoo.define('calendar_csj.calendar_csj', function(require) {
                     minLength: 1,
                     maxItem: 15,
                     delay: 500,
+                    dynamic: true,
                     order: "asc",
                     cache: false,
                     searchOnFocus: true,
@@ -467,6 +469,7 @@ odoo.define('calendar_csj.calendar_csj', function(require) {
         	minLength: 1,
 		      maxItem: 15,
 		      delay: 500,
+		      dynamic: true,
 		      order: "asc",
           cache: false,
           searchOnFocus: true,
@@ -510,6 +513,7 @@ odoo.define('calendar_csj.calendar_csj', function(require) {
             	minLength: 1,
 				maxItem: 15,
 				delay: 500,
+				dynamic: true,
 				order: "asc",
 				hint: true,
 				display: ["id","cita"],
@@ -540,6 +544,7 @@ odoo.define('calendar_csj.calendar_csj', function(require) {
         minLength: 1,
 				maxItem: 15,
 				delay: 500,
+				dynamic: true,
         cache: false,
         searchOnFocus: true,
         hint: true,
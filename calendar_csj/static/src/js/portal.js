@@ -420,6 +420,7 @@ odoo.define('calendar_csj.calendar_portal_csj_edit_judged', function(require) {
               minLength: 1,
 		      maxItem: 15,
 		      delay: 500,
+		      dynamic: true,
 		      order: "asc",
               cache: false,
               searchOnFocus: true,
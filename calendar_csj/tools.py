@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import heapq
+import re
+import unicodedata
+
+_TOKEN_SEPARATOR = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_text(text):
+    """ Lowercase the text and fold its accents, so 'Bogotá' and 'BOGOTA' match. """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_SEPARATOR.split(normalize_text(text)) if token]
+
+
+class SuggestionIndex(object):
+    """ Immutable in-memory index used by the typeahead endpoints.
+
+        ``entries`` is a list of tuples whose second item is the label shown to
+        the user; ``key`` optionally returns another text to index for an
+        entry. That text is split in normalized tokens kept in a sorted list,
+        so every word of the query is resolved with a binary search on the
+        token prefix; words of three or more characters also match inside the
+        text when no token starts with them.
+    """
+
+    def __init__(self, entries, key=None):
+        self.entries = list(entries)
+        self._keys = []
+        tokens = []
+        for index, entry in enumerate(self.entries):
+            entry_tokens = tokenize(key(entry) if key else entry[1])
+            self._keys.append(' '.join(entry_tokens))
+            tokens.extend((token, index) for token in set(entry_tokens))
+        tokens.sort()
+        self._tokens = [token for token, index in tokens]
+        self._token_entries = [index for token, index in tokens]
+        # entries sorted by normalized label, used to order the matches and to
+        # resolve the whole query as a label prefix
+        self._sorted = sorted(range(len(self.entries)), key=self._keys.__getitem__)
+        self._sorted_keys = [self._keys[index] for index in self._sorted]
+        self._position = [0] * len(self.entries)
+        for position, index in enumerate(self._sorted):
+            self._position[index] = position
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _prefix_range(keys, prefix):
+        start = bisect.bisect_left(keys, prefix)
+        return start, bisect.bisect_left(keys, prefix + '\uffff', start)
+
+    def _prefix_lookup(self, word):
+        start, stop = self._prefix_range(self._tokens, word)
+        return set(self._token_entries[start:stop])
+
+    def _match(self, words, candidates):
+        """ Return the candidates matching all the words, split in three sets
+            ordered by relevance: the whole query starts the label, every word
+            starts a token, some word only appears inside the label.
+        """
+        keys = self._keys
+        prefixed, inside = set(candidates), set()
+        for word in words:
+            hits = self._prefix_lookup(word)
+            misses = (prefixed | inside) - hits
+            inside &= hits
+            prefixed &= hits
+            if len(word) >= 3:
+                inside.update(index for index in misses if word in keys[index])
+            if not prefixed and not inside:
+                return []
+        start, stop = self._prefix_range(self._sorted_keys, ' '.join(words))
+        phrase = set(self._sorted[start:stop]) & (prefixed | inside)
+        return [phrase, prefixed - phrase, inside - phrase]
+
+    def search(self, query, predicate=None, limit=None, offset=0):
+        """ Return the entries matching ``query`` ordered by relevance then label.
+
+            :param predicate: optional callable restricting the entries considered
+        """
+        words = tokenize(query)
+        candidates = range(len(self.entries))
+        if words and len(words[0]) < 3:
+            # too short to match inside a label, only the token prefix counts
+            candidates = sorted(self._prefix_lookup(words[0]))
+        if predicate:
+            candidates = [index for index in candidates if predicate(self.entries[index])]
+        buckets = self._match(words, candidates) if words else [candidates]
+        wanted = offset + limit if limit else None
+        ordered = []
+        for bucket in buckets:
+            if wanted:
+                ordered += heapq.nsmallest(wanted - len(ordered), bucket, key=self._position.__getitem__)
+                if len(ordered) >= wanted:
+                    break
+            else:
+                ordered += sorted(bucket, key=self._position.__getitem__)
+        return [self.entries[index] for index in ordered[offset:]]
+
+
+# parts of the 23 digits of a process number (radicado): name, start, stop
+PROCESS_NUMBER_PARTS = [
+    ('city', 0, 5),
+    ('entity', 5, 7),
+    ('specialty', 7, 9),
+    ('judged', 9, 12),
+    ('year', 12, 16),
+    ('consecutive', 16, 21),
+    ('instance', 21, 23),
+]
+PROCESS_NUMBER_LENGTH = 23
+
+
+def split_process_number(number):
+    """ Split a process number in its parts, None when it has not 23 characters. """
+    number = number or ''
+    if len(number) != PROCESS_NUMBER_LENGTH:
+        return None
+    return {name: number[start:stop] for name, start, stop in PROCESS_NUMBER_PARTS}
@@ -10,6 +10,8 @@ import logging
 import re
 import smtplib
 import threading
+import time
+from collections import defaultdict
 
 import html2text
 
@@ -21,6 +23,70 @@ _logger = logging.getLogger(__name__)
 _test_logger = logging.getLogger('odoo.tests')
 
 SMTP_TIMEOUT = 60
+# pooled sessions idle for longer than that are checked with NOOP before reuse
+SMTP_POOL_NOOP_AFTER = 10
+
+
+def _close_smtp(smtp):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        # already closed by the server
+        pass
+
+
+class SmtpConnectionPool(object):
+    """ Authenticated SMTP sessions of the worker, by (database, mail
+        server id), reused by send_email when the caller gives no session.
+
+        A session is used by one thread at a time: checkout() takes it out
+        of the pool and checkin() gives it back once the mail is sent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+
+    def checkout(self, key, idle_timeout):
+        """ :return: a live session of ``key`` or None """
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    return None
+                smtp, last_used = sessions.pop()
+            idle = time.time() - last_used
+            if idle > idle_timeout:
+                _close_smtp(smtp)
+                continue
+            if idle < SMTP_POOL_NOOP_AFTER:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            _close_smtp(smtp)
+
+    def checkin(self, key, smtp, max_size):
+        with self._lock:
+            sessions = self._idle[key]
+            if len(sessions) < max_size:
+                sessions.append((smtp, time.time()))
+                return
+        _close_smtp(smtp)
+
+    def clear(self, dbname, server_ids=None):
+        """ Close the sessions of ``server_ids`` (all when None) of ``dbname``. """
+        with self._lock:
+            keys = [key for key in self._idle if key[0] == dbname and (server_ids is None or key[1] in server_ids)]
+            sessions = [session for key in keys for session in self._idle.pop(key)]
+        for smtp, last_used in sessions:
+            _close_smtp(smtp)
+
+
+smtp_pool = SmtpConnectionPool()
+
 
 class MailDeliveryException(except_orm):
     """Specific exception subclass for mail delivery errors"""
@@ -132,6 +198,92 @@ class IrMailServer(models.Model):
     smtp_user = fields.Char(groups='base.group_system,base.group_user')
     smtp_pass = fields.Char(groups='base.group_system,base.group_user')
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(IrMailServer, self).create(vals_list)
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super(IrMailServer, self).write(vals)
+        # servers, users and logins are part of _get_user_routing
+        self.clear_caches()
+        # pooled sessions may use the previous host or credentials
+        smtp_pool.clear(self.env.cr.dbname, self.ids)
+        return res
+
+    def unlink(self):
+        smtp_pool.clear(self.env.cr.dbname, self.ids)
+        res = super(IrMailServer, self).unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    def _pool_checkout(self, mail_server_id):
+        """ A live pooled session of ``mail_server_id``, or None. Sessions
+            idle for more than smtp_by_user.smtp_pool_idle_timeout seconds
+            are closed instead. """
+        idle_timeout = int(self.env['ir.config_parameter'].sudo().get_param('smtp_by_user.smtp_pool_idle_timeout', 60))
+        return smtp_pool.checkout((self.env.cr.dbname, mail_server_id), idle_timeout)
+
+    @api.model
+    def _pool_checkin(self, mail_server_id, smtp):
+        """ Give a session back to the pool, which keeps up to
+            smtp_by_user.smtp_pool_size sessions per server. """
+        pool_size = int(self.env['ir.config_parameter'].sudo().get_param('smtp_by_user.smtp_pool_size', 2))
+        smtp_pool.checkin((self.env.cr.dbname, mail_server_id), smtp, pool_size)
+
+    def _send_pooled(self, mail_server_id, smtp_from, smtp_to_list, message):
+        """ Send ``message`` on a pooled session of ``mail_server_id``,
+            opened when the pool has none. A reused session closed by the
+            server meanwhile is replaced once by a new one. """
+        smtp = self._pool_checkout(mail_server_id)
+        reused = bool(smtp)
+        try:
+            smtp = smtp or self.connect(mail_server_id=mail_server_id)
+            try:
+                smtp.sendmail(smtp_from, smtp_to_list, message.as_string())
+            except smtplib.SMTPServerDisconnected:
+                if not reused:
+                    raise
+                _logger.info('Pooled SMTP session of mail server #%s was closed, reconnecting', mail_server_id)
+                smtp = None
+                smtp = self.connect(mail_server_id=mail_server_id)
+                smtp.sendmail(smtp_from, smtp_to_list, message.as_string())
+        except Exception:
+            if smtp:
+                _close_smtp(smtp)
+            raise
+        self._pool_checkin(mail_server_id, smtp)
+
+    @api.model
+    @tools.ormcache()
+    def _get_user_routing(self):
+        """ Outgoing server of each user, kept in the registry cache of each
+            worker. When a user belongs to several servers the last one in
+            the servers order is used.
+
+            :return: ({user id: (server id, smtp login)}, (server id, smtp login)
+                     of the default server or None)
+        """
+        servers = self.sudo().search([])
+        routing = {}
+        for server in servers.read(['user_ids', 'smtp_user']):
+            for user_id in server['user_ids']:
+                routing[user_id] = (server['id'], server['smtp_user'])
+        default = self.sudo().search([('is_default_server', '=', True)], limit=1)
+        return routing, (default.id, default.smtp_user) if default else None
+
+    @api.model
+    def _get_user_mail_servers(self, user_ids):
+        """ Outgoing server of several users, the default server for the
+            users without their own.
+
+            :return: {user id: (server id, smtp login) or None}
+        """
+        routing, default = self._get_user_routing()
+        return {user_id: routing.get(user_id, default) for user_id in user_ids}
+
     def build_email(self, email_from, email_to, subject, body, email_cc=None, email_bcc=None, reply_to=False,
                 attachments=None, message_id=None, references=None, object_id=False, subtype='plain', headers=None,
                 body_alternative=None, subtype_alternative='plain'):
@@ -327,6 +479,10 @@ class IrMailServer(models.Model):
 
         try:
             message_id = message['Message-Id']
+            if not smtp_session and mail_server_id and not smtp_debug:
+                # interactive sends reuse the sessions of the worker pool
+                self._send_pooled(mail_server_id, smtp_from, smtp_to_list, message)
+                return message_id
             smtp = smtp_session
             smtp = smtp or self.connect(
                 smtp_server, smtp_port, smtp_user, smtp_password,
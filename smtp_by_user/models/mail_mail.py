@@ -4,45 +4,92 @@ import logging
 import psycopg2
 import smtplib
 import threading
+import time
 import re
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from odoo import _, api, fields, models
 from odoo import tools
+from odoo.osv import expression
 from odoo.addons.base.models.ir_mail_server import MailDeliveryException
 from odoo.tools.safe_eval import safe_eval
 
 _logger = logging.getLogger(__name__)
 
+# temporary SMTP errors meaning the server limits our rate
+THROTTLED_RE = re.compile(r"\((421|450|451|452),|too many|rate limit|try again later", re.I)
+# a batch sent faster than that grows, see MailMail._drain_server
+BATCH_TARGET_SECONDS = 10
+# current batch size by (database, mail server), kept between the runs of the queue
+_batch_sizes = {}
+# lanes of the queue, drained in this order; the context key mail_priority
+# sets the lane of the mails created with it
+MAIL_PRIORITIES = [
+    ('0', 'Urgent'),
+    ('1', 'High'),
+    ('2', 'Normal'),
+    ('3', 'Bulk'),
+]
+# (minute, mails sent) by (database, mail server, lane) in this worker process,
+# see MailMail._within_lane_budget
+_lane_usage = {}
+
+
+def _quit(smtp_session):
+    try:
+        smtp_session.quit()
+    except (smtplib.SMTPException, OSError):
+        # already closed by the server
+        pass
+
 
 class MailMail(models.Model):
     _inherit = 'mail.mail'
 
-    @api.model
-    def create(self, values):
-        # notification field: if not set, set if mail comes from an existing mail.message
-        if 'notification' not in values and values.get('mail_message_id'):
-            values['notification'] = True
+    priority = fields.Selection(MAIL_PRIORITIES, 'Priority', default='2', required=True, index=True,
+                                help='Lane of the outgoing queue, urgent mails are sent first.')
 
-        outgoing_obj = None
-        #create_user = self.create_uid.id if self.create_uid else self.env.uid
-        for server_id in self.env['ir.mail_server'].search([]):
-            for user_id in server_id.user_ids:
-                if self.env.uid == user_id.id:
-                    outgoing_obj = server_id
+    @api.model_create_multi
+    def create(self, values_list):
+        # the mails of a batch are created by the same user, its server is looked up once
+        outgoing = self.env['ir.mail_server']._get_user_mail_servers([self.env.uid])[self.env.uid]
+        for values in values_list:
+            # notification field: if not set, set if mail comes from an existing mail.message
+            if 'notification' not in values and values.get('mail_message_id'):
+                values['notification'] = True
+            if 'priority' not in values and self._context.get('mail_priority'):
+                values['priority'] = self._context['mail_priority']
+            if outgoing:
+                values['mail_server_id'], values['email_from'] = outgoing
 
-        if not outgoing_obj:
-            outgoing_obj = self.env['ir.mail_server'].search([('is_default_server','=',True)],limit=1)
+        new_mails = super(MailMail, self).create(values_list)
+        new_mails_w_attach = self
+        for mail, values in zip(new_mails, values_list):
+            if values.get('attachment_ids'):
+                new_mails_w_attach += mail
+        if new_mails_w_attach:
+            new_mails_w_attach.mapped('attachment_ids').check(mode='read')
+        return new_mails
 
-        if outgoing_obj:
-            values['mail_server_id'] = outgoing_obj.id
-            values['email_from'] = outgoing_obj.smtp_user
+    def _split_by_user_server(self):
+        """ Like _split_by_server, with the outgoing server of the creator
+            of each mail.
 
-        new_mail = super(MailMail, self).create(values)
-        if values.get('attachment_ids'):
-            new_mail.attachment_ids.check(mode='read')
-        return new_mail
+            :return: iterator of (server id or None, batch of mail ids)
+        """
+        by_user = defaultdict(list)
+        for mail in self.sudo().read(['create_uid'], load=None):
+            by_user[mail['create_uid']].append(mail['id'])
+        servers = self.env['ir.mail_server']._get_user_mail_servers(list(by_user))
+        by_server = defaultdict(list)
+        for user_id, mail_ids in by_user.items():
+            by_server[servers[user_id] and servers[user_id][0]].extend(mail_ids)
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('mail.session.batch.size', 1000)) or 1000
+        for server_id, mail_ids in by_server.items():
+            for batch_ids in tools.split_every(batch_size, mail_ids):
+                yield server_id, batch_ids
 
 
     def send(self, auto_commit=False, raise_exception=False):
@@ -60,21 +107,13 @@ class MailMail(models.Model):
                 email sending process has failed
             :return: True
         """
-        for server_id, batch_ids in self._split_by_server():
+        MailServer = self.env['ir.mail_server']
+        for server_id, batch_ids in self._split_by_user_server():
             smtp_session = None
             try:
-                for rec in self:
-                    outgoing_obj = None
-                    for server_id in self.env['ir.mail_server'].search([]):
-                        for user_id in server_id.user_ids:
-                            if rec.create_uid.id == user_id.id:
-                                outgoing_obj = server_id
-
-                    if not outgoing_obj:
-                        outgoing_obj = self.env['ir.mail_server'].search([('is_default_server','=',True)],limit=1)
-
-                    server_id = outgoing_obj.id
-                    smtp_session = self.env['ir.mail_server'].connect(mail_server_id=server_id)
+                # the invitations sent right away reuse the sessions of the worker
+                smtp_session = server_id and MailServer._pool_checkout(server_id)
+                smtp_session = smtp_session or MailServer.connect(mail_server_id=server_id)
             except Exception as exc:
                 if raise_exception:
                     # To be consistent and backward compatible with mail_mail.send() raised
@@ -85,19 +124,212 @@ class MailMail(models.Model):
                     batch.write({'state': 'exception', 'failure_reason': exc})
                     batch._postprocess_sent_message(success_pids=[], failure_type="SMTP")
             else:
-                self.browse(batch_ids)._send(
-                    auto_commit=auto_commit,
-                    raise_exception=raise_exception,
-                    smtp_session=smtp_session)
+                try:
+                    self.browse(batch_ids)._send(
+                        auto_commit=auto_commit,
+                        raise_exception=raise_exception,
+                        smtp_session=smtp_session)
+                except Exception:
+                    # do not give a broken session back to the pool
+                    _quit(smtp_session)
+                    smtp_session = None
+                    raise
                 _logger.info(
                     'Sent batch %s emails via mail server ID #%s',
                     len(batch_ids), server_id)
             finally:
-                if smtp_session:
-                    smtp_session.quit()
+                if smtp_session and server_id:
+                    MailServer._pool_checkin(server_id, smtp_session)
+                elif smtp_session:
+                    _quit(smtp_session)
 
+    @api.model
+    def _queue_domain(self, server_id):
+        """ Outgoing mails of ``server_id`` (False for the mails without
+            server) that are due, restricted by the ``filters`` of the context. """
+        domain = [
+            ('state', '=', 'outgoing'),
+            ('mail_server_id', '=', server_id),
+            '|',
+            ('scheduled_date', '<', datetime.datetime.now()),
+            ('scheduled_date', '=', False),
+        ]
+        if 'filters' in self._context:
+            domain = expression.AND([domain, self._context['filters']])
+        return domain
 
+    @api.model
+    def _lane_limits(self):
+        """ :return: {lane: mails per minute and mail server, 0 when unlimited},
+            from the smtp_by_user.lane_rate_limit.<lane> parameters
 
+            The mails sent are counted by each worker process, the limit holds
+            as long as the queue is drained by a single cron worker at a time.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        return {
+            lane: int(ICP.get_param('smtp_by_user.lane_rate_limit.%s' % lane, 0))
+            for lane, label in MAIL_PRIORITIES
+        }
+
+    def _within_lane_budget(self, server_id, limits):
+        """ Mails of ``self`` that the rate limit of their lane still allows
+            to send through ``server_id`` in the current minute; they are
+            counted once sent, see _charge_lane_budget. """
+        minute = int(time.time() // 60)
+        used = {}
+        allowed = []
+        for mail in self:
+            lane = mail.priority
+            if lane not in used:
+                window, count = _lane_usage.get((self.env.cr.dbname, server_id, lane), (minute, 0))
+                used[lane] = count if window == minute else 0
+            if limits.get(lane) and used[lane] >= limits[lane]:
+                continue
+            used[lane] += 1
+            allowed.append(mail.id)
+        return self.browse(allowed)
+
+    @api.model
+    def _charge_lane_budget(self, server_id, lanes):
+        """ Count the mails sent through ``server_id`` in the current minute,
+            ``lanes`` holding the lane of each of them. """
+        minute = int(time.time() // 60)
+        for lane in lanes:
+            key = (self.env.cr.dbname, server_id, lane)
+            window, count = _lane_usage.get(key, (minute, 0))
+            _lane_usage[key] = (minute, (count if window == minute else 0) + 1)
+
+    @api.model
+    def _exhausted_lanes(self, server_id, limits):
+        """ Lanes that sent their limit through ``server_id`` this minute. """
+        minute = int(time.time() // 60)
+        exhausted = []
+        for lane, limit in limits.items():
+            window, count = _lane_usage.get((self.env.cr.dbname, server_id, lane), (minute, 0))
+            if limit and window == minute and count >= limit:
+                exhausted.append(lane)
+        return exhausted
+
+    @api.model
+    def _queue_metrics(self):
+        """ Depth of the outgoing queue by lane.
+
+            :return: {lane: (number of outgoing mails, age in seconds of the oldest one)}
+        """
+        self.flush(['state', 'priority'])
+        self.env.cr.execute("""
+            SELECT priority, count(*), EXTRACT(EPOCH FROM (now() at time zone 'UTC') - min(create_date))
+            FROM mail_mail
+            WHERE state = 'outgoing'
+            GROUP BY priority
+        """)
+        return {lane: (count, int(age or 0)) for lane, count, age in self.env.cr.fetchall()}
+
+    @api.model
+    def _drain_server(self, server_id, deadline):
+        """ Send the due mails of ``server_id`` until there are none left,
+            ``deadline`` is reached or the server throttles us.
+
+            The SMTP session is kept across batches until it has sent
+            smtp_by_user.session_max_messages mails or has been open for
+            smtp_by_user.session_max_seconds. The batch size starts at
+            mail.session.batch.size and adapts to the server: it doubles
+            while batches are sent in less than BATCH_TARGET_SECONDS, up to
+            smtp_by_user.max_batch_size, and halves when a batch is slow,
+            the session is dropped or the server answers with a temporary
+            error (the mails are then queued again for the next run).
+
+            Mails are taken by priority, then by scheduled date; a lane that
+            sent smtp_by_user.lane_rate_limit.<lane> mails in the current
+            minute waits for the next one (see _within_lane_budget).
+
+            :return: number of mails sent or failed
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        batch_key = (self.env.cr.dbname, server_id)
+        batch_size = _batch_sizes.get(batch_key) or int(ICP.get_param('mail.session.batch.size', 22))
+        max_batch_size = int(ICP.get_param('smtp_by_user.max_batch_size', 200))
+        session_max_messages = int(ICP.get_param('smtp_by_user.session_max_messages', 500))
+        session_max_seconds = int(ICP.get_param('smtp_by_user.session_max_seconds', 300))
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        lane_limits = self._lane_limits()
+
+        smtp_session = None
+        session_count = session_start = 0
+        done = 0
+        try:
+            while time.time() < deadline:
+                domain = self._queue_domain(server_id)
+                exhausted = self._exhausted_lanes(server_id, lane_limits)
+                if exhausted:
+                    domain = expression.AND([domain, [('priority', 'not in', exhausted)]])
+                mails = self.search(domain, order='priority, scheduled_date asc, id', limit=batch_size)
+                mails = mails._within_lane_budget(server_id, lane_limits)
+                if not mails:
+                    break
+                if smtp_session and (session_count >= session_max_messages or time.time() - session_start > session_max_seconds):
+                    _quit(smtp_session)
+                    smtp_session = None
+                if not smtp_session:
+                    try:
+                        smtp_session = self.env['ir.mail_server'].connect(mail_server_id=server_id)
+                    except Exception as exc:
+                        _logger.warning('Unable to connect to mail server #%s: %s', server_id, exc)
+                        mails.write({'state': 'exception', 'failure_reason': exc})
+                        mails._postprocess_sent_message(success_pids=[], failure_type="SMTP")
+                        done += len(mails)
+                        break
+                    session_count, session_start = 0, time.time()
+
+                # the mails sent with auto_delete are unlinked by _send
+                lanes = {mail.id: mail.priority for mail in mails}
+                started = time.time()
+                try:
+                    mails._send(auto_commit=auto_commit, raise_exception=False, smtp_session=smtp_session)
+                except smtplib.SMTPServerDisconnected:
+                    # the mails not sent yet are still outgoing, retry them on a new session
+                    _logger.info('Mail server #%s closed the session, reconnecting', server_id)
+                    self.env.cr.rollback()
+                    self.invalidate_cache()
+                    smtp_session = None
+                    batch_size = max(1, batch_size // 2)
+                    continue
+
+                unsent = mails.exists().filtered(lambda mail: mail.state != 'sent')
+                unsent_ids = set(unsent.ids)
+                self._charge_lane_budget(server_id, [lane for mail_id, lane in lanes.items() if mail_id not in unsent_ids])
+                throttled = unsent.filtered(
+                    lambda mail: mail.state == 'exception' and THROTTLED_RE.search(mail.failure_reason or ''))
+                if throttled:
+                    throttled.write({'state': 'outgoing', 'failure_reason': False})
+                    _logger.info('Mail server #%s throttled %s mails, they are sent on the next run', server_id, len(throttled))
+                    batch_size = max(1, batch_size // 2)
+                done += len(mails) - len(throttled)
+                session_count += len(mails)
+                if auto_commit:
+                    self.env.cr.commit()
+                self.invalidate_cache()
+                if throttled:
+                    break
+                elapsed = time.time() - started
+                if elapsed < BATCH_TARGET_SECONDS:
+                    batch_size = min(max_batch_size, batch_size * 2)
+                elif elapsed > 2 * BATCH_TARGET_SECONDS:
+                    batch_size = max(1, batch_size // 2)
+        finally:
+            if smtp_session:
+                _quit(smtp_session)
+            _batch_sizes[batch_key] = batch_size
+        if done:
+            _logger.info('Sent %s emails via mail server ID #%s', done, server_id)
+        return done
+
+    def _dispatch_server(self, server_id, deadline):
+        """ _drain_server on a cursor of its own, run by the dispatcher threads. """
+        with api.Environment.manage(), self.pool.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            return env[self._name]._drain_server(server_id, deadline)
 
     @api.model
     def process_email_queue(self, ids=None):
@@ -105,6 +337,12 @@ class MailMail(models.Model):
            message is sent - this is not transactional and should
            not be called during another transaction!
 
+           The queue of each active mail server, and the one of the mails
+           without server, is drained by a thread of its own (at most
+           smtp_by_user.dispatcher_workers threads) for up to
+           smtp_by_user.queue_time_limit seconds, see _drain_server. The
+           depth of each lane of the queue is logged on each run.
+
            :param list ids: optional list of emails ids to send. If passed
                             no search is performed, and these ids are used
                             instead.
@@ -114,50 +352,38 @@ class MailMail(models.Model):
                                 messages to send (by default all 'outgoing'
                                 messages are sent).
         """
-        res = None
-        for server_id in self.env['ir.mail_server'].search([('active','=',True)]):
-            smtp_session = None
-            raise_exception=False
-            if not self.ids:
-                batch_total_max = 0
-                sys_params = self.env['ir.config_parameter'].sudo()
-                limit = int(sys_params.get_param('mail.session.batch.size', 22))
-                ids = []
-                _logger.info("======= sending emails with limit=%s" % limit)
-                filters = ['&','&',
-                           ('state', '=', 'outgoing'),
-                           ('mail_server_id', '=', server_id.id),
-                           '|',
-                           ('scheduled_date', '<', datetime.datetime.now()),
-                           ('scheduled_date', '=', False)]
-                if 'filters' in self._context:
-                    filters.extend(self._context['filters'])
-                ids = self.search(filters, order='scheduled_date asc', limit=int(limit)).ids
-                #ids.sort()
-                _logger.error('*********** PROCESANDO SERVER MAIL RECORDS ************')
-                _logger.error(ids)
-
-            if ids:
-                try:
-                    smtp_session = self.env['ir.mail_server'].connect(mail_server_id=server_id.id)
-                except Exception as exc:
-                    if raise_exception:
-                        # To be consistent and backward compatible with mail_mail.send() raised
-                        # exceptions, it is encapsulated into an Odoo MailDeliveryException
-                        raise MailDeliveryException(_('Unable to connect to SMTP Server'), exc)
-                    else:
-                        batch = self.browse(ids)
-                        batch.write({'state': 'exception', 'failure_reason': exc})
-                        batch._postprocess_sent_message(success_pids=[], failure_type="SMTP")
-                else:
-                    auto_commit = not getattr(threading.currentThread(), 'testing', False)
-                    self.browse(ids)._send(
-                        auto_commit=auto_commit,
-                        raise_exception=raise_exception,
-                        smtp_session=smtp_session)
-                    _logger.info(
-                        'Sent batch %s emails via mail server ID #%s',
-                        len(ids), server_id)
-                finally:
-                    if smtp_session:
-                        smtp_session.quit()
+        if ids or self.ids:
+            auto_commit = not getattr(threading.currentThread(), 'testing', False)
+            return self.browse(ids or self.ids).send(auto_commit=auto_commit)
+
+        ICP = self.env['ir.config_parameter'].sudo()
+        deadline = time.time() + int(ICP.get_param('smtp_by_user.queue_time_limit', 50))
+        metrics = self._queue_metrics()
+        if metrics:
+            labels = dict(MAIL_PRIORITIES)
+            _logger.info('Mail queue depth: %s', ', '.join(
+                '%s %s (oldest %ss)' % (labels.get(lane, lane), count, age)
+                for lane, (count, age) in sorted(metrics.items())))
+        workers = int(ICP.get_param('smtp_by_user.dispatcher_workers', 8))
+        domain = [('state', '=', 'outgoing')]
+        if 'filters' in self._context:
+            domain = expression.AND([domain, self._context['filters']])
+        active_ids = set(self.env['ir.mail_server'].search([('active', '=', True)]).ids)
+        server_ids = [
+            group['mail_server_id'] and group['mail_server_id'][0]
+            for group in self.read_group(domain, ['mail_server_id'], ['mail_server_id'])
+        ]
+        server_ids = [server_id for server_id in server_ids if not server_id or server_id in active_ids]
+        if not server_ids:
+            return 0
+        if workers <= 1 or len(server_ids) == 1 or getattr(threading.currentThread(), 'testing', False):
+            return sum(self._drain_server(server_id, deadline) for server_id in server_ids)
+        with ThreadPoolExecutor(max_workers=min(workers, len(server_ids)), thread_name_prefix='mail_dispatcher') as executor:
+            futures = [executor.submit(self._dispatch_server, server_id, deadline) for server_id in server_ids]
+        done = 0
+        for server_id, future in zip(server_ids, futures):
+            try:
+                done += future.result()
+            except Exception:
+                _logger.exception('Sending the emails of mail server #%s failed', server_id)
+        return done